@@ -0,0 +1,23 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+"""
+
+from mcm.sdos.service import asyncServer
+
+
+"""
+	One process serves many concurrent clients on an event loop; blocking work runs on the executor.
+	See async_executor_workers in the configuration
+"""
+
+asyncServer.run()
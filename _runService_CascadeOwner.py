@@ -0,0 +1,23 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+"""
+
+from mcm.sdos.parallelExecution import CascadeOwner
+
+
+"""
+	Run the cascade owner on its own, for servers with cascade_mode "owner" that are not started
+	through config_gunicorn.py
+"""
+
+CascadeOwner.serve()
@@ -0,0 +1,22 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+"""
+
+from mcm.sdos.service import sharding
+
+
+"""
+	Multi-process server for cascade_mode "sharded"; each container's key cascade lives in exactly one process
+"""
+
+sharding.run()
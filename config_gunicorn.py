@@ -13,14 +13,29 @@ from mcm.sdos import configuration
 import multiprocessing
 
 bind = "{}:{}".format(configuration.my_bind_host, configuration.my_endpoint_port)
-# workers = multiprocessing.cpu_count() * 2 + 1
-# workers = workers * 1
-# gunicorn runs multi-process; this currently does not work with the Key Cascade due to the need for locking
-# which we can only do in a multi-thread, but no multi-process scenario
-workers = 1
+# gunicorn runs multi-process; the Key Cascade needs locking which we can only do in a multi-thread,
+# but no multi-process scenario. With cascade_mode "owner", the cascades live in a separate process
+# that is started by the master (on_starting) and the workers are stateless.
+# cascade_mode "sharded" (_runService_Sharded.py) uses the other settings for each shard, with a single worker
+if configuration.cascade_mode == "owner":
+    workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    workers = 1
 timeout = 600
 graceful_timeout = 800
 worker_class = "gevent"
 # worker_class = "eventlet"
 # worker_class = "geventwebsocket.gunicorn.workers.GeventWebSocketWorker"
-#worker_class = "egg:meinheld#gunicorn_worker"
\ No newline at end of file
+#worker_class = "egg:meinheld#gunicorn_worker"
+
+
+def on_starting(server):
+    if configuration.cascade_mode == "owner":
+        from mcm.sdos.parallelExecution import CascadeOwner
+        CascadeOwner.start()
+
+
+def on_exit(server):
+    if configuration.cascade_mode == "owner":
+        from mcm.sdos.parallelExecution import CascadeOwner
+        CascadeOwner.stop()
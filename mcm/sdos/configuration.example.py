@@ -53,6 +53,109 @@ my_bind_host = "0.0.0.0"
 
 my_endpoint_store_url = "http://{}:{}/v1/AUTH_{}".format(my_endpoint_host, my_endpoint_port, "{}")
 
+"""
+the SDOS properties of SDOS containers are cached for this many seconds; non-SDOS containers are looked up
+on every request. Changes to a container made through this proxy take effect immediately in the worker process
+that forwarded them; with several processes (gunicorn workers, sharded mode) the other processes may use
+the old properties until they expire
+"""
+container_properties_ttl = 30
+
+"""
+requests for SDOS containers are only served with a token that swift accepted (HEAD on the account) within
+this many seconds. A revoked token may be used with the key cascades until then
+"""
+token_validity_ttl = 30
+
+"""
+the frontends/key cascades of containers are unloaded (after flushing their changes to swift) when they were
+not used for fe_pool_idle_timeout seconds. The least recently used ones are also unloaded while more than
+fe_pool_max_entries are loaded or while the estimated memory of all cascades exceeds fe_pool_memory_budget bytes.
+swift connections per tenant/token are dropped in the same way.
+the pools are checked every pool_janitor_interval seconds
+"""
+fe_pool_idle_timeout = 3600
+fe_pool_max_entries = 1000
+fe_pool_memory_budget = 1024 * 1024 * 1024
+swift_pool_idle_timeout = 3600
+swift_pool_max_entries = 10000
+pool_janitor_interval = 60
+
+"""
+memory bounds of each cascade: resolved object keys (number of keys; 0 disables the cache) and cached partitions
+(bytes; 0 is unbounded). containers can override them with the headers
+X-Container-Meta-Sdosobjectkeycachesize and X-Container-Meta-Sdospartitioncachesize
+"""
+object_key_cache_size = 4096
+partition_cache_size = 64 * 1024 * 1024
+
+"""
+connections to swift are kept alive and re-used. http_pool_maxsize connections are kept per backend host;
+connections that were not used for http_pool_idle_timeout seconds are dropped
+"""
+http_pool_maxsize = 32
+http_pool_idle_timeout = 60
+
+"""
+object data is streamed between client, SDOS and swift; it is en/decrypted in chunks of this size (bytes).
+this bounds the memory used per request
+"""
+stream_chunk_size = 64 * 1024
+
+"""
+the chunks of large objects are en/decrypted in parallel on a pool of workers.
+crypto_pool_type: None (en/decrypt on the request thread), "thread" or "process"
+"thread" applies to the servers that use real threads: the threaded flask servers (_runService_Production.py,
+_runService_Development.py), the async server and the sharded server. the cipher releases the GIL, so threads
+use multiple cores.
+The gevent server (config_gunicorn.py) replaces threads with greenlets, so a thread pool only adds overhead
+there; use "process" or None
+"""
+crypto_pool_type = None
+crypto_pool_workers = os.cpu_count()
+
+"""
+segments of large objects (SLO/DLO) are fetched and decrypted concurrently by this many workers per request.
+each of them reads ahead at most segment_readahead_chunks chunks (of about stream_chunk_size bytes) of its segment
+"""
+segment_fetch_workers = 4
+segment_readahead_chunks = 16
+
+"""
+AES implementation: "pycrypto" or "openssl" (requires the cryptography package).
+None selects the fastest available one at startup; see tester/CryptoBenchmark.py
+"""
+crypto_backend = None
+
+"""
+the asyncio server (_runService_Async.py) runs key cascade operations and en/decryption on a thread pool
+of this size; requests to swift and unencrypted data are handled on the event loop
+"""
+async_executor_workers = 32
+
+"""
+the key cascades use in-process locks.
+cascade_mode "local": each server process has its own cascades; only a single process may be used
+cascade_mode "owner": one cascade owner process (started by config_gunicorn.py or _runService_CascadeOwner.py)
+holds the cascades; the worker processes send key lookups, allocations and deletes to it over local IPC
+and en/decrypt the object data themselves. This allows multiple gunicorn workers
+cascade_mode "sharded": _runService_Sharded.py starts sharded_workers processes; each cascade is owned by one
+of them (consistent hashing on tenant/container) and requests are forwarded to the owner on its internal port
+sharded_internal_port_base + worker index. Each of them is a gunicorn server with one worker and the other
+settings from config_gunicorn.py
+"""
+cascade_mode = os.getenv("SDOS_CASCADE_MODE", "local")
+cascade_owner_address = ("127.0.0.1", 4001)
+"""
+the workers authenticate to the cascade owner with this secret; anyone who knows it can read keys and run code in
+the owner process. Leave it unset when the owner is started by config_gunicorn.py, then a random one is generated
+on every start and inherited by the workers. A separately started owner (_runService_CascadeOwner.py) and its
+workers require a configured, random secret, e.g. from: python -c "import secrets; print(secrets.token_hex(32))"
+"""
+cascade_owner_authkey = os.getenv("SDOS_CASCADE_OWNER_AUTHKEY", "").encode("utf-8") or None
+sharded_workers = os.cpu_count()
+sharded_internal_port_base = 4100
+
 
 """
 ################################################################################
@@ -14,9 +14,12 @@
 import logging
 import math
 
+from sdos.core import SlotPlacement
+
 
 class CascadeProperties(object):
     PREFIX_MCM_INTERNAL = '_mcm-internal_{}'
+    MAX_REKEY_WORKERS = 32
 
     def __init__(self, container_name,
                  partition_bits=8,
@@ -24,16 +27,26 @@ class CascadeProperties(object):
                  master_key_type=None,
                  tpm_key_id=None,
                  use_partition_cache=True,
-                 use_batch_delete=False):
+                 use_batch_delete=False,
+                 object_key_cache_size=4096,
+                 partition_cache_size=64 * 1024 * 1024,
+                 rekey_workers=1,
+                 slot_placement=None):
         """
         	Key Cascade geometry / parameters
         	PARTITION_BITS8 # 256 slots for 8 bit, 4 slots for 2 bit
         	TREE_HEIGHT # height doesn't include the root
         	BYTES_FOR_NAME_LENGTH = 2  # allows names to be 65536 characters long
+
+        	Runtime parameters
+        	object_key_cache_size # max. number of resolved object keys kept in memory; 0 disables the cache
+        	partition_cache_size # max. bytes of (encrypted and decrypted) partitions kept in memory; 0 is unbounded
+        	rekey_workers # number of threads that re-key the partitions of one cascade level in parallel (1..MAX_REKEY_WORKERS)
+        	slot_placement # policy for co-locating new objects that will likely be deleted together, see SlotPlacement
         """
         b = int(partition_bits)
         h = int(tree_height) - 1  # internally we don't count the root
-        self.__validate_properties(b, h)
+        self.__validate_properties(b, h, slot_placement)
 
         self.container_name = container_name
         self.container_name_mgmt = self.PREFIX_MCM_INTERNAL.format(self.container_name)
@@ -42,6 +55,12 @@ class CascadeProperties(object):
         self.use_partition_cache = use_partition_cache
         self.use_batch_delete = use_batch_delete
         self.tpm_key_id = tpm_key_id
+        self.object_key_cache_size = max(0, int(object_key_cache_size))
+        self.partition_cache_size = max(0, int(partition_cache_size))
+        self.rekey_workers = min(max(1, int(rekey_workers)), self.MAX_REKEY_WORKERS)
+        if self.rekey_workers != int(rekey_workers):
+            logging.warning("rekey_workers {} out of range, using {}".format(rekey_workers, self.rekey_workers))
+        self.slot_placement = slot_placement or SlotPlacement.PLACEMENT_LOWEST
 
         self.PARTITION_BITS = b
         self.TREE_HEIGHT = h
@@ -75,7 +94,9 @@ class CascadeProperties(object):
         logging.info(
             'object key IDs are in the range {}..{}'.format(self.FIRST_OBJECT_KEY_SLOT, self.LAST_OBJCT_KEY_SLOT))
 
-    def __validate_properties(self, partition_bits, tree_height):
+    def __validate_properties(self, partition_bits, tree_height, slot_placement):
         if not (partition_bits >= 2 and partition_bits < 32 and tree_height > 0 and tree_height < 64):
             raise ValueError(
                 "Cascade properties invalid: partition_bits {} -- tree_height {}".format(partition_bits, tree_height))
+        if slot_placement and slot_placement not in SlotPlacement.PLACEMENT_POLICIES:
+            raise ValueError("Cascade properties invalid: slot_placement {}".format(slot_placement))
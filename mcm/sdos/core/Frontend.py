@@ -28,9 +28,10 @@ from mcm.sdos.core.KeyCascade import Cascade
 from mcm.sdos.crypto import CryptoLib
 from mcm.sdos.crypto import DataCrypt
 from mcm.sdos.swift import SwiftBackend
-from sdos.core import MasterKeySource
+from sdos.core import MasterKeySource, SlotPlacement
 from sdos.core.CascadeProperties import CascadeProperties
 from sdos.core.KeyPartitionCache import KeyPartitionCache
+from sdos.parallelExecution.CryptoPool import CryptoPool
 
 
 ###############################################################################
@@ -38,8 +39,14 @@ from sdos.core.KeyPartitionCache import KeyPartitionCache
 
 
 
-def frontendFactory(swift_backend, container_name):
-    p = swift_backend.get_sdos_properties(container_name)
+def frontendFactory(swift_backend, container_name, properties=None):
+    """
+    :param swift_backend:
+    :param container_name:
+    :param properties: the containers SDOS properties, if they are already known. read from swift otherwise
+    :return:
+    """
+    p = properties or swift_backend.get_sdos_properties(container_name)
     # print(p)
     if p["sdos_type"] == "sdos":
 
@@ -48,7 +55,11 @@ def frontendFactory(swift_backend, container_name):
                                               tree_height=p["sdosheight"],
                                               master_key_type=p["sdosmasterkey"],
                                               use_batch_delete=p["sdosbatchdelete"],
-                                              tpm_key_id=p["sdostpmkeyid"])
+                                              tpm_key_id=p["sdostpmkeyid"],
+                                              rekey_workers=p["sdosrekeyworkers"],
+                                              slot_placement=p["sdosslotplacement"],
+                                              object_key_cache_size=p["sdosobjectkeycachesize"],
+                                              partition_cache_size=p["sdospartitioncachesize"])
         swift_backend.create_container_if_not_exists(cascadeProperties.container_name_mgmt)
         key_source = MasterKeySource.masterKeySourceFactory(
             swiftBackend=swift_backend,
@@ -96,6 +107,12 @@ class DirectFrontend(object):
     def finish(self):
         pass
 
+    def close(self):
+        pass
+
+    def getMemoryUsage(self):
+        return 0
+
     def putObject(self, o, name):
         self.si.putObject(container=self.containerName, name=name, dataObject=o)
 
@@ -110,7 +127,62 @@ class DirectFrontend(object):
 ###############################################################################
 
 
-class CryptoFrontend(object):
+class ObjectCryptFrontend(object):
+    """
+    en/decryption of object data, shared by the frontends that encrypt. subclasses provide the keys:
+    get_key_for_new_object(name, headers) and get_key_for_stored_object(name)
+    """
+
+    def encrypt_object(self, o, name, headers=None):
+        key = self.get_key_for_new_object(name, headers)
+        return DataCrypt.DataCrypt(key).encryptBytesIO(plaintext=o)
+
+    def encrypt_bytes_object(self, o, name, headers=None):
+        return self.encrypt_object(o=io.BytesIO(o), name=name, headers=headers).read()
+
+    def encrypt_stream(self, chunks, name, headers=None):
+        """
+        encrypt an object chunk by chunk. the key is retrieved immediately, the data is encrypted while the
+        returned generator is consumed
+        :param chunks: iterable of plaintext bytes
+        :return: generator of ciphertext bytes
+        """
+        key = self.get_key_for_new_object(name, headers)
+        return DataCrypt.DataCrypt(key, CryptoPool()).encryptStream(chunks)
+
+    def decrypt_object(self, c, name):
+        key = self.get_key_for_stored_object(name)
+        return DataCrypt.DataCrypt(key).decryptBytesIO(ciphertext=c)
+
+    def decrypt_bytes_object(self, c, name):
+        return self.decrypt_object(io.BytesIO(c), name).read()
+
+    def decrypt_stream(self, chunks, name):
+        """
+        decrypt an object chunk by chunk
+        :param chunks: iterable of ciphertext bytes
+        :return: generator of plaintext bytes
+        """
+        key = self.get_key_for_stored_object(name)
+        return DataCrypt.DataCrypt(key, CryptoPool()).decryptStream(chunks)
+
+    def decrypt_range_stream(self, head, chunks, name, offset):
+        """
+        decrypt a byte range of a range-readable object, see DataCrypt.decryptRangeStream
+        :param head: the first DataCrypt.HEADER_LENGTH_V2 bytes of the object
+        :param chunks: iterable of ciphertext bytes of the range
+        :param offset: plaintext byte offset of the range
+        :return: generator of plaintext bytes
+        """
+        key = self.get_key_for_stored_object(name)
+        return DataCrypt.DataCrypt(key, CryptoPool()).decryptRangeStream(head, chunks, offset)
+
+
+###############################################################################
+###############################################################################
+
+
+class CryptoFrontend(ObjectCryptFrontend):
     """
     This frontend encrypts the objects with a single master key before storing them.
     When retrieving objects, the same key is used to decrypt the data again.
@@ -134,24 +206,22 @@ class CryptoFrontend(object):
     def finish(self):
         pass
 
-    def encrypt_object(self, o, name):
-        key = self.key_source.get_current_key()
-        return DataCrypt.DataCrypt(key).encryptBytesIO(plaintext=o)
+    def close(self):
+        pass
+
+    def getMemoryUsage(self):
+        return 0
+
+    def get_key_for_new_object(self, name, headers=None):
+        return self.key_source.get_current_key()
 
-    def encrypt_bytes_object(self, o, name):
-        return self.encrypt_object(o=io.BytesIO(o), name=name).read()
+    def get_key_for_stored_object(self, name):
+        return self.key_source.get_current_key()
 
     def putObject(self, o, name):
         c = self.encrypt_object(o=o, name=name)
         self.swift_backend.putObject(self.containerName, name, c,
-                                     headers={"X-Object-Meta-MCM-Content": DataCrypt.HEADER})
-
-    def decrypt_object(self, c, name):
-        key = self.key_source.get_current_key()
-        return DataCrypt.DataCrypt(key).decryptBytesIO(ciphertext=c)
-
-    def decrypt_bytes_object(self, c, name):
-        return self.decrypt_object(io.BytesIO(c), name).read()
+                                     headers={"X-Object-Meta-MCM-Content": DataCrypt.HEADER_V2})
 
     def getObject(self, name):
         c = self.swift_backend.getObject(container=self.containerName, name=name)
@@ -160,12 +230,15 @@ class CryptoFrontend(object):
     def deleteObject(self, name):
         pass
 
+    def deleteObjects(self, names):
+        pass
+
 
 ###############################################################################
 ###############################################################################
 
 
-class SdosFrontend(object):
+class SdosFrontend(ObjectCryptFrontend):
     """
     This frontend implements the SDOS functionality
     """
@@ -196,7 +269,7 @@ class SdosFrontend(object):
             swiftBackend=self.swift_backend)
 
         if useCache:
-            p = KeyPartitionCache(partitionStore=self.partitionStore)
+            p = KeyPartitionCache(partitionStore=self.partitionStore, cascadeProperties=self.cascadeProperties)
         else:
             p = self.partitionStore
 
@@ -215,24 +288,31 @@ class SdosFrontend(object):
     def finish(self):
         self.cascade.finish()
 
-    def encrypt_object(self, o, name):
-        key = self.cascade.getKeyForNewObject(name)
-        return DataCrypt.DataCrypt(key).encryptBytesIO(plaintext=o)
+    def close(self):
+        """
+        flush the cascade and stop its background work; the frontend can't be used anymore.
+        see parallelExecution.Pool.FEPool.evict
+        :return:
+        """
+        self.cascade.close()
+
+    def getMemoryUsage(self):
+        return self.cascade.getMemoryUsage()
+
+    def get_placement_group(self, name, headers):
+        return SlotPlacement.get_placement_group(policy=self.cascadeProperties.slot_placement, name=name,
+                                                 headers=headers)
 
-    def encrypt_bytes_object(self, o, name):
-        return self.encrypt_object(o=io.BytesIO(o), name=name).read()
+    def get_key_for_new_object(self, name, headers=None):
+        return self.cascade.getKeyForNewObject(name, group=self.get_placement_group(name, headers))
+
+    def get_key_for_stored_object(self, name):
+        return self.cascade.getKeyForStoredObject(name)
 
     def putObject(self, o, name):
         c = self.encrypt_object(o=o, name=name)
         self.swift_backend.putObject(self.containerName, name, c,
-                                     headers={"X-Object-Meta-MCM-Content": DataCrypt.HEADER})
-
-    def decrypt_object(self, c, name):
-        key = self.cascade.getKeyForStoredObject(name)
-        return DataCrypt.DataCrypt(key).decryptBytesIO(ciphertext=c)
-
-    def decrypt_bytes_object(self, c, name):
-        return self.decrypt_object(io.BytesIO(c), name).read()
+                                     headers={"X-Object-Meta-MCM-Content": DataCrypt.HEADER_V2})
 
     def getObject(self, name):
         c = self.swift_backend.getObject(container=self.containerName, name=name)
@@ -243,16 +323,35 @@ class SdosFrontend(object):
         delete an individual object. this triggers the secure delete / re-keying on the cascade
         unless batch delete is activated, then the frontend will save deletions to a log and
         not call the cascade for re-keying
+        objects without a key, e.g. large object manifests, are ignored
         :param name:
         :param deleteDataObjectInSwift:
         :return:
         """
+        if not self.cascade.hasObjectKey(name):
+            logging.info("object {} has no key, nothing to delete".format(name))
+            return
         if self.cascadeProperties.use_batch_delete:
             self.batch_delete_log.add(name)
             logging.info("new batch delete log entry: {}".format(name))
         else:
             self.cascade.secureDeleteObjectKey(name)
 
+    def deleteObjects(self, names):
+        """
+        delete many objects like deleteObject, with a single re-keying of the cascade
+        :param names:
+        :return:
+        """
+        names = sorted(set(name for name in names if self.cascade.hasObjectKey(name)))
+        if not names:
+            return
+        if self.cascadeProperties.use_batch_delete:
+            self.batch_delete_log.update(names)
+            logging.info("{} new batch delete log entries".format(len(names)))
+        else:
+            self.cascade.secureDeleteObjectKeyBatch(names)
+
     def batch_delete_start(self):
         """
         here we process the logged delete requests.
@@ -272,3 +371,59 @@ class SdosFrontend(object):
 
             ###############################################################################
             ###############################################################################
+
+
+class RemoteSdosFrontend(ObjectCryptFrontend):
+    """
+    This frontend is used by worker processes in cascade_mode "owner", see parallelExecution.CascadeOwner
+    key lookups, allocations and deletes are sent to the cascade owner process; the object data
+    is en/decrypted locally
+    """
+
+    def __init__(self, containerName, swiftTenant, swiftToken, owner):
+        """
+        Constructor
+        :param owner: proxy of the CascadeOwner
+        """
+        self.containerName = containerName
+        self.swiftTenant = swiftTenant
+        self.swiftToken = swiftToken
+        self.owner = owner
+
+    def __call(self, method, *args):
+        return self.owner.call(self.containerName, self.swiftTenant, self.swiftToken, method, *args)
+
+    def refresh_swift_backend(self, swift_backend_new):
+        pass
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+    def getMemoryUsage(self):
+        return 0
+
+    def get_key_for_new_object(self, name, headers=None):
+        return self.__call("get_key_for_new_object", name, dict(headers) if headers else None)
+
+    def get_key_for_stored_object(self, name):
+        return self.__call("get_key_for_stored_object", name)
+
+    def deleteObject(self, name):
+        self.__call("deleteObject", name)
+
+    def deleteObjects(self, names):
+        self.__call("deleteObjects", list(names))
+
+    def batch_delete_start(self):
+        return self.__call("batch_delete_start")
+
+    def dispatch_pseudo_object(self, method, thisObject, data=None):
+        """
+        pseudo objects operate on the cascade; they are executed by the owner
+        :return: (body, status, mimetype)
+        """
+        return self.owner.dispatch_pseudo_object(self.containerName, self.swiftTenant, self.swiftToken, method,
+                                                 thisObject, data)
@@ -14,12 +14,17 @@
 
 import logging
 import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from threading import Event, Lock, Condition
 
+import numpy as np
+
 from sdos.crypto import CryptoLib
 from sdos.crypto.PartitionCrypt import PartitionCrypt
 from sdos import configuration
 from sdos.core.KeyPartition import KeyPartition
+from sdos.core.KeyPartitionCache import KeyPartitionCache
 
 
 class Cascade(object):
@@ -46,6 +51,12 @@ class Cascade(object):
     self.cascade_rekey_lock = Lock()
 
     This lock serializes the rekey/secure delete. --> synchronizes changing of the single master key
+
+
+    self.partition_locks = dict()
+
+    creates lock each partition they may modify. Only one partition lock is held at a time; the path is
+    processed from the root downwards.
     """
 
     def __init__(self, partitionStore, keySlotMapper, masterKeySource, cascadeProperties):
@@ -54,7 +65,21 @@ class Cascade(object):
         self.keySlotMapper = keySlotMapper
         self.masterKeySource = masterKeySource
         self.cascadeProperties = cascadeProperties
-        self.cascade_lock = Lock()
+        self.num_cr_treads = 0
+        self.cr_threads_condition = Condition()
+        self.cascade_open_for_reading = Event()
+        self.cascade_open_for_reading.set()
+        self.cascade_rekey_lock = Lock()
+        self.partition_locks = dict()
+        self.partition_locks_lock = Lock()
+        self.rekey_pool = None
+        # set when the cascade was unloaded, see close()
+        self.closed = False
+        # resolved object keys by slot, LRU ordered. Saves the walk from the root for hot objects
+        self.objectKeyCache = OrderedDict()
+        self.object_key_cache_lock = Lock()
+        # decrypted partitions can only be cached if the store is a cache
+        self.use_plain_partition_cache = isinstance(self.partitionStore, KeyPartitionCache)
         logging.warning(
             "Initialized new Key Cascade: {} with partitionStore {}, keySlotMapper {}, cascadeProperties {}".format(
                 self, self.partitionStore, self.keySlotMapper, self.cascadeProperties))
@@ -63,18 +88,17 @@ class Cascade(object):
     # Helpers for visualizing, debugging, statistics...
     ###############################################################################
     def get_used_partitions(self):
-        def rekParts(listNow):
-            if not listNow:
-                return []
-            n = set()
-            for i in listNow:
-                s = self.__getPartitionIdForSlot(i)
-                n.add(s)
-                if (i == 0): return n
-            return n.union(rekParts(n))
-
-        p = rekParts(self.keySlotMapper.getUsedList())
-        return list(p)
+        """
+        all partitions on the paths to the used object key slots. computed level by level with numpy
+        :return: sorted list of partition IDs
+        """
+        slots = np.fromiter(self.keySlotMapper.getUsedListSnapshot(), dtype=np.int64)
+        partitions = set()
+        while slots.size:
+            slots = np.unique(np.maximum(0, (slots - 1) // self.cascadeProperties.PARTITION_SIZE))
+            partitions.update(slots.tolist())
+            slots = slots[slots > 0]
+        return sorted(partitions)
 
     def get_reverse_object_key_partition_mapping(self):
         """
@@ -84,7 +108,7 @@ class Cascade(object):
         :return:
         """
         result = dict()
-        for objName, objKeySlot in self.keySlotMapper.getMappingDict().items():
+        for objName, objKeySlot in self.keySlotMapper.getMappingSnapshot().items():
             objKeyPartition = self.__getPartitionIdForSlot(objKeySlot)
             slotInPartition = self.__globalSlotToLocalSlot(objKeySlot)
             # print(objName, objKeySlot, objKeyPartition, slotInPartition)
@@ -117,10 +141,117 @@ class Cascade(object):
         """
         return slot >= self.cascadeProperties.FIRST_OBJECT_KEY_SLOT
 
+    ###############################################################################
+    # Locking
+    ###############################################################################
+    def __assert_open(self):
+        if self.closed:
+            raise SystemError("key cascade of container {} is closed".format(self.cascadeProperties.container_name))
+
+    def __start_create_read(self):
+        with self.cr_threads_condition:
+            while not self.cascade_open_for_reading.is_set():
+                self.cr_threads_condition.wait()
+            self.__assert_open()
+            self.num_cr_treads += 1
+
+    def __end_create_read(self):
+        with self.cr_threads_condition:
+            self.num_cr_treads -= 1
+            self.cr_threads_condition.notify_all()
+
+    def __start_exclusive(self):
+        """
+        block new reads/creates and wait until the running ones are done
+        :return:
+        """
+        self.cascade_rekey_lock.acquire()
+        with self.cr_threads_condition:
+            self.cascade_open_for_reading.clear()
+            while self.num_cr_treads:
+                self.cr_threads_condition.wait()
+
+    def __end_exclusive(self):
+        with self.cr_threads_condition:
+            self.cascade_open_for_reading.set()
+            self.cr_threads_condition.notify_all()
+        self.cascade_rekey_lock.release()
+
+    def __lock_partition(self, partitionId):
+        with self.partition_locks_lock:
+            l = self.partition_locks.get(partitionId, None)
+            if not l:
+                l = Lock()
+                self.partition_locks[partitionId] = l
+        l.acquire()
+
+    def __unlock_partition(self, partitionId):
+        self.partition_locks[partitionId].release()
+
+    ###############################################################################
+    # Object key cache
+    ###############################################################################
+    def __get_cached_object_key(self, slot):
+        with self.object_key_cache_lock:
+            key = self.objectKeyCache.get(slot, None)
+            if key:
+                self.objectKeyCache.move_to_end(slot)
+        if key and not self.__getCurrentMasterKey():
+            # cached keys must not be served while the master key is locked
+            raise KeyError("Master key is not available")
+        return key
+
+    def __cache_object_key(self, slot, key):
+        if not self.cascadeProperties.object_key_cache_size:
+            return
+        with self.object_key_cache_lock:
+            self.objectKeyCache[slot] = key
+            self.objectKeyCache.move_to_end(slot)
+            while len(self.objectKeyCache) > self.cascadeProperties.object_key_cache_size:
+                self.objectKeyCache.popitem(last=False)
+
+    def __invalidate_object_key(self, slot):
+        with self.object_key_cache_lock:
+            self.objectKeyCache.pop(slot, None)
+
     def finish(self):
         # self.partitionStore.print()
         self.keySlotMapper.finish()
 
+    def close(self):
+        """
+        flush the mapping and the cached partitions and stop their flusher timers and the re-key workers.
+        waits for running operations; all later operations fail. if flushing fails, the cascade stays open
+        :return:
+        """
+        self.__start_exclusive()
+        try:
+            if self.closed:
+                return
+            if self.use_plain_partition_cache:
+                self.partitionStore.flush()
+            self.keySlotMapper.flush()
+            self.closed = True
+            if self.use_plain_partition_cache:
+                self.partitionStore.close()
+            self.keySlotMapper.close()
+            if self.rekey_pool:
+                # idle, re-keying runs exclusively
+                self.rekey_pool.shutdown()
+                self.rekey_pool = None
+        finally:
+            self.__end_exclusive()
+
+    def getMemoryUsage(self):
+        """
+        estimated memory of the mapping and the partition cache
+        :return: bytes
+        """
+        m = self.keySlotMapper.getMemoryUsage()
+        if self.use_plain_partition_cache:
+            m += self.partitionStore.getMemoryUsage()
+        return m
+
     ###############################################################################
     # Master Key
     ###############################################################################
@@ -141,7 +272,22 @@ class Cascade(object):
         return KeyPartition(partitionId=partitionId, cascadeProperties=self.cascadeProperties)
 
     def getPartition(self, partitionId, key, lockForWriting=False):
+        """
+        load and decrypt a partition. Decrypted partitions are served from the cache if possible.
+        cached partitions are shared with other readers, so callers that modify the partition (lockForWriting)
+        get their own copy which replaces the cached one in __storePartition
+        :param partitionId:
+        :param key:
+        :param lockForWriting:
+        :return:
+        """
         self.log.info('getting partition: {}'.format(partitionId))
+        # without a key (e.g. locked master key) we never serve from the cache; decryption fails below instead
+        if key and self.use_plain_partition_cache:
+            partition = self.partitionStore.readPlainPartition(partitionId)
+            if partition:
+                return partition.copy() if lockForWriting else partition
+            version = self.partitionStore.getPartitionVersion(partitionId)
         by = self.partitionStore.readPartition(partitionId, lockForWriting=lockForWriting)
         if not by:
             self.log.info('requested partition does not exist. Id: {}'.format(partitionId))
@@ -152,9 +298,13 @@ class Cascade(object):
                 pc = PartitionCrypt(key)
                 partition.deserializeFromBytesIO(pc.decryptBytesIO(by))
                 by.close()
-                return partition
             except TypeError as e:
                 raise TypeError("error parsing partition {} - {}".format(partitionId, e))
+            if key and self.use_plain_partition_cache:
+                self.partitionStore.writePlainPartition(partition, version=version)
+                if lockForWriting:
+                    return partition.copy()
+            return partition
 
     def __storePartition(self, partition, key):
         self.log.info('storing partition {}'.format(partition.getId()))
@@ -163,34 +313,119 @@ class Cascade(object):
         pc = PartitionCrypt(key)
         by = pc.encryptBytesIO(partition.serializeToBytesIO())
         self.partitionStore.writePartition(partition.getId(), by)
+        if self.use_plain_partition_cache:
+            self.partitionStore.writePlainPartition(partition)
 
     ###############################################################################
     # Insert new key, get existing key
     ###############################################################################
-    def getKeyForNewObject(self, name):
-        return self.__get_new_or_existing_key(name=name, createIfNotExists=True)
+    def getKeyForNewObject(self, name, group=None):
+        return self.__get_new_or_existing_key(name=name, createIfNotExists=True, group=group)
 
     def getKeyForStoredObject(self, name):
         return self.__get_new_or_existing_key(name=name, createIfNotExists=False)
 
-    def __get_new_or_existing_key(self, name, createIfNotExists):
-        self.cascade_lock.acquire()
+    def hasObjectKey(self, name):
+        """
+        objects that were stored without encryption (e.g. large object manifests) have no key
+        """
+        return self.keySlotMapper.hasMapping(name)
+
+    def getKeysForNewObjects(self, names, group=None):
+        """
+        allocate slots and keys for many new objects at once. The slots are packed into few object key partitions
+        and each modified partition is only stored once
+        :param names:
+        :param group: placement group of the new objects
+        :return: dict name -> key
+        """
+        self.__start_create_read()
+        try:
+            slots = self.keySlotMapper.getOrCreateMappings(set(names), group=group)
+            self.log.info('getting keys for {} new objects'.format(len(slots)))
+            keys = dict()
+            byPartition = dict()
+            for name, slot in slots.items():
+                k = self.__get_cached_object_key(slot)
+                if k:
+                    keys[name] = k
+                else:
+                    byPartition.setdefault(self.__getPartitionIdForSlot(slot), []).append(name)
+            for partitionId, partitionNames in sorted(byPartition.items()):
+                partitionKey = self._getKeyFromCascade(partitionId, createIfNotExists=True)
+                self.__lock_partition(partitionId)
+                try:
+                    partition = self.getPartition(partitionId, partitionKey, lockForWriting=True)
+                    if not partition:
+                        partition = self.generatePartition(partitionId)
+                    modified = False
+                    for name in partitionNames:
+                        localSlot = self.__globalSlotToLocalSlot(slots[name])
+                        key = partition.getKey(localSlot)
+                        if not key:
+                            key = partition.generateKey(localSlot)
+                            modified = True
+                        keys[name] = key
+                    if modified:
+                        self.__storePartition(partition, partitionKey)
+                finally:
+                    self.__unlock_partition(partitionId)
+                for name in partitionNames:
+                    self.__cache_object_key(slots[name], keys[name])
+        finally:
+            self.__end_create_read()
+        return keys
+
+    def getKeysForStoredObjects(self, names):
+        """
+        get the keys for many stored objects at once. The slots are grouped by partition, so each partition on
+        the paths to the object keys is only read/decrypted once.
+        :param names:
+        :return: dict name -> key
+        """
+        self.__start_create_read()
+        try:
+            slots = dict((name, self.keySlotMapper.getMapping(name)) for name in names)
+            self.log.info('getting keys for {} objects'.format(len(slots)))
+            keys = dict()
+            for name, slot in slots.items():
+                k = self.__get_cached_object_key(slot)
+                if k:
+                    keys[name] = k
+            missing = set(slot for name, slot in slots.items() if name not in keys)
+            if missing:
+                slotKeys = self._getKeysFromCascade(missing)
+                for name, slot in slots.items():
+                    if name not in keys:
+                        keys[name] = slotKeys[slot]
+                        self.__cache_object_key(slot, keys[name])
+        finally:
+            self.__end_create_read()
+        return keys
+
+    def __get_new_or_existing_key(self, name, createIfNotExists, group=None):
+        self.__start_create_read()
         try:
             if createIfNotExists:
-                slot = self.keySlotMapper.getOrCreateMapping(name)
+                slot = self.keySlotMapper.getOrCreateMapping(name, group=group)
             else:
                 slot = self.keySlotMapper.getMapping(name)
             self.log.info(
                 'getting key for (new?{}) object with name: {}, goes into slot: {}'.format(createIfNotExists, name,
                                                                                            slot))
-            k = self._getKeyFromCascade(slot, createIfNotExists=createIfNotExists)
+            k = self.__get_cached_object_key(slot)
+            if not k:
+                k = self._getKeyFromCascade(slot, createIfNotExists=createIfNotExists)
+                self.__cache_object_key(slot, k)
         finally:
-            self.cascade_lock.release()
+            self.__end_create_read()
         return k
 
     def _getKeyFromCascade(self, slot, createIfNotExists=False):
         """
-        TODO: separate reading/writing cases
+        walk the path from the root to the given slot. Readers don't lock; they work on the cached partitions
+        which are only ever replaced, never modified.
+        Creates lock each partition on the path while reading and possibly modifying it.
         :param slot:
         :param createIfNotExists:
         :return:
@@ -206,28 +441,60 @@ class Cascade(object):
         # if create is allowed, we lock the partition a-priori. It could be that we add a new key...
         # this also means that we wait for release of the write lock on that partition.
         # in the other case, we don't wait for that lock and read immediately
-        partition = self.getPartition(partitionId, partitionKey, lockForWriting=createIfNotExists)
-        if not partition and createIfNotExists:
-            partition = self.generatePartition(partitionId)
-        # the partition will be stored later since the key will be empty as well
-        elif not partition and not createIfNotExists:
-            raise SystemError('requested partition {} does not exist'.format(partitionId))
-
         localSlot = self.__globalSlotToLocalSlot(slot)
-        key = partition.getKey(localSlot)
-        if not key and createIfNotExists:
-            key = partition.generateKey(localSlot)
-            self.__storePartition(partition, partitionKey)
-        elif not key and not createIfNotExists:
-            raise SystemError('key slot {} in partition {} is empty'.format(localSlot, partitionId))
-            # elif key and createIfNotExists:
-            # If the partition did exist and also had the key, we need to manually release the a-priori lock.
-            # In all other cases, the partition was saved above which unlocks implicitly
-        #    self.partitionStore.unlockPartition(partitionId)
+        if createIfNotExists:
+            self.__lock_partition(partitionId)
+        try:
+            partition = self.getPartition(partitionId, partitionKey, lockForWriting=createIfNotExists)
+            if not partition and createIfNotExists:
+                partition = self.generatePartition(partitionId)
+            # the partition will be stored later since the key will be empty as well
+            elif not partition and not createIfNotExists:
+                raise SystemError('requested partition {} does not exist'.format(partitionId))
+
+            key = partition.getKey(localSlot)
+            if not key and createIfNotExists:
+                key = partition.generateKey(localSlot)
+                self.__storePartition(partition, partitionKey)
+            elif not key and not createIfNotExists:
+                raise SystemError('key slot {} in partition {} is empty'.format(localSlot, partitionId))
+        finally:
+            if createIfNotExists:
+                self.__unlock_partition(partitionId)
         self.log.debug(
             '_getKeyFromCascade for slot: {}, in partition: {}, is localSlot: {}'.format(slot, partitionId, localSlot))
         return key
 
+    def _getKeysFromCascade(self, slots):
+        """
+        read-only walk from the root to many slots. processes the cascade level by level and visits
+        each partition once
+        :param slots:
+        :return: dict slot -> key
+        """
+        branches = self.__get_branches_to_slots(slots)
+        partitionKeys = {0: self.__getCurrentMasterKey()}
+        result = dict()
+        level = [0]
+        while level:
+            nextLevel = []
+            for partitionId in level:
+                partition = self.getPartition(partitionId, partitionKeys.pop(partitionId))
+                if not partition:
+                    raise SystemError('requested partition {} does not exist'.format(partitionId))
+                for s in branches[partitionId]:
+                    localSlot = self.__globalSlotToLocalSlot(s)
+                    key = partition.getKey(localSlot)
+                    if not key:
+                        raise SystemError('key slot {} in partition {} is empty'.format(localSlot, partitionId))
+                    if self.__is_object_key_slot(s):
+                        result[s] = key
+                    else:
+                        partitionKeys[s] = key
+                        nextLevel.append(s)
+            level = nextLevel
+        return result
+
     ###############################################################################
     # Delete: individual object key
     ###############################################################################
@@ -235,18 +502,25 @@ class Cascade(object):
         """
         This function just deletes a single object key without path re-keying
         used to remove a falsely assigned/unused key
+        it runs exclusively so that no concurrent reader can re-populate the object key cache for this slot
         :param name:
         :return:
         """
-        slot = self.keySlotMapper.resetMapping(name)
-        self.log.info('deleting object key for object: {} in slot: {}'.format(name, slot))
+        self.__start_exclusive()
+        try:
+            self.__assert_open()
+            slot = self.keySlotMapper.resetMapping(name)
+            self.log.info('deleting object key for object: {} in slot: {}'.format(name, slot))
+            self.__invalidate_object_key(slot)
 
-        partitionId = self.__getPartitionIdForSlot(slot)
-        partitionKey = self._getKeyFromCascade(partitionId)
-        partition = self.getPartition(partitionId, partitionKey, lockForWriting=True)
+            partitionId = self.__getPartitionIdForSlot(slot)
+            partitionKey = self._getKeyFromCascade(partitionId)
+            partition = self.getPartition(partitionId, partitionKey, lockForWriting=True)
 
-        partition.resetKey(self.__globalSlotToLocalSlot(slot))
-        self.__storePartition(partition, partitionKey)
+            partition.resetKey(self.__globalSlotToLocalSlot(slot))
+            self.__storePartition(partition, partitionKey)
+        finally:
+            self.__end_exclusive()
 
     ###############################################################################
     # Delete: secure delete
@@ -254,26 +528,32 @@ class Cascade(object):
     def secureDeleteObjectKey(self, name):
         if not name:
             raise ValueError("no obj name supplied")
-        self.cascade_lock.acquire()
+        self.__start_exclusive()
         try:
+            self.__assert_open()
+            if not self.keySlotMapper.hasMapping(name):
+                # deleted concurrently
+                self.log.info('no object key to delete for object: {}'.format(name))
+                return
             self.__assert_key_replace_possible()
             self.__secure_delete_top_down(name)
         except Exception as e:
             raise Exception("Secure delete failed. {}".format(e))
         finally:
-            self.cascade_lock.release()
+            self.__end_exclusive()
 
     def secureDeleteObjectKeyBatch(self, names):
         if not names:
             raise ValueError("no obj name list supplied")
-        self.cascade_lock.acquire()
+        self.__start_exclusive()
         try:
+            self.__assert_open()
             self.__assert_key_replace_possible()
             self.__secure_delete_top_down_batch(names)
         except Exception as e:
             raise Exception("Batched secure delete failed. {}".format(e))
         finally:
-            self.cascade_lock.release()
+            self.__end_exclusive()
 
     ###############################################################################
     # SECURE DELETE TOP DOWN
@@ -285,6 +565,9 @@ class Cascade(object):
         self.__cascaded_rekey_top_down(oldMasterKey, newMasterKey, 0, [slot])
 
     def __secure_delete_top_down_batch(self, names):
+        names = [name for name in names if self.keySlotMapper.hasMapping(name)]
+        if not names:
+            return
         slots = [self.keySlotMapper.resetMapping(name) for name in names]
 
         self.log.warning('Cascaded batch re-keying starting. Batch length: {}'.format(len(slots)))
@@ -302,7 +585,9 @@ class Cascade(object):
         Recursively, nodes are re-keyed (decrypted, modified, encrypted with new key) up to the root.
 
         This implementation accepts a list of keys to delete. It executes the re-keying (and then deleting in the leaves)
-        depth-first, and so only visits each necessary node once.
+        level by level, starting at the given partition, and so only visits each necessary node once.
+        Once a partition has its new key, its subtree is independent of its siblings. All the partitions of one level
+        are therefore processed concurrently on the re-key pool (see CascadeProperties.rekey_workers)
 
         :param partitionKeyOld: the current key for the partition
         :param partitionKeyNew: the new key to use after modifying the partition
@@ -312,10 +597,24 @@ class Cascade(object):
         the slots here must be "globalslots" i.e. in the global slot range and not local to one partition
         :return:
         """
+        branches = self.__get_branches_to_slots(objectKeySlots)
+        level = [(partitionId, partitionKeyOld, partitionKeyNew)]
+        while level:
+            nextLevel = []
+            for children in self.__map_on_rekey_pool(
+                    lambda l: self.__rekey_partition(l[0], l[1], l[2], branches.get(l[0], [])), level):
+                nextLevel.extend(children)
+            level = nextLevel
+
+    def __rekey_partition(self, partitionId, partitionKeyOld, partitionKeyNew, slotsToModify):
+        """
+        re-key a single partition: clear the object keys / replace the partition keys in the given slots and
+        store the partition with its new key
+        :return: list of (child partition id, old key, new key) for the replaced partition keys
+        """
         thisPartition = self.getPartition(partitionId, partitionKeyOld, lockForWriting=True)
-        slotsToModify = self.__get_list_of_slots_to_branches(objectKeySlots, partitionId)
-        self.log.info("cascaded re-keying on partition {}, targeting object Key IDs {}. following paths to: {}".format(
-            partitionId, objectKeySlots, slotsToModify))
+        self.log.info("cascaded re-keying on partition {}. following paths to: {}".format(partitionId, slotsToModify))
+        children = []
         for s in slotsToModify:
             localSlot = self.__globalSlotToLocalSlot(s)
             if self.__is_object_key_slot(s):
@@ -323,6 +622,7 @@ class Cascade(object):
                     "cascaded re-keying on object key partition {}, clearing slot {}".format(
                         partitionId, s))
                 thisPartition.resetKey(localSlot)
+                self.__invalidate_object_key(s)
             else:
                 self.log.info(
                     "cascaded re-keying on internal partition {}, replacing key in slot {}".format(
@@ -330,44 +630,42 @@ class Cascade(object):
                 ok = thisPartition.getKey(localSlot)
                 nk = CryptoLib.generateRandomKey()
                 thisPartition.setKey(localSlot, nk)
-                self.__cascaded_rekey_top_down(ok, nk, s, objectKeySlots)
+                children.append((s, ok, nk))
         self.__storePartition(thisPartition, partitionKeyNew)
+        return children
 
-    def __get_list_of_slots_to_branches(self, objectKeySlots, thisPartitionId):
+    def __map_on_rekey_pool(self, f, items):
+        if len(items) < 2 or self.cascadeProperties.rekey_workers < 2:
+            return [f(i) for i in items]
+        if not self.rekey_pool:
+            self.rekey_pool = ThreadPoolExecutor(max_workers=self.cascadeProperties.rekey_workers)
+        return list(self.rekey_pool.map(f, items))
+
+    def __get_branches_to_slots(self, objectKeySlots):
         """
-        here we determine a list of global slots (equiv. to partition IDs)
+        here we determine for each partition the list of global slots (equiv. to partition IDs)
         that are children of this partition and are the next on a path to the
         object keys
         example: our cascade has 3 levels, partitions have 4 slots. object IDs 21..24 are in part. 5
         which is the child of 1, which is the child of 0. OKID 25 is in part. 6, child of 1, child of 0
-        In [34]: __get_list_of_slots_to_branches(c, [21,22,23,25], 0)
-        Out[34]: {1}
-
-        In [35]: __get_list_of_slots_to_branches(c, [21,22,23,25], 1)
-        Out[35]: {5, 6}
-
-        In [36]: __get_list_of_slots_to_branches(c, [21,22,23,25], 5)
-        Out[36]: {21, 22, 23}
-
-        In [37]: __get_list_of_slots_to_branches(c, [21,22,23,25], 6)
-        Out[37]: {25}
+        In [34]: __get_branches_to_slots(c, [21,22,23,25])
+        Out[34]: {0: [1], 1: [5, 6], 5: [21, 22, 23], 6: [25]}
 
         :param objectKeySlots:
-        :param thisPartitionId:
-        :return:
+        :return: dict partition id -> sorted list of slots
         """
-        slots = set()
+        branches = dict()
         for oks in objectKeySlots:
             thisSlot = oks
-            while thisSlot > thisPartitionId:
+            while thisSlot > 0:
                 parent = self.__getPartitionIdForSlot(thisSlot)
-                if parent == thisPartitionId:
-                    slots.add(thisSlot)
+                siblings = branches.setdefault(parent, set())
+                if thisSlot in siblings:
+                    # the path from here to the root was already added
+                    break
+                siblings.add(thisSlot)
                 thisSlot = parent
-        l = list(slots)
-        l.sort()
-        return l
-
+        return dict((p, sorted(slots)) for p, slots in branches.items())
 
 '''
     ###############################################################################
@@ -16,22 +16,38 @@ import io
 import logging
 import math
 
+import numpy as np
+
 from sdos.crypto import CryptoLib
 
 
 class KeyPartition(object):
     """
     An individual node (partition) form the tree
+
+    Partitions with few keys are sparse: the keys are kept in a dict slot -> key. Once a partition has more than
+    PARTITION_SIZE / SPARSE_FRACTION keys, all keys are stored in one contiguous buffer;
+    the key in slot i is at [i * KEY_SIZE:(i + 1) * KEY_SIZE]
+
+    Serialized formats:
+        dense:  <partition id><PARTITION_SIZE keys>
+        sparse: <partition id><format version><presence bitmap, one bit per slot><keys of the used slots>
+    The sparse format is only written if it is shorter, so a serialized partition with the dense length is always dense.
     """
-    EMPTY_KEY = '\0'.encode() * 32
+    __slots__ = ('cascadeProperties', 'keys', 'sparseKeys', 'partitionID')
+    KEY_SIZE = 32
+    EMPTY_KEY = '\0'.encode() * KEY_SIZE
+    SPARSE_FRACTION = 8
+    SPARSE_FORMAT_VERSION = 2
+    log = logging.getLogger(__name__)
 
     def __init__(self, partitionId, cascadeProperties):
         """
         Constructor
         """
-        self.log = logging.getLogger(__name__)
         self.cascadeProperties = cascadeProperties
-        self.keys = [self.EMPTY_KEY] * self.cascadeProperties.PARTITION_SIZE
+        self.keys = None
+        self.sparseKeys = dict()
         self.partitionID = partitionId
 
     def print_partition(self):
@@ -39,35 +55,89 @@ class KeyPartition(object):
         print('+' + '----' * 32 + '+')
         print('| SDOS key partition - PartitionID: %s' % (self.partitionID))
         print('+' + '----' * 32 + '+')
-        for i in range(0, self.cascadeProperties.PARTITION_SIZE):
-            # print ('| Key %i: \t %s' % (i, 'Empty' if self.keys[i] == self.EMPTY_KEY else self.keys[i]))
-            print('| Key %i: \t %s' % (i, self.keys[i])) if self.keys[i] != self.EMPTY_KEY else None
+        for i in self.__getUsedSlots():
+            print('| Key %i: \t %s' % (i, self.getKey(i)))
         print('+' + '----' * 32 + '+')
 
+    ###############################################################################
+    # Dense / sparse representation
+    ###############################################################################
+    def isSparse(self):
+        return self.sparseKeys is not None
+
+    def __sparseLimit(self):
+        return self.cascadeProperties.PARTITION_SIZE // self.SPARSE_FRACTION
+
+    def __denseKeys(self):
+        """
+        :return: a new buffer with all keys of this sparse partition
+        """
+        keys = bytearray(self.KEY_SIZE * self.cascadeProperties.PARTITION_SIZE)
+        for slot, key in self.sparseKeys.items():
+            keys[slot * self.KEY_SIZE:(slot + 1) * self.KEY_SIZE] = key
+        return keys
+
+    def __toDense(self):
+        self.keys = self.__denseKeys()
+        self.sparseKeys = None
+
+    def __getUsedSlots(self):
+        """
+        :return: sorted list of the slots that contain a key
+        """
+        if self.isSparse():
+            return sorted(self.sparseKeys)
+        used = np.frombuffer(self.keys, dtype=np.uint8).reshape(-1, self.KEY_SIZE).any(axis=1)
+        return np.flatnonzero(used).tolist()
+
     ###############################################################################
     # Key / slot operations
     ###############################################################################
     def setKey(self, slot, key):
-        # yield from self.lock
         self.log.debug('partition {} setting slot {} to key {}'.format(self.partitionID, slot, key))
-        self.keys[slot] = key
+        if len(key) != self.KEY_SIZE:
+            raise ValueError('key for slot {} has wrong length {}'.format(slot, len(key)))
+        if self.isSparse():
+            self.sparseKeys[slot] = bytes(key)
+            if len(self.sparseKeys) > self.__sparseLimit():
+                self.__toDense()
+        else:
+            self.keys[slot * self.KEY_SIZE:(slot + 1) * self.KEY_SIZE] = key
 
     def resetKey(self, slot):
-        # self.lock.acquire()
-        self.keys[slot] = self.EMPTY_KEY
+        if self.isSparse():
+            self.sparseKeys.pop(slot, None)
+        else:
+            self.keys[slot * self.KEY_SIZE:(slot + 1) * self.KEY_SIZE] = self.EMPTY_KEY
 
     def getKey(self, slot):
-        if (self.EMPTY_KEY == self.keys[slot]):
+        if self.isSparse():
+            return self.sparseKeys.get(slot, None)
+        key = bytes(self.keys[slot * self.KEY_SIZE:(slot + 1) * self.KEY_SIZE])
+        if (self.EMPTY_KEY == key):
             return None
-        return self.keys[slot]
+        return key
 
     def generateKey(self, slot):
-        if (self.EMPTY_KEY != self.keys[slot]):
+        if self.getKey(slot):
             raise SystemError('requested generate key but slot is not empty')
         key = CryptoLib.generateRandomKey()
         self.setKey(slot, key)
         return key
 
+    def copy(self):
+        """
+        partitions from the cache are shared between readers; writers modify their own copy
+        :return:
+        """
+        p = KeyPartition(partitionId=self.partitionID, cascadeProperties=self.cascadeProperties)
+        if self.isSparse():
+            p.sparseKeys = dict(self.sparseKeys)
+        else:
+            p.sparseKeys = None
+            p.keys = bytearray(self.keys)
+        return p
+
     ###############################################################################
     # Navigate / traverse cascade structure
     ###############################################################################
@@ -86,22 +156,58 @@ class KeyPartition(object):
     ###############################################################################
     # Serialization
     ###############################################################################
+    def __denseLength(self):
+        return self.KEY_SIZE * self.cascadeProperties.PARTITION_SIZE
+
+    def __bitmapLength(self):
+        return math.ceil(self.cascadeProperties.PARTITION_SIZE / 8)
+
     def serializeToBytesIO(self):
         by = io.BytesIO()
         by.write(self.partitionID.to_bytes(length=self.cascadeProperties.BYTES_FOR_PARTITION_IDs, byteorder='little',
                                            signed=False))
-        for i in range(self.cascadeProperties.PARTITION_SIZE):
-            by.write(self.keys[i])
+        usedSlots = self.__getUsedSlots()
+        if 1 + self.__bitmapLength() + self.KEY_SIZE * len(usedSlots) < self.__denseLength():
+            presence = np.zeros(self.cascadeProperties.PARTITION_SIZE, dtype=np.bool_)
+            presence[usedSlots] = True
+            by.write(self.SPARSE_FORMAT_VERSION.to_bytes(length=1, byteorder='little', signed=False))
+            by.write(np.packbits(presence).tobytes())
+            for slot in usedSlots:
+                by.write(self.getKey(slot))
+        elif self.isSparse():
+            # serializing doesn't change the representation; partitions from the cache are shared
+            by.write(self.__denseKeys())
+        else:
+            by.write(self.keys)
         by.seek(0)
         return by
 
     def deserializeFromBytesIO(self, by):
-        assert (len(by.getbuffer()) == (
-            len(
-                self.EMPTY_KEY) * self.cascadeProperties.PARTITION_SIZE) + self.cascadeProperties.BYTES_FOR_PARTITION_IDs)
-        by.seek(0)
-        self.partitionID = int.from_bytes(by.read(self.cascadeProperties.BYTES_FOR_PARTITION_IDs), byteorder='little',
-                                          signed=False)
-        for i in range(self.cascadeProperties.PARTITION_SIZE):
-            self.keys[i] = by.read(len(self.EMPTY_KEY))
-        by.__del__()
\ No newline at end of file
+        idLength = self.cascadeProperties.BYTES_FOR_PARTITION_IDs
+        buf = by.getbuffer()
+        self.partitionID = int.from_bytes(buf[:idLength], byteorder='little', signed=False)
+        if len(buf) == self.__denseLength() + idLength:
+            self.keys = bytearray(buf[idLength:])
+            self.sparseKeys = None
+            usedSlots = self.__getUsedSlots()
+            if len(usedSlots) <= self.__sparseLimit():
+                self.sparseKeys = dict((slot, self.getKey(slot)) for slot in usedSlots)
+                self.keys = None
+        else:
+            self.__deserializeSparse(buf[idLength:])
+        buf.release()
+        by.close()
+
+    def __deserializeSparse(self, buf):
+        if not len(buf) or buf[0] != self.SPARSE_FORMAT_VERSION:
+            raise TypeError('unknown partition format on partition {}'.format(self.partitionID))
+        bitmapEnd = 1 + self.__bitmapLength()
+        bitmap = np.frombuffer(buf[1:bitmapEnd], dtype=np.uint8)
+        usedSlots = np.flatnonzero(np.unpackbits(bitmap)[:self.cascadeProperties.PARTITION_SIZE]).tolist()
+        if len(buf) != bitmapEnd + self.KEY_SIZE * len(usedSlots):
+            raise TypeError('sparse partition {} has wrong length'.format(self.partitionID))
+        self.keys = None
+        self.sparseKeys = dict()
+        for i, slot in enumerate(usedSlots):
+            start = bitmapEnd + i * self.KEY_SIZE
+            self.setKey(slot, buf[start:start + self.KEY_SIZE])
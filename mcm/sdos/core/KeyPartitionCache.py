@@ -15,27 +15,95 @@
 import io
 import logging
 import threading
+from collections import OrderedDict
 
 
 class KeyPartitionCache(object):
     """
     Caching and loading of nodes
     This class may be used as a wrapper for the regular CascadePersistance class
+
+    Two tiers are kept: the encrypted partition buffers (these get flushed to the backend) and the
+    decrypted KeyPartition objects. The second tier lets the cascade skip decrypting/parsing on hot paths.
+
+    The cache is bounded by the cascades partition_cache_size (bytes, both tiers). Partitions are evicted
+    least recently used first, object key partitions (leaves) before inner partitions. The root and the
+    inner partitions of the first level are on every path and always stay; dirty partitions stay until they are flushed
     """
 
-    def __init__(self, partitionStore):
+    def __init__(self, partitionStore, cascadeProperties=None):
         """
         Constructor
+        :param cascadeProperties: without properties, the cache is unbounded
         """
         logging.info("Init new")
         self.partitionStore = partitionStore
-        self.partitionCache = dict()
+        self.cascadeProperties = cascadeProperties
+        # LRU ordered, the order applies to both tiers
+        self.partitionCache = OrderedDict()
+        self.plainPartitionCache = dict()
+        # every write of a partition increases its version. Readers decrypt concurrently to writers, so a plain
+        # partition is only accepted if it was decrypted from the current version
+        self.__versions = dict()
+        self.__lock = threading.Lock()
         self.__dirty_partitions = set()
-        # partition-level locking is not useful since all methods end up locking/waiting for part. 0 anyway...
-        # cascade-level locking is now used
+        self.__sizes = dict()
+        self.__bytes = 0
+        # flushes from the timer and from close() must not overlap
+        self.__flush_lock = threading.Lock()
+        self.__stopped = False
+        self.__timer = None
+        # partition-level locking for writers is done in the cascade
         # self.__locks = dict()
         self.__watch_and_store_partitions()
 
+    ###############################################################################
+    # size bound / eviction; callers hold self.__lock
+    ###############################################################################
+    def __account(self, partitionId):
+        """
+        update the size of a partition; a decrypted partition is about the size of the encrypted one
+        """
+        by = self.partitionCache.get(partitionId)
+        size = 0
+        if by is not None:
+            size = len(by) * (2 if partitionId in self.plainPartitionCache else 1)
+        self.__bytes += size - self.__sizes.pop(partitionId, 0)
+        if size:
+            self.__sizes[partitionId] = size
+
+    def __is_pinned(self, partitionId):
+        # in a two-level cascade, the first level are leaves and they are evicted like all other leaves
+        return partitionId <= self.cascadeProperties.PARTITION_SIZE and not self.__is_leaf(partitionId)
+
+    def __is_leaf(self, partitionId):
+        return partitionId >= self.cascadeProperties.NUMBER_OF_PARTITION_KEY_PARTITIONS
+
+    def __evict(self):
+        if not self.cascadeProperties or not self.cascadeProperties.partition_cache_size:
+            return
+        excess = self.__bytes - self.cascadeProperties.partition_cache_size
+        if excess <= 0:
+            return
+        victims = []
+        for leavesOnly in (True, False):
+            for pid in self.partitionCache:
+                if excess <= 0:
+                    break
+                if (self.__is_pinned(pid) or pid in self.__dirty_partitions or
+                        (leavesOnly and not self.__is_leaf(pid)) or (not leavesOnly and self.__is_leaf(pid))):
+                    continue
+                victims.append(pid)
+                excess -= self.__sizes.get(pid, 0)
+        for pid in victims:
+            self.partitionCache.pop(pid)
+            self.plainPartitionCache.pop(pid, None)
+            self.__account(pid)
+        logging.debug("evicted {} partitions from cache, {} bytes cached".format(len(victims), self.__bytes))
+
+    ###############################################################################
+    # partition store interface
+    ###############################################################################
     def writePartition(self, partitionId, by):
         """
 
@@ -44,8 +112,15 @@ class KeyPartitionCache(object):
         :return:
         """
         logging.debug("writing partition to cache: {}".format(partitionId))
-        self.partitionCache[partitionId] = by.getbuffer()
-        self.__dirty_partitions.add(partitionId)
+        with self.__lock:
+            self.partitionCache[partitionId] = by.getbuffer()
+            self.partitionCache.move_to_end(partitionId)
+            self.__versions[partitionId] = self.__versions.get(partitionId, 0) + 1
+            # the decrypted version is now outdated; the cascade provides the new one with writePlainPartition
+            self.plainPartitionCache.pop(partitionId, None)
+            self.__dirty_partitions.add(partitionId)
+            self.__account(partitionId)
+            self.__evict()
         # self.unlockPartition(partitionId)
 
     def readPartition(self, partitionId, lockForWriting=False):
@@ -59,35 +134,135 @@ class KeyPartitionCache(object):
         # if lockForWriting:
         #    self.lockPartition(partitionId)
 
-        if partitionId in self.partitionCache:
-            logging.debug("partition found in cache: {}".format(partitionId))
-        else:
+        while True:
+            with self.__lock:
+                by = self.partitionCache.get(partitionId)
+                if by is not None:
+                    self.partitionCache.move_to_end(partitionId)
+                version = self.__versions.get(partitionId, 0)
+            if by is not None:
+                logging.debug("partition found in cache: {}".format(partitionId))
+                return io.BytesIO(by)
+
             logging.warning("partition NOT found in cache: {}".format(partitionId))
-            by = self.partitionStore.readPartition(partitionId)
-            if not by:
-                return None
-            self.partitionCache[partitionId] = by.getbuffer()
-        return io.BytesIO(self.partitionCache[partitionId])
+            loaded = self.partitionStore.readPartition(partitionId)
+            with self.__lock:
+                by = self.partitionCache.get(partitionId)
+                if by is None and version != self.__versions.get(partitionId, 0):
+                    # a concurrent writer stored a newer version, and it was flushed and evicted while we were
+                    # loading; what we loaded may be outdated
+                    continue
+                if by is None:
+                    if not loaded:
+                        return None
+                    by = self.partitionCache[partitionId] = loaded.getbuffer()
+                    self.__account(partitionId)
+                    self.__evict()
+                else:
+                    # a concurrent writer or reader cached it while we were loading
+                    self.partitionCache.move_to_end(partitionId)
+            return io.BytesIO(by)
+
+    def readPlainPartition(self, partitionId):
+        """
+        get the decrypted partition object from the cache. The object is shared with other readers and
+        must not be modified
+        :param partitionId:
+        :return: the KeyPartition or None
+        """
+        with self.__lock:
+            partition = self.plainPartitionCache.get(partitionId, None)
+            if partition is not None:
+                self.partitionCache.move_to_end(partitionId)
+        return partition
+
+    def getPartitionVersion(self, partitionId):
+        return self.__versions.get(partitionId, 0)
+
+    def writePlainPartition(self, partition, version=None):
+        """
+        put a decrypted partition object into the cache. it must match the encrypted partition in this cache
+        :param partition:
+        :param version: the version the partition was decrypted from; it is dropped if outdated.
+        writers that hold the partition lock pass None
+        :return:
+        """
+        logging.debug("writing plain partition to cache: {}".format(partition.getId()))
+        with self.__lock:
+            if version is not None and version != self.__versions.get(partition.getId(), 0):
+                return
+            if partition.getId() not in self.partitionCache:
+                # evicted in the meantime
+                return
+            self.plainPartitionCache[partition.getId()] = partition
+            self.__account(partition.getId())
+            self.__evict()
+
+    ###############################################################################
+    # flushing
+    ###############################################################################
+    def flush(self):
+        """
+        Flush all the dirty partitions to the backend store. raises if a partition could not be stored
+        a partition stays dirty - and can't be evicted - until it is stored
+        :return:
+        """
+        logging.debug("checking for dirty partitions in cache: {} found".format(len(self.__dirty_partitions)))
+        with self.__flush_lock:
+            while True:
+                with self.__lock:
+                    if not self.__dirty_partitions:
+                        break
+                    pid = next(iter(self.__dirty_partitions))
+                    by = self.partitionCache[pid]
+                    version = self.__versions.get(pid, 0)
+                logging.warning("flushing modified partition {} from cache to mgmt container {}".format(pid,
+                                                                                                        self.partitionStore.containerNameSdosMgmt))
+                try:
+                    self.partitionStore.writePartition(pid, io.BytesIO(by))
+                except Exception:
+                    logging.error(
+                        "storing changed partition {} failed! {} dirty partitions left to store.".format(
+                            pid, len(self.__dirty_partitions)))
+                    raise
+                with self.__lock:
+                    # it stays dirty if it was written again in the meantime
+                    if version == self.__versions.get(pid, 0):
+                        self.__dirty_partitions.discard(pid)
+        with self.__lock:
+            # clean partitions may be evicted now
+            self.__evict()
+
+    def close(self):
+        """
+        flush and stop the periodic flushing. raises if not all partitions could be stored; it keeps running then
+        :return:
+        """
+        self.flush()
+        self.__stopped = True
+        if self.__timer:
+            self.__timer.cancel()
+
+    def getMemoryUsage(self):
+        """
+        estimated memory of both tiers
+        :return: bytes
+        """
+        return self.__bytes
 
     def __watch_and_store_partitions(self):
         """
         Flush all the dirty partitions to the backend store. This methods gets called periodically on a timer
         :return:
         """
-        logging.debug("checking for dirty partitions in cache: {} found".format(len(self.__dirty_partitions)))
-        while self.__dirty_partitions:
-            pid = self.__dirty_partitions.pop()
-            logging.warning("flushing modified partition {} from cache to mgmt container {}".format(pid,
-                                                                                                    self.partitionStore.containerNameSdosMgmt))
-            try:
-                self.partitionStore.writePartition(pid, io.BytesIO(self.partitionCache[pid]))
-            except Exception:
-                self.__dirty_partitions.add(pid)
-                logging.exception(
-                    "storing changed partition {} failed! {} dirty partitions left to store. Leaving this execution.".format(
-                        pid, len(self.__dirty_partitions)))
-                break
-        threading.Timer(10, self.__watch_and_store_partitions).start()
+        if self.__stopped:
+            return
+        try:
+            self.flush()
+        except Exception:
+            logging.exception("storing changed partitions failed. Leaving this execution.")
+        self.__timer = threading.Timer(10, self.__watch_and_store_partitions)
+        self.__timer.start()
 
 
 '''
@@ -15,6 +15,112 @@
 import io
 import logging
 import threading
+from collections import OrderedDict
+
+
+###############################################################################
+###############################################################################
+###############################################################################
+class FreeSlotMap(object):
+    """
+    tracks the used object key slots for allocation. Each object key partition with used slots gets a
+    bytearray with one byte per slot (0 = free) which we search with bytearray.find, i.e. in C.
+    Partitions without used slots take no memory. The hint points to the first partition that may have free slots,
+    so allocation is O(1) amortized
+    """
+
+    def __init__(self, cascadeProperties):
+        self.cascadeProperties = cascadeProperties
+        self.bitmaps = dict()
+        self.usedCounts = dict()
+        self.firstFreeHint = 0
+        self.firstEmptyHint = 0
+
+    def __locate(self, slot):
+        i = slot - self.cascadeProperties.FIRST_OBJECT_KEY_SLOT
+        return divmod(i, self.cascadeProperties.PARTITION_SIZE)
+
+    def __slot(self, partition, localSlot):
+        return self.cascadeProperties.FIRST_OBJECT_KEY_SLOT + partition * self.cascadeProperties.PARTITION_SIZE + localSlot
+
+    def setUsed(self, slot):
+        p, l = self.__locate(slot)
+        b = self.bitmaps.get(p, None)
+        if b is None:
+            b = bytearray(self.cascadeProperties.PARTITION_SIZE)
+            self.bitmaps[p] = b
+            self.usedCounts[p] = 0
+        if not b[l]:
+            b[l] = 1
+            self.usedCounts[p] += 1
+
+    def setFree(self, slot):
+        p, l = self.__locate(slot)
+        b = self.bitmaps.get(p, None)
+        if b is None or not b[l]:
+            return
+        b[l] = 0
+        self.usedCounts[p] -= 1
+        if not self.usedCounts[p]:
+            del self.bitmaps[p]
+            del self.usedCounts[p]
+            self.firstEmptyHint = min(self.firstEmptyHint, p)
+        self.firstFreeHint = min(self.firstFreeHint, p)
+
+    def findFreeSlots(self, n):
+        """
+        find the n lowest free slots. the slots don't get marked as used here
+        :param n:
+        :return: list of slots
+        """
+        size = self.cascadeProperties.PARTITION_SIZE
+        while self.usedCounts.get(self.firstFreeHint, 0) == size:
+            self.firstFreeHint += 1
+        slots = []
+        p = self.firstFreeHint
+        while len(slots) < n:
+            if p >= self.cascadeProperties.NUMBER_OF_OBJECT_KEY_PARTITIONS:
+                raise SystemError('no more free key slots available')
+            b = self.bitmaps.get(p, None)
+            if b is None:
+                slots.extend(self.__slot(p, l) for l in range(min(size, n - len(slots))))
+            else:
+                l = b.find(0)
+                while l != -1 and len(slots) < n:
+                    slots.append(self.__slot(p, l))
+                    l = b.find(0, l + 1)
+            p += 1
+        return slots
+
+    def findFreeSlotsInPartition(self, p, n):
+        """
+        find up to n free slots in object key partition p (counted from 0)
+        :return: list of slots
+        """
+        b = self.bitmaps.get(p, None)
+        if b is None:
+            return [self.__slot(p, l) for l in range(min(self.cascadeProperties.PARTITION_SIZE, n))]
+        slots = []
+        l = b.find(0)
+        while l != -1 and len(slots) < n:
+            slots.append(self.__slot(p, l))
+            l = b.find(0, l + 1)
+        return slots
+
+    def findEmptyPartition(self, start=0):
+        """
+        find the first object key partition without used slots
+        :param start: don't return partitions before this one
+        :return: the partition (counted from 0) or None if all partitions are used
+        """
+        while self.firstEmptyHint in self.bitmaps:
+            self.firstEmptyHint += 1
+        p = max(self.firstEmptyHint, start)
+        while p in self.bitmaps:
+            p += 1
+        if p >= self.cascadeProperties.NUMBER_OF_OBJECT_KEY_PARTITIONS:
+            return None
+        return p
 
 
 ###############################################################################
@@ -24,7 +130,14 @@ class KeySlotMapper(object):
     """
     here we store and manage the mapping between keys (identified by object IDs/object names)
     and slots in the object-key-partitions
+
+    new objects may belong to a placement group (see SlotPlacement). Each group fills its own object key partition;
+    when it is full, the group continues in the next empty partition. The group->partition assignment is
+    only kept in memory, after a restart the groups start in new partitions
     """
+    MAX_PLACEMENT_GROUPS = 4096
+    # estimated memory of one mapping entry: the name, the slot and the entries in mapping/usedList
+    MAPPING_ENTRY_BYTES = 200
 
     def __init__(self, mappingStore, cascadeProperties):
         """
@@ -36,9 +149,17 @@ class KeySlotMapper(object):
         self.is_mapping_clean = True
         self.mapping = dict()
         self.usedList = set()
+        self.freeSlotMap = FreeSlotMap(cascadeProperties=cascadeProperties)
+        self.groupPartitions = OrderedDict()
+        # creates run concurrently; allocating a slot has to be atomic
+        self.mapping_lock = threading.Lock()
         # self.freeList = dict() # no free list used ATM
         self.mappingStore = mappingStore
         self.cascadeProperties = cascadeProperties
+        # flushes from the timer and from close() must not overlap
+        self.__flush_lock = threading.Lock()
+        self.__stopped = False
+        self.__timer = None
         self.readMapping()
         self.__watch_and_store_mapping()
 
@@ -47,22 +168,50 @@ class KeySlotMapper(object):
             self.usedList.add(t)
 
     def finish(self):
-        self.storeMapping()
+        self.storeMapping(mapping_dict=self.mapping)
+
+    def flush(self):
+        """
+        store the mapping if it was modified
+        :return:
+        """
+        with self.__flush_lock:
+            if not self.is_mapping_clean:
+                # we use a copy so that the original can still be used for writing while we persist the copy
+                with self.mapping_lock:
+                    m = self.mapping.copy()
+                self.is_mapping_clean = True
+                logging.warning("flushing modified mapping with {} entries to mgmt container {}".format(
+                    len(m), self.cascadeProperties.container_name_mgmt))
+                try:
+                    self.storeMapping(mapping_dict=m)
+                except:
+                    self.is_mapping_clean = False
+                    raise
+
+    def close(self):
+        """
+        flush and stop the periodic flushing. raises if the mapping could not be stored; it keeps running then
+        :return:
+        """
+        self.flush()
+        self.__stopped = True
+        if self.__timer:
+            self.__timer.cancel()
+
+    def getMemoryUsage(self):
+        return len(self.mapping) * self.MAPPING_ENTRY_BYTES
 
     def __watch_and_store_mapping(self):
+        if self.__stopped:
+            return
         self.log.debug("checking mapping consistency...")
-        if not self.is_mapping_clean:
-            # we use a copy so that the original can still be used for writing while we persist the copy
-            m = self.mapping.copy()
-            self.is_mapping_clean = True
-            logging.warning("flushing modified mapping with {} entries to mgmt container {}".format(
-                len(m), self.cascadeProperties.container_name_mgmt))
-            try:
-                self.storeMapping(mapping_dict=m)
-            except:
-                self.is_mapping_clean = False
-                logging.exception("error storing mapping")
-        threading.Timer(10, self.__watch_and_store_mapping).start()
+        try:
+            self.flush()
+        except:
+            logging.exception("error storing mapping")
+        self.__timer = threading.Timer(10, self.__watch_and_store_mapping)
+        self.__timer.start()
 
     def getMappingDict(self):
         return self.mapping
@@ -70,35 +219,100 @@ class KeySlotMapper(object):
     def getUsedList(self):
         return self.usedList
 
+    def getMappingSnapshot(self):
+        """
+        a copy of the mapping that can be iterated while objects are added or deleted
+        """
+        with self.mapping_lock:
+            return dict(self.mapping)
+
+    def getUsedListSnapshot(self):
+        """
+        a copy of the used slots that can be iterated while objects are added or deleted
+        """
+        with self.mapping_lock:
+            return list(self.usedList)
+
     ###############################################################################
     ###############################################################################
     def findFreeSlot(self):
-        for slot in range(self.cascadeProperties.FIRST_OBJECT_KEY_SLOT, self.cascadeProperties.LAST_OBJCT_KEY_SLOT + 1):
-            if slot not in self.usedList:
-                return slot
-        raise SystemError('no more free key slots available')
+        return self.freeSlotMap.findFreeSlots(1)[0]
+
+    def findFreeSlots(self, n, group=None):
+        """
+        find n free slots. they are packed into as few object key partitions as possible
+        :param n:
+        :param group: the placement group; None uses the lowest free slots
+        :return: list of slots
+        """
+        if group is None:
+            return self.freeSlotMap.findFreeSlots(n)
+        slots = []
+        p = self.groupPartitions.get(group, None)
+        if p is not None:
+            slots = self.freeSlotMap.findFreeSlotsInPartition(p, n)
+            self.groupPartitions.move_to_end(group)
+        start = 0
+        while len(slots) < n:
+            # partitions taken in this loop are not marked as used yet, so we continue after them
+            p = self.freeSlotMap.findEmptyPartition(start=start)
+            if p is None:
+                self.log.warning('no empty partitions left for placement group {}'.format(group))
+                self.groupPartitions.pop(group, None)
+                taken = set(slots)
+                lowest = self.freeSlotMap.findFreeSlots(n + len(slots))
+                return slots + [slot for slot in lowest if slot not in taken][:n - len(slots)]
+            slots.extend(self.freeSlotMap.findFreeSlotsInPartition(p, n - len(slots)))
+            self.groupPartitions[group] = p
+            self.groupPartitions.move_to_end(group)
+            start = p + 1
+        while len(self.groupPartitions) > self.MAX_PLACEMENT_GROUPS:
+            self.groupPartitions.popitem(last=False)
+        return slots
 
     def setMapping(self, name, slot):
         self.is_mapping_clean = False
         self.mapping[str(name)] = slot
         self.usedList.add(slot)
+        self.freeSlotMap.setUsed(slot)
         self.log.debug('set mapping: {} {}, {} {}'.format(name, type(name), slot, type(slot)))
 
-    def getOrCreateMapping(self, name):
-        if name in self.mapping:
-            slot = self.getMapping(name)
-        else:
-            slot = self.findFreeSlot()
-            self.setMapping(name, slot)
+    def getOrCreateMapping(self, name, group=None):
+        with self.mapping_lock:
+            if name in self.mapping:
+                slot = self.getMapping(name)
+            else:
+                slot = self.findFreeSlots(1, group=group)[0]
+                self.setMapping(name, slot)
         return slot
 
+    def getOrCreateMappings(self, names, group=None):
+        """
+        batch version of getOrCreateMapping. new names get their slots in a single allocation
+        :param names:
+        :param group: placement group of the new names
+        :return: dict name -> slot
+        """
+        with self.mapping_lock:
+            slots = dict((name, self.mapping[name]) for name in names if name in self.mapping)
+            new = [name for name in names if name not in slots]
+            for name, slot in zip(new, self.findFreeSlots(len(new), group=group)):
+                self.setMapping(name, slot)
+                slots[name] = slot
+        return slots
+
     def getMapping(self, name):
         return self.mapping[name]
 
+    def hasMapping(self, name):
+        return name in self.mapping
+
     def resetMapping(self, name):
-        self.is_mapping_clean = False
-        slot = self.mapping.pop(name)
-        self.usedList.remove(slot)
+        with self.mapping_lock:
+            self.is_mapping_clean = False
+            slot = self.mapping.pop(name)
+            self.usedList.remove(slot)
+            self.freeSlotMap.setFree(slot)
         return slot
 
     ###############################################################################
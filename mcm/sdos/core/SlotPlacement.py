@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+	Slot placement policies. The cost of a (batch) secure delete depends on the number of partitions on the paths
+	to the deleted keys. A policy assigns new objects to a placement group; the KeySlotMapper then puts
+	the objects of one group into the same object key partitions, so that deleting a group touches few partitions.
+"""
+
+import time
+
+PLACEMENT_LOWEST = "lowest"  # no groups, use the lowest free slot
+PLACEMENT_PREFIX = "prefix"  # objects in the same pseudo-folder, i.e. with the same name prefix up to the last "/"
+PLACEMENT_EXPIRY = "expiry"  # objects that expire (X-Delete-At/X-Delete-After) in the same time window
+PLACEMENT_UPLOAD_TIME = "uploadtime"  # objects uploaded in the same time window
+
+PLACEMENT_POLICIES = [PLACEMENT_LOWEST, PLACEMENT_PREFIX, PLACEMENT_EXPIRY, PLACEMENT_UPLOAD_TIME]
+
+EXPIRY_WINDOW_SECONDS = 3600
+UPLOAD_TIME_WINDOW_SECONDS = 3600
+
+
+def __get_header(headers, name):
+    if not headers:
+        return None
+    return headers.get(name, headers.get(name.lower(), None))
+
+
+def __get_expiry(headers):
+    try:
+        delete_at = __get_header(headers, "X-Delete-At")
+        if delete_at:
+            return int(delete_at)
+        delete_after = __get_header(headers, "X-Delete-After")
+        if delete_after:
+            return int(time.time()) + int(delete_after)
+    except ValueError:
+        pass
+    return None
+
+
+def get_placement_group(policy, name, headers=None):
+    """
+    determine the placement group of a new object
+    :param policy: one of PLACEMENT_POLICIES
+    :param name: object name
+    :param headers: request headers of the upload
+    :return: the group name or None if the object has no group
+    """
+    if not policy or policy == PLACEMENT_LOWEST:
+        return None
+    elif policy == PLACEMENT_PREFIX:
+        return "prefix:" + name.rpartition("/")[0]
+    elif policy == PLACEMENT_EXPIRY:
+        expiry = __get_expiry(headers)
+        if expiry is None:
+            return None
+        return "expiry:{}".format(expiry // EXPIRY_WINDOW_SECONDS)
+    elif policy == PLACEMENT_UPLOAD_TIME:
+        return "uploadtime:{}".format(int(time.time()) // UPLOAD_TIME_WINDOW_SECONDS)
+    else:
+        raise ValueError("unknown slot placement policy: {}".format(policy))
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+	Implementations of the AES/random primitives that CryptoLib uses.
+	PyCrypto(dome) is always available; the OpenSSL backend (AES-NI) requires the "cryptography" package.
+	Unless one is configured, the fastest available backend is selected on first use.
+"""
+
+import logging
+import os
+import time
+
+from Crypto import Random
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+try:
+	from cryptography.hazmat.backends import default_backend
+	from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+	logging.exception("unable to import cryptography, OpenSSL crypto backend will not be available")
+	Cipher = None
+
+BLOCK_SIZE = 16
+CTR_NONCE_SIZE = 8
+
+
+class PyCryptoBackend(object):
+	"""
+	the cipher functions return a function that en/decrypts a sequence of blocks, keeping the cipher state
+	"""
+	name = "pycrypto"
+
+	def randomBytes(self, n):
+		return Random.new().read(n)
+
+	def cbcEncryptor(self, key, iv):
+		return AES.new(key, AES.MODE_CBC, iv).encrypt
+
+	def cbcDecryptor(self, key, iv):
+		return AES.new(key, AES.MODE_CBC, iv).decrypt
+
+	def ctrTransformer(self, key, nonce, blockIndex):
+		"""
+		:param nonce: CTR_NONCE_SIZE bytes, the counter block is <nonce><64 bit block index, big endian>
+		:param blockIndex: index of the first block
+		:return:
+		"""
+		ctr = Counter.new(128 - 8 * CTR_NONCE_SIZE, prefix=nonce, initial_value=blockIndex)
+		return AES.new(key, AES.MODE_CTR, counter=ctr).encrypt
+
+
+class OpenSSLBackend(object):
+	"""
+	same as PyCryptoBackend, using OpenSSL through the cryptography package
+	"""
+	name = "openssl"
+
+	def randomBytes(self, n):
+		return os.urandom(n)
+
+	def cbcEncryptor(self, key, iv):
+		return Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).encryptor().update
+
+	def cbcDecryptor(self, key, iv):
+		return Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).decryptor().update
+
+	def ctrTransformer(self, key, nonce, blockIndex):
+		counterBlock = nonce + blockIndex.to_bytes(BLOCK_SIZE - CTR_NONCE_SIZE, byteorder='big')
+		return Cipher(algorithms.AES(key), modes.CTR(counterBlock), backend=default_backend()).encryptor().update
+
+
+def getAvailableBackends():
+	backends = [PyCryptoBackend()]
+	if Cipher:
+		backends.append(OpenSSLBackend())
+	return backends
+
+
+###############################################################################
+###############################################################################
+
+def benchmarkBackend(backend, size, mode="cbc", minSeconds=0.0):
+	"""
+	measure the encryption throughput of a backend
+	:param backend:
+	:param size: data size in bytes, multiple of BLOCK_SIZE
+	:param mode: "cbc" or "ctr"
+	:param minSeconds: repeat the encryption until this much time has passed
+	:return: MB/s
+	"""
+	data = bytes(size)
+	key = backend.randomBytes(32)
+	rounds = 0
+	start = time.perf_counter()
+	while True:
+		if mode == "ctr":
+			backend.ctrTransformer(key, backend.randomBytes(CTR_NONCE_SIZE), 0)(data)
+		else:
+			backend.cbcEncryptor(key, backend.randomBytes(BLOCK_SIZE))(data)
+		rounds += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= minSeconds:
+			return rounds * size / elapsed / (1 << 20)
+
+
+__backend = None
+
+
+def selectBackend(name=None):
+	"""
+	select the backend used by CryptoLib
+	:param name: backend name, or None to select the fastest available backend
+	:return: the selected backend
+	"""
+	global __backend
+	backends = getAvailableBackends()
+	if name:
+		try:
+			__backend = next(b for b in backends if b.name == name)
+		except StopIteration:
+			raise ValueError("crypto backend not available: {}".format(name))
+	else:
+		__backend = max(backends, key=lambda b: benchmarkBackend(b, size=1 << 20, mode="ctr", minSeconds=0.05))
+	logging.info("selected crypto backend: {}".format(__backend.name))
+	return __backend
+
+
+def getBackend():
+	if not __backend:
+		selectBackend()
+	return __backend
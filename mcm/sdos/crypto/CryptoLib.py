@@ -12,11 +12,12 @@
 	of the MIT license.  See the LICENSE file for details.
 """
 
-from Crypto.Cipher import AES
-from Crypto import Random
+from mcm.sdos.crypto import CryptoBackend
 import hashlib
 import logging
 import io
+import itertools
+import collections
 
 
 def getSha1Bytes(d):
@@ -37,14 +38,36 @@ def getKeyAsId(k):
 		return ""
 
 def generateRandomKey():
-	r = Random.new()
-	return hashlib.sha256(r.read(64)).digest()
+	return hashlib.sha256(CryptoBackend.getBackend().randomBytes(64)).digest()
 
 
 def digestKeyString(keyString):
 	return hashlib.sha256(keyString.encode()).digest()
 
 
+CTR_NONCE_SIZE = CryptoBackend.CTR_NONCE_SIZE
+
+
+def _getCtrCipher(key, iv, offset):
+	"""
+	:param key:
+	:param iv:
+	:param offset: byte offset in the encrypted part of a CryptoLibCtr ciphertext
+	:return: en/decryption function positioned at offset
+	"""
+	transform = CryptoBackend.getBackend().ctrTransformer(key, iv[:CTR_NONCE_SIZE], offset // CryptoBackend.BLOCK_SIZE)
+	transform(b'\0' * (offset % CryptoBackend.BLOCK_SIZE))
+	return transform
+
+
+def ctrTransform(key, iv, offset, data):
+	"""
+	en/decrypt one chunk of a CryptoLibCtr ciphertext independently of the other chunks.
+	module level function, so that it can be run in a process pool
+	"""
+	return _getCtrCipher(key, iv, offset)(data)
+
+
 def _unpadBytesIO(d):
 	length = d.getbuffer().nbytes
 	d.seek(length - 1)
@@ -68,7 +91,7 @@ class CryptoLib(object):
 		self.innerHeader = outerHeader
 		self.log = logging.getLogger(__name__)
 		self.key = key
-		self.blockSize = AES.block_size  # 16 bytes
+		self.blockSize = CryptoBackend.BLOCK_SIZE  # 16 bytes
 
 	# self._padBytesIO = lambda s: s + (self.blockSize - len(s) % self.blockSize) * chr(self.blockSize - len(s) % self.blockSize)
 	# self._unpadBytesIO = lambda s : s[:-ord(s[len(s)-1:])]
@@ -102,9 +125,9 @@ class CryptoLib(object):
 	def encryptBytesIO(self, plaintext):
 		assert (self.key)
 		self._padBytesIO(plaintext)
-		iv = Random.new().read(self.blockSize)
-		cipher = AES.new(self.key, AES.MODE_CBC, iv)
-		c = io.BytesIO(self.outerHeader + iv + cipher.encrypt(self.innerHeader + plaintext.getvalue()))
+		iv = CryptoBackend.getBackend().randomBytes(self.blockSize)
+		encrypt = CryptoBackend.getBackend().cbcEncryptor(self.key, iv)
+		c = io.BytesIO(self.outerHeader + iv + encrypt(self.innerHeader + plaintext.getvalue()))
 		plaintext.close()
 		return c
 
@@ -116,8 +139,8 @@ class CryptoLib(object):
 			raise TypeError('outer data header mismatch - possibly corrupt ciphertext')
 
 		iv = ciphertext.read(self.blockSize)
-		cipher = AES.new(self.key, AES.MODE_CBC, iv)
-		plaintext = io.BytesIO(cipher.decrypt(ciphertext.read()))
+		decrypt = CryptoBackend.getBackend().cbcDecryptor(self.key, iv)
+		plaintext = io.BytesIO(decrypt(ciphertext.read()))
 		ciphertext.close()
 
 		if not (plaintext.read(len(self.innerHeader)) == self.innerHeader):
@@ -128,3 +151,207 @@ class CryptoLib(object):
 		_unpadBytesIO(plaintextNoHeader)
 
 		return plaintextNoHeader
+
+	###############################################################################
+	# Streaming decryption
+	# consumes the same format as decryptBytesIO, but only keeps one chunk of the data in memory.
+	# chunks can have any size. new objects are streamed in the V2 format, see CryptoLibCtr
+	###############################################################################
+
+	def decryptStream(self, chunks):
+		"""
+		generator that decrypts an iterable of ciphertext chunks
+		the headers are verified before the first plaintext is returned; the padding is verified at the end
+		:param chunks: iterable of bytes
+		:return: generator of plaintext chunks
+		"""
+		assert (self.key)
+		headerLength = len(self.outerHeader) + self.blockSize
+		pending = bytearray()
+		decrypt = None
+		innerHeader = bytearray()
+
+		for chunk in chunks:
+			pending.extend(chunk)
+			if not decrypt:
+				if len(pending) < headerLength:
+					continue
+				if not (pending[:len(self.outerHeader)] == self.outerHeader):
+					raise TypeError('outer data header mismatch - possibly corrupt ciphertext')
+				decrypt = CryptoBackend.getBackend().cbcDecryptor(self.key, bytes(pending[len(self.outerHeader):headerLength]))
+				del pending[:headerLength]
+
+			# keep the last block back; it contains the padding if it is the end of the data
+			n = len(pending) - len(pending) % self.blockSize
+			if n == len(pending):
+				n -= self.blockSize
+			if n <= 0:
+				continue
+			plaintext = decrypt(bytes(pending[:n]))
+			del pending[:n]
+			if len(innerHeader) < len(self.innerHeader):
+				i = len(self.innerHeader) - len(innerHeader)
+				innerHeader.extend(plaintext[:i])
+				plaintext = plaintext[i:]
+				if len(innerHeader) == len(self.innerHeader) and not (innerHeader == self.innerHeader):
+					raise TypeError('inner data header mismatch - possibly wrong decryption key: {}...'.format(self.key[:5]))
+			if plaintext:
+				yield plaintext
+
+		if not decrypt or len(pending) != self.blockSize:
+			raise TypeError('incomplete ciphertext')
+		plaintext = decrypt(bytes(pending))
+		if len(innerHeader) < len(self.innerHeader):
+			i = len(self.innerHeader) - len(innerHeader)
+			innerHeader.extend(plaintext[:i])
+			plaintext = plaintext[i:]
+			if not (innerHeader == self.innerHeader):
+				raise TypeError('inner data header mismatch - possibly wrong decryption key: {}...'.format(self.key[:5]))
+		padSize = plaintext[-1] if plaintext else 0
+		if not 0 < padSize <= min(self.blockSize, len(plaintext)):
+			raise TypeError('padding mismatch - possibly corrupt ciphertext')
+		if len(plaintext) > padSize:
+			yield plaintext[:-padSize]
+
+
+class CryptoLibCtr(object):
+	"""
+	AES-CTR variant. The ciphertext has the same length as the plaintext, so any byte range of the data
+	can be decrypted from the same byte range of the ciphertext. The resulting encrypted data looks like this
+
+	<header:plain><nonce (8 bytes) + 8 zero bytes:plain><header:enc><data...:enc>
+
+	the counter of each block is its index in the encrypted part, starting with 0 for the encrypted header
+	in CTR mode decryption is the same operation as encryption
+	"""
+
+	def __init__(self, key = "", outerHeader = b"", pool = None):
+		"""
+		Constructor
+		:param pool: optional CryptoPool; streams are then en/decrypted in parallel chunks
+		"""
+		self.outerHeader = outerHeader
+		self.innerHeader = outerHeader
+		self.log = logging.getLogger(__name__)
+		self.key = key
+		self.blockSize = CryptoBackend.BLOCK_SIZE  # 16 bytes
+		self.nonceSize = CTR_NONCE_SIZE
+		self.pool = pool
+		# length of everything before the first data byte
+		self.headerLength = len(self.outerHeader) + self.blockSize + len(self.innerHeader)
+
+	###############################################################################
+	###############################################################################
+
+	def _getCipher(self, iv, offset):
+		"""
+		:param iv:
+		:param offset: byte offset in the encrypted part (inner header + data)
+		:return: en/decryption function positioned at offset
+		"""
+		return _getCtrCipher(self.key, iv, offset)
+
+	def _transformChunks(self, iv, chunks, offset):
+		"""
+		en/decrypt consecutive chunks, starting at offset in the encrypted part.
+		with a pool, the chunks are processed in parallel; a bounded number of chunks is in flight
+		and the results are returned in order
+		"""
+		if not (self.pool and self.pool.is_enabled()):
+			transform = self._getCipher(iv, offset)
+			for chunk in chunks:
+				if chunk:
+					yield transform(bytes(chunk))
+			return
+
+		pending = collections.deque()
+		try:
+			for chunk in chunks:
+				if not chunk:
+					continue
+				pending.append(self.pool.submit(ctrTransform, self.key, iv, offset, bytes(chunk)))
+				offset += len(chunk)
+				if len(pending) >= self.pool.max_pending():
+					yield pending.popleft().result()
+			while pending:
+				yield pending.popleft().result()
+		finally:
+			for f in pending:
+				f.cancel()
+
+	def _newIv(self):
+		return CryptoBackend.getBackend().randomBytes(self.nonceSize) + b'\0' * (self.blockSize - self.nonceSize)
+
+	def decryptHeader(self, head):
+		"""
+		verify the headers at the start of a ciphertext
+		:param head: the first headerLength bytes of the ciphertext
+		:return: the iv
+		"""
+		assert (self.key)
+		if not (head[:len(self.outerHeader)] == self.outerHeader):
+			raise TypeError('outer data header mismatch - possibly corrupt ciphertext')
+		iv = bytes(head[len(self.outerHeader):len(self.outerHeader) + self.blockSize])
+		innerHeader = self._getCipher(iv, 0)(bytes(head[len(self.outerHeader) + self.blockSize:self.headerLength]))
+		if not (innerHeader == self.innerHeader):
+			raise TypeError('inner data header mismatch - possibly wrong decryption key: {}...'.format(self.key[:5]))
+		return iv
+
+	def encryptBytesIO(self, plaintext):
+		assert (self.key)
+		iv = self._newIv()
+		encrypt = self._getCipher(iv, 0)
+		c = io.BytesIO()
+		c.write(self.outerHeader + iv)
+		c.write(encrypt(self.innerHeader))
+		c.write(encrypt(plaintext.getvalue()))
+		plaintext.close()
+		c.seek(0)
+		return c
+
+	def decryptBytesIO(self, ciphertext):
+		ciphertext.seek(0)
+		iv = self.decryptHeader(ciphertext.read(self.headerLength))
+		plaintext = io.BytesIO(self._getCipher(iv, len(self.innerHeader))(ciphertext.read()))
+		ciphertext.close()
+		return plaintext
+
+	def encryptStream(self, chunks):
+		"""
+		generator that encrypts an iterable of plaintext chunks
+		:param chunks: iterable of bytes
+		:return: generator of ciphertext chunks
+		"""
+		assert (self.key)
+		iv = self._newIv()
+		yield self.outerHeader + iv + self._getCipher(iv, 0)(self.innerHeader)
+		for c in self._transformChunks(iv, chunks, len(self.innerHeader)):
+			yield c
+
+	def decryptStream(self, chunks):
+		"""
+		generator that decrypts an iterable of ciphertext chunks
+		:param chunks: iterable of bytes
+		:return: generator of plaintext chunks
+		"""
+		chunks = iter(chunks)
+		head = bytearray()
+		for chunk in chunks:
+			head.extend(chunk)
+			if len(head) >= self.headerLength:
+				break
+		if len(head) < self.headerLength:
+			raise TypeError('incomplete ciphertext')
+		iv = self.decryptHeader(head)
+		rest = bytes(head[self.headerLength:])
+		return self.decryptRangeStream(iv, chunks if not rest else itertools.chain([rest], chunks), 0)
+
+	def decryptRangeStream(self, iv, chunks, offset):
+		"""
+		generator that decrypts a part of the data
+		:param iv: from decryptHeader
+		:param chunks: iterable of ciphertext bytes, starting at the data byte offset
+		:param offset: byte offset in the plaintext data, i.e. without headers
+		:return: generator of plaintext chunks
+		"""
+		return self._transformChunks(iv, chunks, len(self.innerHeader) + offset)
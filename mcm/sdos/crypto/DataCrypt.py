@@ -12,9 +12,14 @@
 	of the MIT license.  See the LICENSE file for details.
 """
 
+import itertools
 import logging
-from mcm.sdos.crypto.CryptoLib import CryptoLib
+from mcm.sdos.crypto.CryptoLib import CryptoLib, CryptoLibCtr
 HEADER = 'SDOS_ENCO_V1____'.encode(encoding='utf_8', errors='strict') # should always be 16 bytes long
+# V2 is range-readable (AES-CTR); new objects are always written as V2
+HEADER_V2 = 'SDOS_ENCO_V2____'.encode(encoding='utf_8', errors='strict') # should always be 16 bytes long
+# length of the V2 headers; data byte p is at ciphertext byte HEADER_LENGTH_V2 + p
+HEADER_LENGTH_V2 = CryptoLibCtr(outerHeader=HEADER_V2).headerLength
 
 class DataCrypt(object):
 	"""
@@ -22,14 +27,16 @@ class DataCrypt(object):
 	"""
 
 
-	def __init__(self, key):
+	def __init__(self, key, pool=None):
 		"""
 		Constructor
+		:param pool: optional CryptoPool for parallel en/decryption of V2 streams
 		"""
 		self.log = logging.getLogger(__name__)
 		self.log.debug('initializing')
 		self.key = key
 		self.cl = CryptoLib(key, HEADER)
+		self.clV2 = CryptoLibCtr(key, HEADER_V2, pool)
 
 	###############################################################################
 	###############################################################################
@@ -40,8 +47,58 @@ class DataCrypt(object):
 	###############################################################################
 	def encryptBytesIO(self, plaintext):
 		self.log.debug('encrypting data with key: {}'.format(self.key))
-		return self.cl.encryptBytesIO(plaintext)
+		return self.clV2.encryptBytesIO(plaintext)
 
 	def decryptBytesIO(self, ciphertext):
 		self.log.debug('decrypting data with key: {}'.format(self.key))
+		ciphertext.seek(0)
+		header = ciphertext.read(len(HEADER_V2))
+		ciphertext.seek(0)
+		if header == HEADER_V2:
+			return self.clV2.decryptBytesIO(ciphertext)
 		return self.cl.decryptBytesIO(ciphertext)
+
+	def encryptStream(self, chunks):
+		self.log.debug('encrypting data stream with key: {}'.format(self.key))
+		return self.clV2.encryptStream(chunks)
+
+	def decryptStream(self, chunks):
+		"""
+		decrypt V1 or V2 objects, depending on their header
+		:param chunks:
+		:return:
+		"""
+		self.log.debug('decrypting data stream with key: {}'.format(self.key))
+		chunks = iter(chunks)
+		header = bytearray()
+		for chunk in chunks:
+			header.extend(chunk)
+			if len(header) >= len(HEADER_V2):
+				break
+		chunks = itertools.chain([bytes(header)], chunks)
+		if header[:len(HEADER_V2)] == HEADER_V2:
+			return self.clV2.decryptStream(chunks)
+		return self.cl.decryptStream(chunks)
+
+	###############################################################################
+	# Range reads (V2 only)
+	###############################################################################
+	def decryptRangeStream(self, head, chunks, offset):
+		"""
+		decrypt a byte range of a V2 object
+		:param head: the first HEADER_LENGTH_V2 bytes of the object
+		:param chunks: iterable of ciphertext bytes, starting at ciphertext byte HEADER_LENGTH_V2 + offset
+		:param offset: plaintext byte offset of the range
+		:return: generator of plaintext chunks
+		"""
+		self.log.debug('decrypting data range with key: {}'.format(self.key))
+		iv = self.clV2.decryptHeader(head)
+		return self.clV2.decryptRangeStream(iv, chunks, offset)
+
+
+def isRangeReadable(head):
+	"""
+	:param head: the start of a ciphertext
+	:return: True if byte ranges of the object can be decrypted individually
+	"""
+	return len(head) >= HEADER_LENGTH_V2 and head[:len(HEADER_V2)] == HEADER_V2
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+	The key cascades rely on in-process locks, so only one process may use them. In cascade_mode "owner",
+	a single cascade owner process holds all frontends/cascades and serves key lookups, allocations and deletes
+	to any number of stateless worker processes over local IPC (multiprocessing managers).
+	The workers handle HTTP, swift I/O and the en/decryption of object data.
+
+	The manager serves each worker connection on its own thread, so the cascades are used exactly as
+	in the single-process, multi-threaded server
+
+"""
+import logging
+import os
+import secrets
+import time
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+from threading import Lock
+
+from swiftclient.exceptions import ClientException
+
+from mcm.sdos import configuration
+from sdos.core import Frontend
+from sdos.parallelExecution import Borg
+from sdos.parallelExecution.Pool import FEPool
+
+# frontend methods that workers may call on the owner
+OWNER_METHODS = frozenset(["get_key_for_new_object", "get_key_for_stored_object",
+                           "deleteObject", "deleteObjects", "batch_delete_start"])
+
+__process = None
+
+
+##############################################################################
+# owner process
+##############################################################################
+class CascadeOwner(object):
+    """
+        lives in the owner process; all workers share one instance
+    """
+
+    def call(self, container, swiftTenant, swiftToken, method, *args):
+        if method not in OWNER_METHODS:
+            raise ValueError("method not available on the cascade owner: {}".format(method))
+        try:
+            fe = FEPool().getFE(container, swiftTenant, swiftToken)
+            return getattr(fe, method)(*args)
+        except ClientException as e:
+            # swiftclient exceptions lose their status when they are sent to the worker
+            from mcm.sdos.service.Exceptions import HttpError
+            raise HttpError(e.__str__(), e.http_status or 500)
+
+    def dispatch_pseudo_object(self, container, swiftTenant, swiftToken, method, thisObject, data=None):
+        """
+        run a pseudo object operation on the owners frontend
+        :param method: "get_head" or "put_post"
+        :return: (body, status, mimetype) of the response
+        """
+        from mcm.sdos.service import pseudoObjects
+        fe = FEPool().getFE(container, swiftTenant, swiftToken)
+        if method == "get_head":
+            r = pseudoObjects.dispatch_get_head(fe, thisObject)
+        else:
+            r = pseudoObjects.dispatch_put_post(fe, thisObject, data)
+        return r.get_data(), r.status_code, r.mimetype
+
+
+class CascadeOwnerManager(BaseManager):
+    pass
+
+
+class CascadeOwnerClientManager(BaseManager):
+    pass
+
+
+CascadeOwnerClientManager.register("get_owner")
+
+
+def get_authkey():
+    """
+    the manager connections are pickled, so the owner must never be reachable with a known or empty key
+    :return: the configured authkey
+    """
+    if not configuration.cascade_owner_authkey:
+        raise SystemExit("cascade_mode \"owner\" requires cascade_owner_authkey, see configuration.example.py")
+    return configuration.cascade_owner_authkey
+
+
+def serve(authkey=None):
+    """
+    run the cascade owner in this process; does not return
+    :param authkey: the configured cascade_owner_authkey if None
+    :return:
+    """
+    authkey = authkey or get_authkey()
+    owner = CascadeOwner()
+    CascadeOwnerManager.register("get_owner", callable=lambda: owner)
+    m = CascadeOwnerManager(address=configuration.cascade_owner_address, authkey=authkey)
+    logging.warning("cascade owner listening on {}".format(configuration.cascade_owner_address))
+    m.get_server().serve_forever()
+
+
+def start(timeout=30):
+    """
+    start the cascade owner as a child process, e.g. from the gunicorn master before the workers are forked.
+    without a configured cascade_owner_authkey, a random one is generated; the workers forked after this
+    inherit it. returns when the owner accepts connections
+    :param timeout: seconds
+    :return:
+    """
+    global __process
+    if not configuration.cascade_owner_authkey:
+        configuration.cascade_owner_authkey = secrets.token_bytes(32)
+    __process = Process(target=serve, args=(configuration.cascade_owner_authkey,), name="sdos-cascade-owner")
+    __process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            CascadeOwnerClientManager(address=configuration.cascade_owner_address,
+                                      authkey=configuration.cascade_owner_authkey).connect()
+            return __process
+        except (ConnectionError, OSError):
+            if time.monotonic() > deadline or not __process.is_alive():
+                raise
+            time.sleep(0.1)
+
+
+def stop():
+    if __process and __process.is_alive():
+        __process.terminate()
+        __process.join()
+
+
+##############################################################################
+# worker processes
+##############################################################################
+class CascadeOwnerClient(Borg):
+    """
+        A singleton that holds the connection to the cascade owner. proxies use one connection per thread;
+        after a fork, the child process connects again
+    """
+
+    def __init__(self):
+        Borg.__init__(self)
+
+        try:
+            self.__lock
+        except:
+            self.__lock = Lock()
+            self.__owner = None
+            self.__pid = None
+
+    def get_owner(self):
+        with self.__lock:
+            if self.__owner is None or self.__pid != os.getpid():
+                m = CascadeOwnerClientManager(address=configuration.cascade_owner_address, authkey=get_authkey())
+                m.connect()
+                self.__owner = m.get_owner()
+                self.__pid = os.getpid()
+            return self.__owner
+
+    def getFE(self, container, swiftTenant, swiftToken):
+        return Frontend.RemoteSdosFrontend(container, swiftTenant, swiftToken, owner=self.get_owner())
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from threading import Lock
+
+from mcm.sdos import configuration
+from sdos.parallelExecution import Borg
+
+POOL_TYPE_THREAD = "thread"
+POOL_TYPE_PROCESS = "process"
+
+
+class CryptoPool(Borg):
+    """
+        A singleton that manages the workers for parallel en/decryption of object data chunks
+        the pool is configured with crypto_pool_type / crypto_pool_workers and started on first use
+    """
+
+    def __init__(self):
+        Borg.__init__(self)
+
+        try:
+            self.__lock
+        except:
+            self.__lock = Lock()
+            self.__executor = None
+
+    def is_enabled(self):
+        return configuration.crypto_pool_type in (POOL_TYPE_THREAD, POOL_TYPE_PROCESS) and \
+               configuration.crypto_pool_workers > 1
+
+    def max_pending(self):
+        """
+        number of chunks that a single stream may have in flight; bounds the memory used per request
+        :return:
+        """
+        return 2 * configuration.crypto_pool_workers
+
+    def __get_executor(self):
+        with self.__lock:
+            if not self.__executor:
+                logging.info("starting crypto pool: {} with {} workers".format(configuration.crypto_pool_type,
+                                                                              configuration.crypto_pool_workers))
+                if configuration.crypto_pool_type == POOL_TYPE_PROCESS:
+                    self.__executor = ProcessPoolExecutor(max_workers=configuration.crypto_pool_workers)
+                else:
+                    self.__executor = ThreadPoolExecutor(max_workers=configuration.crypto_pool_workers)
+            return self.__executor
+
+    def submit(self, fn, *args):
+        return self.__get_executor().submit(fn, *args)
+
+    def shutdown(self):
+        with self.__lock:
+            if self.__executor:
+                self.__executor.shutdown()
+                self.__executor = None
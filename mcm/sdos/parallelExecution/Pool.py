@@ -16,8 +16,12 @@
 
 """
 import logging
+import threading
+import time
+from concurrent.futures import Future
 from threading import Lock
 
+from mcm.sdos import configuration
 from sdos.parallelExecution import Borg
 from sdos.swift import SwiftBackend
 from sdos.core import Frontend
@@ -27,6 +31,10 @@ class SwiftPool(Borg):
     """
         A singleton that manages a pool of swift connections per tenant/user
         only one instance of this class exists at any time -> only one swift connection per user
+        connections that were not used for swift_pool_idle_timeout seconds are dropped, see run_janitor
+
+        getVerifiedConn checks the token with swift before it is used for key cascade operations;
+        the result is cached for token_validity_ttl seconds
     """
 
     def __init__(self):
@@ -36,11 +44,14 @@ class SwiftPool(Borg):
             self.__pool
         except:
             self.__pool = dict()
+            self.__last_used = dict()
+            self.__verified = dict()
 
     def addConn(self, swiftTenant, swiftToken, conn):
         self.__pool[(swiftTenant, swiftToken)] = conn
 
     def getConn(self, swiftTenant, swiftToken):
+        self.__last_used[(swiftTenant, swiftToken)] = time.monotonic()
         try:
             return self.__pool[(swiftTenant, swiftToken)]
         except KeyError:
@@ -48,11 +59,96 @@ class SwiftPool(Borg):
             self.addConn(swiftTenant, swiftToken, sb)
             return sb
 
+    def getVerifiedConn(self, swiftTenant, swiftToken):
+        """
+        the connection for a token that swift accepted. SDOS requests are otherwise only checked by swift after
+        the key cascade was used, e.g. a key slot was allocated or the frontend's swift backend was replaced
+        :raises ClientException: if swift rejects the token
+        :return: SwiftBackend
+        """
+        sb = self.getConn(swiftTenant, swiftToken)
+        if self.__verified.get((swiftTenant, swiftToken), 0) <= time.monotonic():
+            sb.assert_valid_auth()
+            self.__verified[(swiftTenant, swiftToken)] = time.monotonic() + configuration.token_validity_ttl
+        return sb
+
+    def evict(self):
+        """
+        drop idle connections and the least recently used ones beyond swift_pool_max_entries
+        :return:
+        """
+        now = time.monotonic()
+        entries = sorted(self.__last_used.items(), key=lambda e: e[1])
+        n = len(entries)
+        for k, last_used in entries:
+            if now - last_used > configuration.swift_pool_idle_timeout or n > configuration.swift_pool_max_entries:
+                self.__pool.pop(k, None)
+                self.__last_used.pop(k, None)
+                self.__verified.pop(k, None)
+                n -= 1
+
+
+class ContainerPropertiesPool(Borg):
+    """
+        A singleton that caches the SDOS properties of SDOS containers per tenant. This saves a HEAD request
+        to swift on every object request. Entries expire after container_properties_ttl seconds; the proxy
+        invalidates them when it forwards a container PUT/POST/DELETE.
+        Non-SDOS containers are not cached: invalidating only reaches this process, and a stale "not SDOS"
+        entry in another worker would store plaintext in a container that was just made an SDOS container
+    """
+    MAX_ENTRIES = 10000
+
+    def __init__(self):
+        Borg.__init__(self)
+
+        try:
+            self.__lock
+        except:
+            self.__lock = Lock()
+
+        try:
+            self.__pool
+        except:
+            self.__pool = dict()
+
+    def getProperties(self, swiftTenant, container, swift_backend):
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__pool.get((swiftTenant, container))
+        if entry and entry[0] > now:
+            return entry[1]
+
+        p = swift_backend.get_sdos_properties(container)
+        if not p["sdos_type"]:
+            return p
+        with self.__lock:
+            if len(self.__pool) >= self.MAX_ENTRIES:
+                self.__remove_expired(now)
+            self.__pool[(swiftTenant, container)] = (now + configuration.container_properties_ttl, p)
+        return p
+
+    def invalidate(self, swiftTenant, container):
+        logging.info("invalidating cached properties of container {} of tenant {}".format(container, swiftTenant))
+        with self.__lock:
+            self.__pool.pop((swiftTenant, container), None)
+
+    def __remove_expired(self, now):
+        for k in [k for k, entry in self.__pool.items() if entry[0] <= now]:
+            self.__pool.pop(k)
+        if len(self.__pool) >= self.MAX_ENTRIES:
+            self.__pool.clear()
+
 
 class FEPool(Borg):
     """
         A singleton that manages a pool of Frontends; i.e. key cascades with attached swift backends
         only one cascade exists per container/user combination
+
+        the pool holds a Future per container. Creating a frontend downloads the master key and the mapping,
+        so it happens outside the lock; concurrent requests for the same container wait on its Future,
+        requests for other containers are not blocked. Looking up an existing frontend takes no lock (see __evict)
+
+        the pool is bounded, see evict
     """
 
     def __init__(self):
@@ -67,36 +163,146 @@ class FEPool(Borg):
             self.__pool
         except:
             self.__pool = dict()
+            self.__last_used = dict()
+            # Futures of the frontends that are being closed; they resolve to the frontend if closing failed
+            self.__closing = dict()
+            threading.Timer(configuration.pool_janitor_interval, run_janitor).start()
 
     def addFE(self, container, swiftTenant, swiftToken, fe):
-        # self.__pool[(container, swiftTenant, swiftToken)] = fe
         # TODO: multi-backend in the Key Cascade is necessary.
         # currently, we would re-use the first users token for all requests...
-        self.__pool[(container, swiftTenant)] = fe
+        f = Future()
+        f.set_result(fe)
+        with self.__lock:
+            self.__pool[(container, swiftTenant)] = f
+            self.__last_used[(container, swiftTenant)] = time.monotonic()
 
     def getFE(self, container, swiftTenant, swiftToken):
-        logging.info(
-            "looking for Frontend for: container {}, swiftTenant {}, swiftToken {}".format(container, swiftTenant,
-                                                                                           swiftToken))
-        logging.debug("Lock \/ acquiring")
-        self.__lock.acquire()
-        logging.debug("Lock || locked")
+        sp = SwiftPool()
+        # the frontend continues with this backend, so the token must be valid
+        swift_backend_current = sp.getVerifiedConn(swiftTenant, swiftToken)
+
+        key = (container, swiftTenant)
+        # single dict operations are atomic, the fast path needs no lock
+        f = self.__pool.get(key)
+        if f:
+            # mark it as used before checking that it is still pooled; __evict checks in the opposite order
+            self.__last_used[key] = time.monotonic()
+            if self.__pool.get(key) is not f:
+                # evicted in the meantime
+                f = None
+        if not f:
+            f = self.__createFE(container, swiftTenant, swiftToken, swift_backend_current)
+
+        sdos_frontend = f.result()
+        sdos_frontend.refresh_swift_backend(swift_backend_new=swift_backend_current)
+        return sdos_frontend
+
+    def __createFE(self, container, swiftTenant, swiftToken, swift_backend_current):
+        """
+        the first request for a container creates its frontend, all others wait for the Future
+        :return: the Future
+        """
+        with self.__lock:
+            f = self.__pool.get((container, swiftTenant))
+            if f:
+                self.__last_used[(container, swiftTenant)] = time.monotonic()
+                return f
+            f = Future()
+            self.__pool[(container, swiftTenant)] = f
+            self.__last_used[(container, swiftTenant)] = time.monotonic()
+            closing = self.__closing.get((container, swiftTenant))
+
         try:
-            sp = SwiftPool()
-            swift_backend_current = sp.getConn(swiftTenant, swiftToken)
-            sdos_frontend = self.__pool[(container, swiftTenant)]
-            sdos_frontend.refresh_swift_backend(swift_backend_new=swift_backend_current)
-            return sdos_frontend
-        except KeyError:
+            # an evicted frontend must be flushed before its state is loaded again
+            old = closing.result() if closing else None
+            if old:
+                f.set_result(old)
+                return f
             logging.info(
                 "Frontend not found in pool, creating new for: container {}, swiftTenant {}, swiftToken {}".format(
-                    container, swiftTenant,
-                    swiftToken))
+                    container, swiftTenant, swiftToken))
+            p = ContainerPropertiesPool().getProperties(swiftTenant, container, swift_backend_current)
+            f.set_result(Frontend.frontendFactory(swift_backend_current, container, properties=p))
+        except Exception as e:
+            # the next request tries again
+            with self.__lock:
+                self.__pool.pop((container, swiftTenant), None)
+                self.__last_used.pop((container, swiftTenant), None)
+            f.set_exception(e)
+        return f
+
+    ###############################################################################
+    # eviction
+    ###############################################################################
+    def evict(self):
+        """
+        unload frontends that were not used for fe_pool_idle_timeout seconds. Also, the least recently used ones
+        are unloaded while more than fe_pool_max_entries are loaded or the estimated memory of all cascades
+        exceeds fe_pool_memory_budget. Frontends with a pending batch delete log are kept
+        :return:
+        """
+        now = time.monotonic()
+        with self.__lock:
+            loaded = [(self.__last_used.get(k, 0), k, f.result()) for k, f in self.__pool.items()
+                      if f.done() and not f.exception()]
+        loaded.sort(key=lambda e: e[0])
+        usage = dict((k, fe.getMemoryUsage() if fe else 0) for _, k, fe in loaded)
+        total = sum(usage.values())
+        n = len(loaded)
+        logging.info("frontend pool: {} loaded, estimated memory {} bytes".format(n, total))
 
-            fe = Frontend.frontendFactory(swift_backend_current, container)
+        for last_used, k, fe in loaded:
+            if fe and getattr(fe, "batch_delete_log", None):
+                continue
+            if (now - last_used > configuration.fe_pool_idle_timeout or n > configuration.fe_pool_max_entries or
+                        total > configuration.fe_pool_memory_budget):
+                if self.__evict(k, last_used):
+                    n -= 1
+                    total -= usage[k]
 
-            self.addFE(container, swiftTenant, swiftToken, fe)
-            return fe
+    def __evict(self, key, last_used):
+        with self.__lock:
+            f = self.__pool.pop(key, None)
+            if not f:
+                return False
+            # getFE takes no lock; it marks the frontend as used and then checks that it is still pooled.
+            # Removing it first and then checking the last use means that either we see the use or getFE sees
+            # the removal and waits for the lock in __createFE
+            if self.__last_used.get(key, 0) != last_used:
+                # used again in the meantime
+                self.__pool[key] = f
+                return False
+            self.__last_used.pop(key, None)
+            closing = Future()
+            self.__closing[key] = closing
+
+        fe = f.result()
+        try:
+            if fe:
+                fe.close()
+            logging.warning("evicted frontend for container {}, swiftTenant {}".format(*key))
+            fe = None
+            return True
+        except Exception:
+            logging.exception("closing frontend for container {}, swiftTenant {} failed; keeping it".format(*key))
+            with self.__lock:
+                self.__pool.setdefault(key, f)
+            return False
         finally:
-            self.__lock.release()
-            logging.debug("Lock /\ release CREATED NEW FE (probably...)")
+            with self.__lock:
+                self.__closing.pop(key, None)
+            closing.set_result(fe)
+
+
+def run_janitor():
+    """
+    evict frontends and swift connections from the pools. This methods gets called periodically on a timer
+    :return:
+    """
+    try:
+        FEPool().evict()
+        SwiftPool().evict()
+    except Exception:
+        logging.exception("evicting from the pools failed")
+    threading.Timer(configuration.pool_janitor_interval, run_janitor).start()
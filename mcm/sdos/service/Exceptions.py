@@ -28,6 +28,10 @@ class HttpError(Exception):
         if status_code is not None:
             self.status_code = status_code
 
+    def __reduce__(self):
+        # keep the status when the error is sent between processes
+        return (HttpError, (self.message, self.status_code))
+
     def to_json(self):
         d = {"message": self.message}
         json = jsonify(d)
@@ -16,8 +16,12 @@
 import logging
 from flask import Flask
 
+from mcm.sdos import configuration
+from mcm.sdos.crypto import CryptoBackend
 
 log = logging.getLogger()
 
+CryptoBackend.selectBackend(configuration.crypto_backend)
+
 app = Flask(__name__)
 import mcm.sdos.service.apiServer
\ No newline at end of file
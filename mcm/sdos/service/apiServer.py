@@ -23,15 +23,15 @@
 
 import logging
 import json
+import itertools
 from functools import wraps
+from urllib.parse import quote
 from flask import request, Response
 from swiftclient.exceptions import ClientException
 
-from mcm.sdos import configuration
 from mcm.sdos.service.Exceptions import HttpError
-from mcm.sdos.service import httpBackend, app, pseudoObjects, pseudoContainer
-from mcm.sdos.crypto import DataCrypt
-from mcm.sdos.parallelExecution.Pool import SwiftPool, FEPool
+from mcm.sdos.service import httpBackend, app, pseudoObjects, pseudoContainer, largeObjects, sharding, \
+    requestHandling
 from mcm.sdos.swift.SwiftBackend import SwiftBackend
 
 log = logging.getLogger()
@@ -54,6 +54,23 @@ def log_requests(f):
     return logging_wrapper
 
 
+@app.before_request
+def route_to_shard():
+    """
+    in cascade_mode "sharded", requests for a container are handled by the process that owns its cascade.
+    returning a response here skips the regular handler
+    :return:
+    """
+    shard = sharding.get_forward_target(request.view_args, request.environ, request.headers)
+    if shard is None:
+        return None
+    s, h, b = httpBackend.doStreamingRequest(method=request.method,
+                                             reqUrl=sharding.get_internal_url(shard) + quote(request.path),
+                                             reqHead=sharding.add_forwarded_header(request.headers),
+                                             reqArgs=request.args, reqData=get_request_body(), decodeContent=False)
+    return make_passthrough_response(s, h, b)
+
+
 @app.after_request
 def add_mcm_id(response):
     response.headers["MCM-Service-Type"] = "SDOS"
@@ -63,100 +80,39 @@ def add_mcm_id(response):
 ##############################################################################
 # helpers
 ##############################################################################
-def replaceStorageUrl(swiftResponse):
-    swiftUrl = swiftResponse['X-Storage-Url']
-    if not swiftUrl.startswith(configuration.swift_store_url.format("")):
-        raise HttpError("swift returned wrong storage URL")
-    swiftAuthName = swiftUrl[len(configuration.swift_store_url.format("")):]
-    #swiftAuthName = "mcmdemo" # TODO: change for ceph / swift
-    swiftResponse['X-Storage-Url'] = configuration.my_endpoint_store_url.format(swiftAuthName)
+def has_request_body():
+    return bool(request.content_length) or "chunked" == request.headers.get("Transfer-Encoding", "").lower()
 
 
-def replaceStorageUrl_authv2(auth_response):
+def get_request_body():
     """
-    here we parse the response from the auth provider and replace the provided swift store URL
-    the response contains a token and some metadata which we leave intact. there is also an array of all
-    available services. we replace this whole dict with only our SDOS endpoint
-    :param auth_response:
-    :return:
+    :return: the request body as a stream, or None
     """
-    ar = json.loads(auth_response.decode("utf-8"))
-    tenant_id = ar["access"]["token"]["tenant"]["id"]
-    my_endpoint = [{'adminURL': 'http://129.69.209.131:8080',
-                    'region': 'RegionOne',
-                    'publicURL': configuration.my_endpoint_store_url.format(tenant_id),
-                    'id': '1dc55ed5c82f4cd9a98d9f059729422f',
-                    'internalURL': 'http://129.69.209.131:8080/v1/AUTH_ea012720129645d9b32b23b4af5c154f'
-                    }]
-    log.debug("Whole auth data: {}".format(ar))
-    catalog = ar["access"]["serviceCatalog"]
-    log.debug("All catalog: {}".format(catalog))
-
-    for service in catalog:
-        if (service["type"] == "object-store" and service["name"] == "swift"):
-            log.debug("This swift service: {}".format(service))
-            log.debug("replacing the endpoint for this swift service...")
-            service["endpoints"] = my_endpoint
+    if not has_request_body():
+        return None
+    return httpBackend.requestBody(request.stream, request.content_length)
 
-    return ar
 
-
-def strip_etag(h):
-    try:
-        h.pop("Etag")
-    except:
-        pass
-    return h
-
-
-def add_sdos_flag(h):
-    i = dict(h)
-    i["X-Object-Meta-MCM-Content"] = DataCrypt.HEADER
-    return i
-
-
-def get_token(request):
-    return request.headers["X-Auth-Token"]
-
-
-def get_proxy_request_url(thisAuth, thisContainer=None, thisObject=None):
+def passthrough(myUrl):
     """
-    create the url under which this API proxy will reach its swift back end. basically this is the request url with a different hostname
-    :param thisAuth:
-    :param thisContainer:
-    :param thisObject:
+    forward the request to swift and stream the response back. Neither body is held in memory
+    :param myUrl:
     :return:
     """
-    u = configuration.swift_store_url.format(thisAuth)
-    if thisContainer:
-        u += "/" + thisContainer
-        if thisObject:
-            u += "/" + thisObject
-    return u
+    s, h, b = httpBackend.doStreamingRequest(method=request.method, reqUrl=myUrl, reqHead=request.headers,
+                                             reqArgs=request.args, reqData=get_request_body(), decodeContent=False)
+    return make_passthrough_response(s, h, b)
 
 
-##############################################################################
-# Frontend Pool
-##############################################################################
+def make_passthrough_response(s, h, b):
+    r = Response(response=b, status=s)
+    # We overwrite ALL the headers to retain the content size, also in the HEAD case
+    r.headers = h
+    return r
 
-def get_sdos_frontend(containerName, swiftTenant, swiftToken):
-    """
-    TODO: we really need a cascade-pool here and maybe locking in the cascade...
-    :param containerName:
-    :param swiftTenant:
-    :param swiftToken:
-    :return:
-    """
 
-    sp = SwiftPool()
-    sb = sp.getConn(swiftTenant, swiftToken)
-
-    fp = FEPool()
-
-    if sb.is_sdos_container(containerName):
-        return fp.getFE(containerName, swiftTenant, swiftToken)
-    else:
-        return False
+def get_token(request):
+    return request.headers["X-Auth-Token"]
 
 
 ##############################################################################
@@ -193,7 +149,7 @@ def handle_auth():
     swiftStatus, swiftHeaders, swiftBody = httpBackend.doAuthGetToken(reqHead=clientHeaders, method="GET")
     log.debug("swift response: {} {} {}".format(swiftStatus, swiftHeaders, swiftBody))
     if 200 == swiftStatus:
-        replaceStorageUrl(swiftResponse=swiftHeaders)
+        requestHandling.replaceStorageUrl(swiftResponse=swiftHeaders)
         log.debug("proxy response: {} {} {}".format(swiftStatus, swiftHeaders, swiftBody))
     return Response(status=swiftStatus, headers=swiftHeaders, response=swiftBody)
 
@@ -220,7 +176,7 @@ def handle_auth_v2():
                                                                       data=clientBody)
     log.debug("swift response: {} {} --BODY-- {}".format(swiftStatus, swiftHeaders, swiftBody))
     if 200 == swiftStatus:
-        proxyResponse = replaceStorageUrl_authv2(swiftBody)
+        proxyResponse = requestHandling.replaceStorageUrl_authv2(swiftBody)
         log.debug("proxy response body: {}".format(proxyResponse))
         return Response(response=json.dumps(proxyResponse), status=swiftStatus)
     return Response(status=swiftStatus, headers=swiftHeaders, response=swiftBody)
@@ -238,10 +194,8 @@ def handle_auth_v2():
 @app.route("/v1/AUTH_<thisAuth>", methods=["HEAD", "POST", "GET", "PUT", "DELETE"])
 @log_requests
 def handle_account(thisAuth):
-    myUrl = get_proxy_request_url(thisAuth)
-    s, h, b = httpBackend.doGenericRequest(method=request.method, reqUrl=myUrl, reqHead=request.headers,
-                                           reqArgs=request.args, reqData=request.data)
-    return Response(response=b, status=s, headers=h)
+    myUrl = requestHandling.get_proxy_request_url(thisAuth)
+    return passthrough(myUrl)
 
 
 """
@@ -256,10 +210,18 @@ def handle_container(thisAuth, thisContainer):
     if thisContainer == pseudoContainer.PSEUDO_CONTAINER_NAME:
         return "", 200
 
-    myUrl = get_proxy_request_url(thisAuth, thisContainer)
-    s, h, b = httpBackend.doGenericRequest(method=request.method, reqUrl=myUrl, reqHead=request.headers,
-                                           reqArgs=request.args, reqData=request.data)
-    return Response(response=b, status=s, headers=h)
+    if request.method == "DELETE" and sharding.is_key_delete(request.environ, request.headers):
+        # keys of large object segments that were deleted through another process, see sharding.ShardFrontend
+        sdos_frontend = requestHandling.get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth,
+                                                          swiftToken=get_token(request))
+        if sdos_frontend:
+            sdos_frontend.deleteObjects(json.loads(request.data.decode("utf-8")))
+        return Response(status=204)
+
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer)
+    r = passthrough(myUrl)
+    requestHandling.container_request_done(request.method, r.status_code, thisAuth, thisContainer)
+    return r
 
 
 """
@@ -275,40 +237,94 @@ def handle_object_get(thisAuth, thisContainer, thisObject):
     if thisContainer == pseudoContainer.PSEUDO_CONTAINER_NAME:
         return pseudoContainer.dispatch(thisObject=thisObject)
 
-    sdos_frontend = get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth, swiftToken=get_token(request))
+    sdos_frontend = requestHandling.get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth,
+                                                      swiftToken=get_token(request))
 
-    if sdos_frontend and thisObject.startswith(pseudoObjects.PSEUDO_OBJECT_PREFIX):
+    if requestHandling.is_pseudo_object(sdos_frontend, thisObject):
+        # the container properties may come from the cache, i.e. swift hasn't seen this token yet
+        SwiftBackend(tenant=thisAuth, token=get_token(request)).assert_valid_auth()
         return pseudoObjects.dispatch_get_head(sdos_frontend, thisObject)
 
-    myUrl = get_proxy_request_url(thisAuth, thisContainer, thisObject)
-    s, h, b = httpBackend.doGenericRequest(method=request.method, reqUrl=myUrl, reqHead=request.headers,
-                                           reqArgs=request.args, reqData=request.data)
-    if (s == 200 and len(b) and sdos_frontend):
-        try:
-            decrypted_b = sdos_frontend.decrypt_bytes_object(b, thisObject)
-        except:
-            raise HttpError("Decryption failed", 412)
-        # don't overwrite headers since the content length from the original response is incorrect; it accounts for padding...
-        # the Response object will determine the actual, correct size
-        return Response(response=decrypted_b, status=s, headers=strip_etag(h))
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    if requestHandling.is_decrypted_get(sdos_frontend, request.method, request.args):
+        return get_decrypted_object(sdos_frontend, thisAuth, myUrl, thisObject)
+
+    # this covers the unencrypted case (1) and also HEAD requests (2)
+    return passthrough(myUrl)
+
+
+def get_decrypted_object(sdos_frontend, thisAuth, myUrl, thisObject):
+    """
+    stream the object from swift through decryption to the client. only one chunk of the object is held in memory
+    single byte range requests are served for range-readable (V2) objects. for V1 objects and large objects
+    the range is ignored and the complete object is returned
+    :param sdos_frontend:
+    :param thisAuth:
+    :param myUrl:
+    :param thisObject:
+    :return:
+    """
+    reqHead = dict(request.headers)
+    byteRange = requestHandling.parse_byte_range(reqHead.pop("Range", None))
+    if byteRange:
+        r = get_decrypted_object_range(sdos_frontend, myUrl, thisObject, reqHead, byteRange)
+        if r:
+            return r
+
+    s, h, b = httpBackend.doStreamingRequest(method="GET", reqUrl=myUrl, reqHead=reqHead,
+                                             reqArgs=request.args, reqData=None)
+    if requestHandling.is_large_object_response(s, h):
+        b.close()
+        get_url, get_frontend = requestHandling.get_segment_accessors(thisAuth, get_token(request))
+        decrypted_b, first = requestHandling.start_large_object_decryption(myUrl, h, reqHead, get_url, get_frontend)
+    elif requestHandling.has_encrypted_body(s, h):
+        decrypted_b, first = requestHandling.start_decryption(lambda: sdos_frontend.decrypt_stream(b, thisObject),
+                                                              b.close)
     else:
-        r = Response(response=b, status=s)
-        # this covers the unencrypted case (1) and also HEAD requests (2). We overwrite ALL the headers to retain
-        # the content size in the HEAD case
-        r.headers = h
-        return r
+        return make_passthrough_response(s, h, b)
+    return Response(response=itertools.chain([first], decrypted_b), status=200,
+                    headers=requestHandling.get_decrypted_headers(h))
+
+
+def get_decrypted_object_range(sdos_frontend, myUrl, thisObject, reqHead, byteRange):
+    """
+    see requestHandling.plan_range
+    :param reqHead: request headers without the Range header
+    :param byteRange: from parse_byte_range
+    :return: the response or None if the object is not range-readable
+    """
+    s, h, head = httpBackend.doGenericRequest(method="GET", reqUrl=myUrl,
+                                              reqHead=requestHandling.get_range_head_request(reqHead),
+                                              reqArgs=request.args, reqData=None)
+    plan = requestHandling.plan_range(s, h, head, reqHead, byteRange)
+    if not plan:
+        return None
+    if plan.status == 416:
+        return Response(status=416, headers=plan.headers)
+
+    s, _, b = httpBackend.doStreamingRequest(method="GET", reqUrl=myUrl, reqHead=plan.rangeHead,
+                                             reqArgs=request.args, reqData=None)
+    if s != 206:
+        # object was changed in between; fall back to the complete object
+        b.close()
+        return None
+    decrypted_b, first = requestHandling.start_decryption(
+        lambda: sdos_frontend.decrypt_range_stream(head, b, thisObject, plan.first), b.close)
+    return Response(response=itertools.chain([first], decrypted_b), status=206, headers=plan.headers)
 
 
 @app.route("/v1/AUTH_<thisAuth>/<thisContainer>/<path:thisObject>", methods=["DELETE"])
 @log_requests
 def handle_object_delete(thisAuth, thisContainer, thisObject):
-    myUrl = get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    sdos_frontend = requestHandling.get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth,
+                                                      swiftToken=get_token(request))
+    get_url, get_frontend = requestHandling.get_segment_accessors(thisAuth, get_token(request))
+    segments = requestHandling.get_segments_for_delete(sdos_frontend, request.args, myUrl, request.headers, get_url)
+
     s, h, b = httpBackend.doGenericRequest(method=request.method, reqUrl=myUrl, reqHead=request.headers,
                                            reqArgs=request.args, reqData=request.data)
-
-    sdos_frontend = get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth, swiftToken=get_token(request))
-    if (s == 204 and sdos_frontend):
-        sdos_frontend.deleteObject(thisObject)
+    requestHandling.delete_keys(s, sdos_frontend, thisObject, segments, get_frontend)
     return Response(response=b, status=s, headers=h)
 
 
@@ -320,8 +336,8 @@ def handle_object_put(thisAuth, thisContainer, thisObject):
     we explicitly check the validity of the request
         SwiftBackend(tenant=thisAuth, token=thisToken).assert_valid_auth()
     for pseudo object/pseudo container requests because this otherwise doesn't happen,
-    or happens too late; i.e. after KeyCascade objects were modified. In case of uploads we verify AFTER
-    K.C. operations because the client can just upload the same object again and the "wrongly" assigned key/slot will be re-used
+    or happens too late; i.e. after KeyCascade objects were modified. Uploads to SDOS containers are verified
+    in get_sdos_frontend before a key/slot is assigned
     :param thisAuth:
     :param thisContainer:
     :param thisObject:
@@ -332,23 +348,24 @@ def handle_object_put(thisAuth, thisContainer, thisObject):
         SwiftBackend(tenant=thisAuth, token=thisToken).assert_valid_auth()
         return pseudoContainer.dispatch(thisObject=thisObject, data=request.headers)
 
-    myUrl = get_proxy_request_url(thisAuth, thisContainer, thisObject)
-    sdos_frontend = get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth, swiftToken=thisToken)
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    sdos_frontend = requestHandling.get_sdos_frontend(containerName=thisContainer, swiftTenant=thisAuth,
+                                                      swiftToken=thisToken)
 
-    if sdos_frontend and thisObject.startswith(pseudoObjects.PSEUDO_OBJECT_PREFIX):
+    if requestHandling.is_pseudo_object(sdos_frontend, thisObject):
         SwiftBackend(tenant=thisAuth, token=thisToken).assert_valid_auth()
         return pseudoObjects.dispatch_put_post(sdos_frontend, thisObject, request.headers)
 
-    if (sdos_frontend and len(request.data)):
-        try:
-            data = sdos_frontend.encrypt_bytes_object(o=request.data, name=thisObject)
-            headers = add_sdos_flag(request.headers)
-        except:
-            raise HttpError("Encryption failed", 412)
+    if (sdos_frontend and largeObjects.is_manifest_put(request.args, request.headers)):
+        data = requestHandling.get_manifest_data(request.args, request.data)
+        headers = request.headers
+    elif (sdos_frontend and has_request_body()):
+        data, headers = requestHandling.start_encryption(sdos_frontend, httpBackend.iterStream(request.stream),
+                                                         thisObject, request.headers)
     else:
-        data = request.data
+        data = get_request_body()
         headers = request.headers
 
     s, h, b = httpBackend.doGenericRequest(method=request.method, reqUrl=myUrl, reqHead=headers,
                                            reqArgs=request.args, reqData=data)
-    return Response(response=b, status=s, headers=strip_etag(h))
+    return Response(response=b, status=s, headers=requestHandling.strip_etag(h))
@@ -0,0 +1,455 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+
+		asyncio (aiohttp) implementation of the proxy server; an alternative to the flask app in apiServer
+	with the same API. Requests to swift are made with an async http client, so a single process can serve
+	many concurrent clients. Unencrypted data is passed through on the event loop.
+	Everything that blocks - key cascade operations, the swift client lib, en/decryption - runs on an executor.
+	The crypto generators read their input from a ChunkFeed that the event loop fills ahead of time
+
+"""
+
+import asyncio
+import collections
+import functools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from swiftclient.exceptions import ClientException
+
+from mcm.sdos import configuration
+from mcm.sdos.service import httpBackend, largeObjects, pseudoObjects, pseudoContainer, requestHandling
+from mcm.sdos.service.Exceptions import HttpError
+from mcm.sdos.swift.SwiftBackend import SwiftBackend
+
+log = logging.getLogger()
+
+# number of chunks that are read ahead from a stream before a crypto generator is advanced
+FEED_WINDOW = 4
+MAX_MANIFEST_SIZE = 8 << 20
+
+executor = ThreadPoolExecutor(max_workers=configuration.async_executor_workers)
+__session = None
+
+
+##############################################################################
+# executor / stream helpers
+##############################################################################
+async def in_executor(fn, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+class ChunkFeed(object):
+    """
+    input for a blocking crypto generator that runs on the executor, read from an aiohttp stream by the event loop.
+    the loop reads ahead (fill) before the generator is advanced, so that the executor threads normally
+    don't wait for the network. if the generator needs more data, it blocks until the loop delivered it
+    """
+
+    def __init__(self, stream, loop):
+        self.stream = stream
+        self.loop = loop
+        self.chunks = collections.deque()
+        self.eof = False
+
+    async def fill(self):
+        while not self.eof and len(self.chunks) < FEED_WINDOW:
+            chunk = await self.stream.read(configuration.stream_chunk_size)
+            if chunk:
+                self.chunks.append(chunk)
+            else:
+                self.eof = True
+
+    def __iter__(self):
+        while True:
+            if self.chunks:
+                yield self.chunks.popleft()
+            elif self.eof:
+                return
+            else:
+                asyncio.run_coroutine_threadsafe(self.fill(), self.loop).result()
+
+
+async def drive(gen, feed=None):
+    """
+    async iteration over a blocking generator
+    :param gen:
+    :param feed: the ChunkFeed that gen reads from
+    :return:
+    """
+    while True:
+        if feed:
+            await feed.fill()
+        chunk = await in_executor(next, gen, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+##############################################################################
+# swift client
+##############################################################################
+def get_session():
+    """
+    one keep-alive client session for all requests to swift, see httpBackend.getSession
+    :return:
+    """
+    global __session
+    if not __session or __session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=configuration.http_pool_maxsize,
+                                         keepalive_timeout=configuration.http_pool_idle_timeout)
+        __session = aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                          cookie_jar=aiohttp.DummyCookieJar())
+    return __session
+
+
+async def close_session(app):
+    if __session:
+        await __session.close()
+
+
+async def swift_request(method, url, headers, params=None, data=None, content_length=None):
+    """
+    :param content_length: length of a streamed body; it is sent chunked if this is None
+    :return: aiohttp.ClientResponse, which must be released by the caller
+    """
+    # unlike requests, aiohttp only accepts str header values; the SDOS flag is bytes
+    headers = dict((k, v.decode("utf-8") if isinstance(v, bytes) else v)
+                   for k, v in httpBackend.stripHeaders(headers).items())
+    if content_length is not None:
+        headers["Content-Length"] = str(content_length)
+    return await get_session().request(method, url, headers=headers, params=params, data=data,
+                                       allow_redirects=False)
+
+
+def get_request_body(request):
+    if not request.body_exists:
+        return None
+    return request.content
+
+
+async def stream_response(request, status, headers, chunks, first=None, backend_response=None):
+    """
+    send a streamed response to the client
+    :param chunks: async iterable of bytes
+    :param first: first chunk, if it was already retrieved
+    :param backend_response: released when done
+    :return:
+    """
+    try:
+        r = web.StreamResponse(status=status, headers=headers)
+        await r.prepare(request)
+        if first:
+            await r.write(first)
+        async for chunk in chunks:
+            await r.write(chunk)
+        await r.write_eof()
+        return r
+    finally:
+        if backend_response:
+            backend_response.release()
+
+
+async def stream_backend_response(request, resp):
+    """
+    pass the swift response on to the client unchanged
+    """
+    return await stream_response(request, resp.status, httpBackend.stripHopByHopHeaders(resp.headers),
+                                 resp.content.iter_chunked(configuration.stream_chunk_size), backend_response=resp)
+
+
+async def read_backend_response(resp):
+    """
+    :return: (status, headers, body) of a small response
+    """
+    try:
+        return resp.status, httpBackend.stripHopByHopHeaders(resp.headers), await resp.read()
+    finally:
+        resp.release()
+
+
+async def passthrough(request, url):
+    resp = await swift_request(request.method, url, request.headers, request.query, get_request_body(request),
+                               request.content_length)
+    return await stream_backend_response(request, resp)
+
+
+def to_web_response(r):
+    """
+    the pseudo object/container handlers return flask responses
+    """
+    if isinstance(r, tuple):
+        return web.Response(text=r[0], status=r[1])
+    return web.Response(body=r.get_data(), status=r.status_code, content_type=r.mimetype)
+
+
+def make_response(s, h, b):
+    return web.Response(body=b, status=s, headers=requestHandling.strip_length(h))
+
+
+##############################################################################
+# frontends
+##############################################################################
+def get_token(request):
+    return request.headers["X-Auth-Token"]
+
+
+async def get_sdos_frontend(containerName, swiftTenant, swiftToken):
+    return await in_executor(requestHandling.get_sdos_frontend, containerName=containerName,
+                             swiftTenant=swiftTenant, swiftToken=swiftToken)
+
+
+async def assert_valid_auth(thisAuth, thisToken):
+    await in_executor(lambda: SwiftBackend(tenant=thisAuth, token=thisToken).assert_valid_auth())
+
+
+def get_release(resp):
+    """
+    the swift response is released on the event loop; requestHandling calls this from the executor
+    """
+    loop = asyncio.get_event_loop()
+    return lambda: loop.call_soon_threadsafe(resp.release)
+
+
+##############################################################################
+# middleware
+##############################################################################
+@web.middleware
+async def error_middleware(request, handler):
+    """
+    see apiServer.handle_invalid_usage
+    """
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except ClientException as e:
+        log.exception("unhandled exception reached API handler")
+        if (401 == e.http_status):
+            return web.Response(text="not authenticated", status=401)
+        return web.Response(text=e.__str__(), status=e.http_status)
+    except HttpError as e:
+        log.exception("unhandled exception reached API handler")
+        return web.Response(text=e.to_string(), status=e.status_code)
+    except Exception as e:
+        log.exception("unhandled exception reached API handler")
+        return web.Response(text="{}".format(e), status=500)
+
+
+async def add_mcm_id(request, response):
+    response.headers["MCM-Service-Type"] = "SDOS"
+
+
+##############################################################################
+# auth
+##############################################################################
+async def handle_auth(request):
+    s, h, b = await read_backend_response(
+        await swift_request("GET", configuration.swift_auth_url, request.headers))
+    if 200 == s:
+        requestHandling.replaceStorageUrl(swiftResponse=h)
+    return make_response(s, h, b)
+
+
+async def handle_auth_v2(request):
+    s, h, b = await read_backend_response(
+        await swift_request("POST", configuration.swift_auth_url, request.headers, data=await request.read()))
+    if 200 == s:
+        return web.Response(body=json.dumps(requestHandling.replaceStorageUrl_authv2(b)), status=s)
+    return make_response(s, h, b)
+
+
+##############################################################################
+# account / container: passthrough
+##############################################################################
+async def handle_account(request):
+    thisAuth = request.match_info["thisAuth"]
+    return await passthrough(request, requestHandling.get_proxy_request_url(thisAuth))
+
+
+async def handle_container(request):
+    thisAuth = request.match_info["thisAuth"]
+    thisContainer = request.match_info["thisContainer"]
+    if thisContainer == pseudoContainer.PSEUDO_CONTAINER_NAME:
+        return web.Response(text="", status=200)
+
+    r = await passthrough(request, requestHandling.get_proxy_request_url(thisAuth, thisContainer))
+    requestHandling.container_request_done(request.method, r.status, thisAuth, thisContainer)
+    return r
+
+
+##############################################################################
+# objects
+##############################################################################
+async def handle_object_get(request):
+    thisAuth = request.match_info["thisAuth"]
+    thisContainer = request.match_info["thisContainer"]
+    thisObject = request.match_info["thisObject"]
+
+    if thisContainer == pseudoContainer.PSEUDO_CONTAINER_NAME:
+        return to_web_response(await in_executor(pseudoContainer.dispatch, thisObject=thisObject))
+
+    sdos_frontend = await get_sdos_frontend(thisContainer, thisAuth, get_token(request))
+
+    if requestHandling.is_pseudo_object(sdos_frontend, thisObject):
+        await assert_valid_auth(thisAuth, get_token(request))
+        return to_web_response(await in_executor(pseudoObjects.dispatch_get_head, sdos_frontend, thisObject))
+
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    if requestHandling.is_decrypted_get(sdos_frontend, request.method, request.query):
+        return await get_decrypted_object(request, sdos_frontend, thisAuth, myUrl, thisObject)
+    return await passthrough(request, myUrl)
+
+
+async def get_decrypted_object(request, sdos_frontend, thisAuth, myUrl, thisObject):
+    """
+    see apiServer.get_decrypted_object
+    """
+    reqHead = dict(request.headers)
+    byteRange = requestHandling.parse_byte_range(reqHead.pop("Range", None))
+    if byteRange:
+        r = await get_decrypted_object_range(request, sdos_frontend, myUrl, thisObject, reqHead, byteRange)
+        if r:
+            return r
+
+    resp = await swift_request("GET", myUrl, reqHead, request.query)
+    h = httpBackend.stripHopByHopHeaders(resp.headers)
+    if requestHandling.is_large_object_response(resp.status, h):
+        resp.release()
+        get_url, get_frontend = requestHandling.get_segment_accessors(thisAuth, get_token(request))
+        decrypted_b, first = await in_executor(requestHandling.start_large_object_decryption, myUrl, h, reqHead,
+                                               get_url, get_frontend)
+        return await stream_response(request, 200, requestHandling.get_decrypted_headers(h), drive(decrypted_b),
+                                     first=first)
+    if requestHandling.has_encrypted_body(resp.status, h):
+        feed = ChunkFeed(resp.content, asyncio.get_event_loop())
+        await feed.fill()
+        decrypted_b, first = await in_executor(requestHandling.start_decryption,
+                                               lambda: sdos_frontend.decrypt_stream(feed, thisObject),
+                                               get_release(resp))
+        return await stream_response(request, 200, requestHandling.get_decrypted_headers(h),
+                                     drive(decrypted_b, feed), first=first, backend_response=resp)
+    return await stream_backend_response(request, resp)
+
+
+async def get_decrypted_object_range(request, sdos_frontend, myUrl, thisObject, reqHead, byteRange):
+    """
+    see apiServer.get_decrypted_object_range
+    """
+    s, h, head = await read_backend_response(
+        await swift_request("GET", myUrl, requestHandling.get_range_head_request(reqHead), request.query))
+    plan = requestHandling.plan_range(s, h, head, reqHead, byteRange)
+    if not plan:
+        return None
+    if plan.status == 416:
+        return web.Response(status=416, headers=plan.headers)
+
+    resp = await swift_request("GET", myUrl, plan.rangeHead, request.query)
+    if resp.status != 206:
+        resp.release()
+        return None
+    feed = ChunkFeed(resp.content, asyncio.get_event_loop())
+    await feed.fill()
+    decrypted_b, first = await in_executor(requestHandling.start_decryption,
+                                           lambda: sdos_frontend.decrypt_range_stream(head, feed, thisObject,
+                                                                                      plan.first),
+                                           get_release(resp))
+    return await stream_response(request, 206, plan.headers, drive(decrypted_b, feed), first=first,
+                                 backend_response=resp)
+
+
+async def handle_object_delete(request):
+    thisAuth = request.match_info["thisAuth"]
+    thisContainer = request.match_info["thisContainer"]
+    thisObject = request.match_info["thisObject"]
+
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    sdos_frontend = await get_sdos_frontend(thisContainer, thisAuth, get_token(request))
+    get_url, get_frontend = requestHandling.get_segment_accessors(thisAuth, get_token(request))
+    segments = await in_executor(requestHandling.get_segments_for_delete, sdos_frontend, request.query, myUrl,
+                                 dict(request.headers), get_url)
+
+    s, h, b = await read_backend_response(await swift_request(request.method, myUrl, request.headers, request.query))
+    await in_executor(requestHandling.delete_keys, s, sdos_frontend, thisObject, segments, get_frontend)
+    return make_response(s, h, b)
+
+
+async def handle_object_put(request):
+    """
+    see apiServer.handle_object_put
+    """
+    thisAuth = request.match_info["thisAuth"]
+    thisContainer = request.match_info["thisContainer"]
+    thisObject = request.match_info["thisObject"]
+    thisToken = get_token(request)
+
+    if thisContainer == pseudoContainer.PSEUDO_CONTAINER_NAME:
+        await assert_valid_auth(thisAuth, thisToken)
+        return to_web_response(await in_executor(pseudoContainer.dispatch, thisObject=thisObject, data=request.headers))
+
+    myUrl = requestHandling.get_proxy_request_url(thisAuth, thisContainer, thisObject)
+    sdos_frontend = await get_sdos_frontend(thisContainer, thisAuth, thisToken)
+
+    if requestHandling.is_pseudo_object(sdos_frontend, thisObject):
+        await assert_valid_auth(thisAuth, thisToken)
+        return to_web_response(
+            await in_executor(pseudoObjects.dispatch_put_post, sdos_frontend, thisObject, request.headers))
+
+    content_length = None
+    if (sdos_frontend and largeObjects.is_manifest_put(request.query, request.headers)):
+        data = requestHandling.get_manifest_data(request.query, await request.read())
+        headers = request.headers
+    elif (sdos_frontend and request.body_exists):
+        feed = ChunkFeed(request.content, asyncio.get_event_loop())
+        encrypted, headers = await in_executor(requestHandling.start_encryption, sdos_frontend, feed, thisObject,
+                                               request.headers)
+        data = drive(encrypted, feed)
+    else:
+        data = get_request_body(request)
+        content_length = request.content_length
+        headers = request.headers
+
+    s, h, b = await read_backend_response(
+        await swift_request(request.method, myUrl, headers, request.query, data, content_length))
+    return make_response(s, requestHandling.strip_etag(h), b)
+
+
+##############################################################################
+# application
+##############################################################################
+def make_app():
+    app = web.Application(middlewares=[error_middleware], client_max_size=MAX_MANIFEST_SIZE)
+    r = app.router
+    r.add_route("GET", "/auth/1.0", handle_auth)
+    r.add_route("GET", "/auth/v1.0", handle_auth)
+    r.add_route("POST", "/v2.0/tokens", handle_auth_v2)
+    for method in ["HEAD", "POST", "GET", "PUT", "DELETE"]:
+        r.add_route(method, "/v1/AUTH_{thisAuth}", handle_account)
+        r.add_route(method, "/v1/AUTH_{thisAuth}/{thisContainer}", handle_container)
+    objectPath = "/v1/AUTH_{thisAuth}/{thisContainer}/{thisObject:.+}"
+    for method, handler in [("GET", handle_object_get), ("HEAD", handle_object_get),
+                            ("DELETE", handle_object_delete),
+                            ("PUT", handle_object_put), ("POST", handle_object_put)]:
+        r.add_route(method, objectPath, handler)
+    app.on_response_prepare.append(add_mcm_id)
+    app.on_cleanup.append(close_session)
+    return app
+
+
+def run():
+    web.run_app(make_app(), host=configuration.my_bind_host, port=int(configuration.my_endpoint_port))
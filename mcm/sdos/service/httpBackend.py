@@ -11,32 +11,86 @@
 	This software may be modified and distributed under the terms
 	of the MIT license.  See the LICENSE file for details.
 """
+import http.cookiejar
 import logging
+import time
+import urllib.parse
+from threading import Lock
+
 import requests
+from requests.adapters import HTTPAdapter
 from mcm.sdos import configuration
 
 log = logging.getLogger(__name__)
 
+# backend host -> [session, time of last use]
+__sessions = dict()
+__sessions_lock = Lock()
+
 def __safe_dict_pop(d, i):
 	try:
 		d.pop(i)
 	except:
 		pass
 
+# connection specific headers; they are not forwarded between client and swift
+HOP_BY_HOP_HEADERS = ['connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+					  'transfer-encoding', 'upgrade']
+
+
+def stripHopByHopHeaders(headers):
+	return dict((k, v) for k, v in dict(headers).items() if k.lower() not in HOP_BY_HOP_HEADERS)
+
+
 def stripHeaders(headers):
-	headers = dict(headers)
+	headers = stripHopByHopHeaders(headers)
 	__safe_dict_pop(headers, 'Host')
 	__safe_dict_pop(headers, 'User-Agent')
 	__safe_dict_pop(headers, 'Content-Length')
 	return headers
 
 
+def __newSession():
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=configuration.http_pool_maxsize)
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	# the session is shared between all clients; don't let cookies leak from one request to another
+	session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+	return session
+
+
+def getSession(url):
+	"""
+	one keep-alive session with a connection pool per backend host, shared by all threads/greenlets.
+	sessions that were idle for longer than http_pool_idle_timeout are replaced, since the backend
+	has probably closed their connections by then
+	:param url: request url
+	:return: requests.Session
+	"""
+	u = urllib.parse.urlsplit(url)
+	host = (u.scheme, u.netloc)
+	now = time.monotonic()
+	with __sessions_lock:
+		entry = __sessions.get(host)
+		if entry and now - entry[1] > configuration.http_pool_idle_timeout:
+			log.debug("replacing idle session for {}".format(host))
+			entry[0].close()
+			entry = None
+		if not entry:
+			entry = [__newSession(), now]
+			__sessions[host] = entry
+		entry[1] = now
+		return entry[0]
+
+
 def doAuthGetToken(reqHead, method, data=None):
 	reqHead = stripHeaders(headers=reqHead)
 	log.debug("doAuthGetToken {}".format(reqHead))
-	r = requests.request(method=method, url=configuration.swift_auth_url, headers=reqHead, data=data)
+	r = getSession(configuration.swift_auth_url).request(method=method, url=configuration.swift_auth_url,
+													   headers=reqHead, data=data)
 	b = r.content
-	h = dict(r.headers)
+	h = stripHopByHopHeaders(r.headers)
 	s = r.status_code
 	log.debug("got: {}, {}, {}".format(b, h, s))
 	return (s, h, b)
@@ -44,10 +98,94 @@ def doAuthGetToken(reqHead, method, data=None):
 
 def doGenericRequest(method, reqUrl, reqHead, reqArgs, reqData):
 	reqHead = stripHeaders(headers=reqHead)
-	r = requests.request(method=method, url=reqUrl, headers=reqHead, params=reqArgs, data=reqData)
+	r = getSession(reqUrl).request(method=method, url=reqUrl, headers=reqHead, params=reqArgs, data=reqData)
 	#log.debug("doGeneric {}, url: {}, head: {}, args: {}, data: {}".format(method, reqUrl, reqHead, reqArgs, reqData))
 	b = r.content
-	h = dict(r.headers)
+	h = stripHopByHopHeaders(r.headers)
 	s = r.status_code
 	#log.debug("doGeneric {} swift response: {}, {}, {}".format(method, s, h, b))
 	return (s, h, b)
+
+
+def doStreamingRequest(method, reqUrl, reqHead, reqArgs, reqData, decodeContent=True):
+	"""
+	like doGenericRequest, but the response body is not loaded into memory.
+	the connection is released once the returned body is exhausted or closed
+	:param reqData: bytes, an iterable of bytes (see requestBody) or None
+	:param decodeContent: undo the Content-Encoding (gzip...) of the response.
+		False returns the bytes unchanged, for passing them on together with the response headers
+	:return: (status, headers, ResponseBody)
+	"""
+	reqHead = stripHeaders(headers=reqHead)
+	r = getSession(reqUrl).request(method=method, url=reqUrl, headers=reqHead, params=reqArgs, data=reqData,
+								   stream=True)
+	h = stripHopByHopHeaders(r.headers)
+	s = r.status_code
+	return (s, h, ResponseBody(r, decodeContent))
+
+
+class ResponseBody(object):
+	"""
+	iterable body of a streamed response. close() releases the connection, also if the body was never
+	iterated - closing a generator that was not started doesn't run its finally block
+	"""
+
+	def __init__(self, r, decodeContent):
+		self.r = r
+		self.decodeContent = decodeContent
+
+	def __iter__(self):
+		try:
+			if self.decodeContent:
+				chunks = self.r.iter_content(chunk_size=configuration.stream_chunk_size)
+			else:
+				chunks = self.r.raw.stream(configuration.stream_chunk_size, decode_content=False)
+			for chunk in chunks:
+				yield chunk
+		finally:
+			self.close()
+
+	def close(self):
+		self.r.close()
+
+
+def iterStream(stream):
+	"""
+	read a file-like object (e.g. the incoming request body) in chunks
+	:param stream:
+	:return: generator of bytes
+	"""
+	while True:
+		chunk = stream.read(configuration.stream_chunk_size)
+		if not chunk:
+			return
+		yield chunk
+
+
+class SizedStream(object):
+	"""
+	iterable request body of known length. requests sends it with a Content-Length header
+	instead of chunked transfer encoding
+	"""
+
+	def __init__(self, stream, length):
+		self.stream = stream
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		return iterStream(self.stream)
+
+
+def requestBody(stream, length):
+	"""
+	forward an incoming request body without reading it into memory
+	:param stream: file-like
+	:param length: content length, or None for a chunked request
+	:return:
+	"""
+	if length is None:
+		return iterStream(stream)
+	return SizedStream(stream, length)
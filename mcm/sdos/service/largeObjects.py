@@ -0,0 +1,273 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+	Handle swift large objects (static SLO / dynamic DLO) in SDOS containers
+	the manifest is stored unencrypted since swift has to read it. every segment is a regular object that is
+	encrypted under its own key when it is uploaded. on download, the segments are fetched and decrypted
+	individually and concurrently, and returned in order
+
+"""
+
+import collections
+import itertools
+import json
+import logging
+import queue
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from mcm.sdos import configuration
+from mcm.sdos.service import httpBackend
+from mcm.sdos.service.Exceptions import HttpError
+
+SLO_HEADER = "X-Static-Large-Object"
+DLO_HEADER = "X-Object-Manifest"
+MANIFEST_ARG = "multipart-manifest"
+
+def __get_header(headers, name):
+    """
+    case insensitive lookup; the response headers from httpBackend are plain dicts
+    """
+    for k, v in headers.items():
+        if k.lower() == name.lower():
+            return v
+    return None
+
+
+##############################################################################
+# detection
+##############################################################################
+def is_manifest_put(args, headers):
+    return args.get(MANIFEST_ARG) == "put" or bool(__get_header(headers, DLO_HEADER))
+
+
+def is_raw_manifest_request(args):
+    """
+    the client requests the manifest itself, not the object contents
+    """
+    return args.get(MANIFEST_ARG) == "get"
+
+
+def is_manifest_response(headers):
+    return str(__get_header(headers, SLO_HEADER)).lower() == "true" or bool(__get_header(headers, DLO_HEADER))
+
+
+##############################################################################
+# upload
+##############################################################################
+def rewrite_slo_manifest(body):
+    """
+    swift checks the etag and size of each segment against the manifest. the stored segments are ciphertexts,
+    so the values that the client computed on the plaintext can't match; null disables these checks
+    :param body: SLO manifest from the client
+    :return: the manifest for swift
+    """
+    try:
+        segments = json.loads(body.decode("utf-8"))
+    except ValueError:
+        raise HttpError("invalid SLO manifest", 400)
+    for segment in segments:
+        if "range" in segment:
+            raise HttpError("segment ranges are not supported in SDOS containers", 400)
+        if "path" in segment:
+            segment["etag"] = None
+            segment["size_bytes"] = None
+    return json.dumps(segments).encode("utf-8")
+
+
+##############################################################################
+# segment lists
+##############################################################################
+def __split_path(path):
+    """
+    :param path: /container/object
+    :return: (container, object)
+    """
+    container, _, obj = path.lstrip("/").partition("/")
+    return container, obj
+
+
+def get_slo_segments(url, reqHead, get_url):
+    """
+    :param url: of the manifest object
+    :param reqHead:
+    :param get_url: function (container, object) -> swift url
+    :return: list of (container, object) of all segments, nested SLOs are resolved
+    """
+    s, h, b = httpBackend.doGenericRequest(method="GET", reqUrl=url, reqHead=reqHead,
+                                           reqArgs={MANIFEST_ARG: "get"}, reqData=None)
+    if s != 200:
+        raise HttpError("unable to read SLO manifest", s)
+    segments = []
+    for segment in json.loads(b.decode("utf-8")):
+        if segment.get("range"):
+            raise HttpError("segment ranges are not supported in SDOS containers", 400)
+        container, obj = __split_path(segment["name"])
+        if segment.get("sub_slo"):
+            segments.extend(get_slo_segments(get_url(container, obj), reqHead, get_url))
+        else:
+            segments.append((container, obj))
+    return segments
+
+
+def get_dlo_segments(manifest, reqHead, get_url):
+    """
+    :param manifest: value of the X-Object-Manifest header: <container>/<prefix>
+    :param reqHead:
+    :param get_url: function (container, object) -> swift url
+    :return: list of (container, object) of all segments; i.e. all objects with the prefix in name order
+    """
+    container, prefix = __split_path(urllib.parse.unquote(manifest))
+    segments = []
+    marker = ""
+    while True:
+        s, h, b = httpBackend.doGenericRequest(method="GET", reqUrl=get_url(container, None), reqHead=reqHead,
+                                               reqArgs={"prefix": prefix, "format": "json", "marker": marker},
+                                               reqData=None)
+        if s == 204:
+            return segments
+        if s != 200:
+            raise HttpError("unable to list DLO segments", s)
+        listing = json.loads(b.decode("utf-8"))
+        if not listing:
+            return segments
+        segments.extend((container, o["name"]) for o in listing)
+        marker = listing[-1]["name"]
+
+
+def get_segments(url, headers, reqHead, get_url):
+    """
+    :param url: of the manifest object
+    :param headers: response headers of the manifest object
+    :return: list of (container, object)
+    """
+    dlo = __get_header(headers, DLO_HEADER)
+    if dlo:
+        return get_dlo_segments(dlo, reqHead, get_url)
+    return get_slo_segments(url, reqHead, get_url)
+
+
+##############################################################################
+# download
+##############################################################################
+__SEGMENT_DONE = object()
+
+
+def __put(q, item, stop):
+    """
+    blocks while the queue is full
+    :return: False if the download was stopped
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def __fetch_segment(segment, reqHead, get_url, get_frontend, out, stop):
+    """
+    stream one segment into the queue out: its plaintext chunks, then __SEGMENT_DONE or an exception
+    """
+    container, obj = segment
+    try:
+        s, h, b = httpBackend.doStreamingRequest(method="GET", reqUrl=get_url(container, obj), reqHead=reqHead,
+                                                 reqArgs={}, reqData=None)
+        try:
+            if s != 200:
+                raise HttpError("segment {}/{} not available".format(container, obj), 409)
+            frontend = get_frontend(container)
+            plain = b
+            if frontend and h.get("Content-Length") != "0":
+                plain = frontend.decrypt_stream(b, obj)
+            for chunk in plain:
+                if not __put(out, chunk, stop):
+                    return
+        finally:
+            b.close()
+        __put(out, __SEGMENT_DONE, stop)
+    except Exception as e:
+        __put(out, e, stop)
+
+
+def stream_segments(segments, reqHead, get_url, get_frontend):
+    """
+    fetch and decrypt up to segment_fetch_workers segments concurrently. Each of them is streamed and reads ahead
+    at most segment_readahead_chunks chunks, so the memory per request is bounded independent of the segment size.
+    the segments are returned in order
+    :param segments: list of (container, object)
+    :param reqHead:
+    :param get_url: function (container, object) -> swift url
+    :param get_frontend: function container -> SDOS frontend or False
+    :return: generator of plaintext bytes
+    """
+    # per request, so that a slow client only holds up its own segments
+    executor = ThreadPoolExecutor(max_workers=configuration.segment_fetch_workers)
+    stop = threading.Event()
+    segments = iter(segments)
+    pending = collections.deque()
+
+    def fetch_next():
+        for segment in itertools.islice(segments, 1):
+            q = queue.Queue(maxsize=configuration.segment_readahead_chunks)
+            executor.submit(__fetch_segment, segment, reqHead, get_url, get_frontend, q, stop)
+            pending.append(q)
+
+    try:
+        for _ in range(configuration.segment_fetch_workers):
+            fetch_next()
+        while pending:
+            q = pending.popleft()
+            while True:
+                chunk = q.get()
+                if chunk is __SEGMENT_DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            fetch_next()
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+##############################################################################
+# delete
+##############################################################################
+def get_segments_for_delete(url, reqHead, get_url):
+    """
+    a delete with multipart-manifest=delete removes the SLO segments as well; their keys need to be deleted
+    :return: list of (container, object) or an empty list if the object is no SLO
+    """
+    s, h, b = httpBackend.doGenericRequest(method="HEAD", reqUrl=url, reqHead=reqHead, reqArgs={}, reqData=None)
+    if s != 200 or str(__get_header(h, SLO_HEADER)).lower() != "true":
+        return []
+    return get_slo_segments(url, reqHead, get_url)
+
+
+def delete_segment_keys(segments, get_frontend):
+    """
+    the keys of the segments are deleted in one batch per container, i.e. one re-keying of each cascade
+    """
+    byContainer = collections.OrderedDict()
+    for container, obj in segments:
+        byContainer.setdefault(container, []).append(obj)
+    for container, objs in byContainer.items():
+        frontend = get_frontend(container)
+        if frontend:
+            logging.info("deleting keys of {} SLO segments in container {}".format(len(objs), container))
+            frontend.deleteObjects(objs)
@@ -40,8 +40,22 @@ def extract_passphrase(msg):
         return None
 
 
+def is_remote(frontend):
+    """
+    in cascade_mode "owner", the operations run in the cascade owner process, see Frontend.RemoteSdosFrontend
+    """
+    return hasattr(frontend, "dispatch_pseudo_object")
+
+
+def remote_dispatch(frontend, method, thisObject, data=None):
+    body, status, mimetype = frontend.dispatch_pseudo_object(method, thisObject, data)
+    return Response(response=body, status=status, mimetype=mimetype)
+
+
 def dispatch_get_head(frontend, thisObject):
     logging.debug("GET/HEAD request for MCM pseudo object: {}".format(thisObject))
+    if is_remote(frontend):
+        return remote_dispatch(frontend, "get_head", thisObject)
     is_operation = lambda name: (thisObject[len(PSEUDO_OBJECT_PREFIX):] == name)
     ###############################################################################
     # statistics, visualization
@@ -85,6 +99,8 @@ def dispatch_get_head(frontend, thisObject):
 
 def dispatch_put_post(frontend, thisObject, data):
     logging.debug("PUT/POST request for MCM pseudo object: {}, data: {}".format(thisObject, data))
+    if is_remote(frontend):
+        return remote_dispatch(frontend, "put_post", thisObject, dict((k.lower(), v) for k, v in data.items()))
     is_operation = lambda name: (thisObject[len(PSEUDO_OBJECT_PREFIX):] == name)
     p = extract_passphrase(data)
 
@@ -0,0 +1,383 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+
+		request handling that is shared by the flask (apiServer) and the aiohttp (asyncServer) proxy servers.
+	Nothing in here depends on the web framework: the functions get the request data as parameters and return
+	data, headers or decisions; the servers only do the I/O. Functions may block, the async server calls them
+	on its executor
+
+"""
+
+import collections
+import json
+import logging
+
+from mcm.sdos import configuration
+from mcm.sdos.crypto import DataCrypt
+from mcm.sdos.parallelExecution.CascadeOwner import CascadeOwnerClient
+from mcm.sdos.parallelExecution.Pool import SwiftPool, FEPool, ContainerPropertiesPool
+from mcm.sdos.service import largeObjects, pseudoObjects, sharding
+from mcm.sdos.service.Exceptions import HttpError
+
+log = logging.getLogger()
+
+# a byte range request of a range-readable object. status 416 (with headers) or 206 (with headers,
+# the plaintext offset and the request headers for the ciphertext range)
+RangePlan = collections.namedtuple("RangePlan", ["status", "headers", "first", "rangeHead"])
+
+
+##############################################################################
+# urls / auth
+##############################################################################
+def get_proxy_request_url(thisAuth, thisContainer=None, thisObject=None):
+    """
+    create the url under which this API proxy will reach its swift back end. basically this is the request url with a different hostname
+    :param thisAuth:
+    :param thisContainer:
+    :param thisObject:
+    :return:
+    """
+    u = configuration.swift_store_url.format(thisAuth)
+    if thisContainer:
+        u += "/" + thisContainer
+        if thisObject:
+            u += "/" + thisObject
+    return u
+
+
+def replaceStorageUrl(swiftResponse):
+    swiftUrl = swiftResponse['X-Storage-Url']
+    if not swiftUrl.startswith(configuration.swift_store_url.format("")):
+        raise HttpError("swift returned wrong storage URL")
+    swiftAuthName = swiftUrl[len(configuration.swift_store_url.format("")):]
+    #swiftAuthName = "mcmdemo" # TODO: change for ceph / swift
+    swiftResponse['X-Storage-Url'] = configuration.my_endpoint_store_url.format(swiftAuthName)
+
+
+def replaceStorageUrl_authv2(auth_response):
+    """
+    here we parse the response from the auth provider and replace the provided swift store URL
+    the response contains a token and some metadata which we leave intact. there is also an array of all
+    available services. we replace this whole dict with only our SDOS endpoint
+    :param auth_response:
+    :return:
+    """
+    ar = json.loads(auth_response.decode("utf-8"))
+    tenant_id = ar["access"]["token"]["tenant"]["id"]
+    my_endpoint = [{'adminURL': 'http://129.69.209.131:8080',
+                    'region': 'RegionOne',
+                    'publicURL': configuration.my_endpoint_store_url.format(tenant_id),
+                    'id': '1dc55ed5c82f4cd9a98d9f059729422f',
+                    'internalURL': 'http://129.69.209.131:8080/v1/AUTH_ea012720129645d9b32b23b4af5c154f'
+                    }]
+    log.debug("Whole auth data: {}".format(ar))
+    catalog = ar["access"]["serviceCatalog"]
+    log.debug("All catalog: {}".format(catalog))
+
+    for service in catalog:
+        if (service["type"] == "object-store" and service["name"] == "swift"):
+            log.debug("This swift service: {}".format(service))
+            log.debug("replacing the endpoint for this swift service...")
+            service["endpoints"] = my_endpoint
+
+    return ar
+
+
+##############################################################################
+# headers
+##############################################################################
+def strip_etag(h):
+    try:
+        h.pop("Etag")
+    except:
+        pass
+    return h
+
+
+def strip_length(h):
+    """
+    the length of en/decrypted streams differs from the length swift/the client reported;
+    the response is sent with chunked encoding instead
+    :param h:
+    :return:
+    """
+    h = dict(h)
+    h.pop("Content-Length", None)
+    h.pop("Transfer-Encoding", None)
+    return h
+
+
+def add_sdos_flag(h):
+    i = dict(h)
+    i["X-Object-Meta-MCM-Content"] = DataCrypt.HEADER_V2
+    return i
+
+
+def get_decrypted_headers(h):
+    """
+    response headers for a decrypted object; its length and etag differ from the stored object
+    """
+    return strip_length(strip_etag(h))
+
+
+##############################################################################
+# frontends
+##############################################################################
+def get_sdos_frontend(containerName, swiftTenant, swiftToken):
+    """
+    TODO: we really need a cascade-pool here and maybe locking in the cascade...
+    :param containerName:
+    :param swiftTenant:
+    :param swiftToken:
+    :return:
+    """
+
+    sp = SwiftPool()
+    # the container properties are cached, so swift doesn't see this token before the key cascade is used
+    sb = sp.getVerifiedConn(swiftTenant, swiftToken)
+
+    fp = FEPool()
+
+    if ContainerPropertiesPool().getProperties(swiftTenant, containerName, sb)["sdos_type"]:
+        if configuration.cascade_mode == "owner":
+            return CascadeOwnerClient().getFE(containerName, swiftTenant, swiftToken)
+        return fp.getFE(containerName, swiftTenant, swiftToken)
+    else:
+        return False
+
+
+def get_segment_accessors(thisAuth, token):
+    """
+    segments are processed outside of the request context, so the token is bound here.
+    in cascade_mode "sharded", segment containers that another process owns are accessed through that process
+    :param thisAuth:
+    :param token:
+    :return: functions (container, object) -> swift url and container -> SDOS frontend or False
+    """
+
+    def get_url(container, obj):
+        shard = sharding.get_remote_owner(thisAuth, container)
+        if shard is not None:
+            return sharding.get_internal_object_url(shard, thisAuth, container, obj)
+        return get_proxy_request_url(thisAuth, container, obj)
+
+    def get_frontend(container):
+        shard = sharding.get_remote_owner(thisAuth, container)
+        if shard is not None:
+            return sharding.ShardFrontend(shard, thisAuth, container, token)
+        return get_sdos_frontend(containerName=container, swiftTenant=thisAuth, swiftToken=token)
+
+    return get_url, get_frontend
+
+
+def is_pseudo_object(sdos_frontend, thisObject):
+    return bool(sdos_frontend) and thisObject.startswith(pseudoObjects.PSEUDO_OBJECT_PREFIX)
+
+
+##############################################################################
+# containers
+##############################################################################
+def container_request_done(method, status, thisAuth, thisContainer):
+    if (method in ("PUT", "POST", "DELETE") and 200 <= status < 300):
+        # the SDOS properties of this container may have changed
+        ContainerPropertiesPool().invalidate(thisAuth, thisContainer)
+
+
+##############################################################################
+# object GET
+##############################################################################
+def is_decrypted_get(sdos_frontend, method, args):
+    """
+    raw manifest requests and HEAD requests are passed through
+    """
+    return bool(sdos_frontend) and method == "GET" and not largeObjects.is_raw_manifest_request(args)
+
+
+def is_large_object_response(s, h):
+    return s == 200 and largeObjects.is_manifest_response(h)
+
+
+def has_encrypted_body(s, h):
+    """
+    error responses and empty objects are passed on unchanged
+    """
+    return s == 200 and h.get("Content-Length") != "0"
+
+
+def parse_byte_range(rangeHeader):
+    """
+    parse a Range header with a single byte range, e.g. "bytes=0-99", "bytes=100-" or "bytes=-100"
+    :param rangeHeader:
+    :return: (first, last) where one of them may be None, or None if this isn't a single byte range
+    """
+    if not rangeHeader or not rangeHeader.startswith("bytes="):
+        return None
+    spec = rangeHeader[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, last = spec.split("-", 1)
+    try:
+        first = int(first) if first.strip() else None
+        last = int(last) if last.strip() else None
+    except ValueError:
+        return None
+    if (first is None and last is None) or (first is not None and last is not None and last < first):
+        return None
+    return first, last
+
+
+def resolve_byte_range(byteRange, length):
+    """
+    :param byteRange: from parse_byte_range
+    :param length: object length
+    :return: (first, last) byte positions, inclusive. None if the range can't be satisfied
+    """
+    first, last = byteRange
+    if first is None:
+        # suffix range: the last n bytes
+        first = max(0, length - last)
+        last = length - 1
+    elif last is None or last >= length:
+        last = length - 1
+    if first >= length or first > last:
+        return None
+    return first, last
+
+
+def get_range_head_request(reqHead):
+    """
+    a range request first retrieves the object header, to check the format and get the length
+    :param reqHead: request headers without the Range header
+    :return: headers for the request of the object header
+    """
+    headReq = dict(reqHead)
+    headReq["Range"] = "bytes=0-{}".format(DataCrypt.HEADER_LENGTH_V2 - 1)
+    return headReq
+
+
+def plan_range(s, h, head, reqHead, byteRange):
+    """
+    :param s: status of the get_range_head_request response
+    :param h: headers of the get_range_head_request response
+    :param head: body of the get_range_head_request response
+    :param reqHead: request headers without the Range header
+    :param byteRange: from parse_byte_range
+    :return: RangePlan, or None if the object is not range-readable and has to be returned completely
+    """
+    if s not in (200, 206) or largeObjects.is_manifest_response(h) or not DataCrypt.isRangeReadable(head):
+        return None
+    if s == 206:
+        length = int(h["Content-Range"].rpartition("/")[2]) - DataCrypt.HEADER_LENGTH_V2
+    else:
+        length = len(head) - DataCrypt.HEADER_LENGTH_V2
+    h = get_decrypted_headers(h)
+    h.pop("Content-Range", None)
+
+    resolvedRange = resolve_byte_range(byteRange, length)
+    if not resolvedRange:
+        h["Content-Range"] = "bytes */{}".format(length)
+        return RangePlan(416, h, None, None)
+    first, last = resolvedRange
+
+    h["Content-Range"] = "bytes {}-{}/{}".format(first, last, length)
+    h["Content-Length"] = str(last - first + 1)
+    rangeHead = dict(reqHead)
+    rangeHead["Range"] = "bytes={}-{}".format(DataCrypt.HEADER_LENGTH_V2 + first, DataCrypt.HEADER_LENGTH_V2 + last)
+    return RangePlan(206, h, first, rangeHead)
+
+
+def start_decryption(decrypt, close):
+    """
+    the first chunk is decrypted before the response starts, so that key/header errors still result in a 412
+    :param decrypt: returns the generator of plaintext chunks
+    :param close: releases the swift response if decryption fails
+    :return: (generator, first chunk)
+    """
+    try:
+        decrypted_b = decrypt()
+        first = next(decrypted_b, b"")
+    except:
+        close()
+        raise HttpError("Decryption failed", 412)
+    return decrypted_b, first
+
+
+def start_large_object_decryption(myUrl, h, reqHead, get_url, get_frontend):
+    """
+    SLO/DLO: the segments are fetched and decrypted individually, each with the frontend of its container
+    :param myUrl:
+    :param h: response headers of the manifest object
+    :param reqHead: request headers without the Range header
+    :return: (generator, first chunk)
+    """
+    try:
+        segments = largeObjects.get_segments(myUrl, h, reqHead, get_url)
+        decrypted_b = largeObjects.stream_segments(segments, reqHead, get_url, get_frontend)
+        first = next(decrypted_b, b"")
+    except HttpError:
+        raise
+    except:
+        raise HttpError("Decryption failed", 412)
+    return decrypted_b, first
+
+
+##############################################################################
+# object PUT
+##############################################################################
+def get_manifest_data(args, data):
+    """
+    large object manifests are stored unencrypted; the segments are encrypted individually
+    """
+    if args.get(largeObjects.MANIFEST_ARG) == "put":
+        return largeObjects.rewrite_slo_manifest(data)
+    return data
+
+
+def start_encryption(sdos_frontend, chunks, thisObject, headers):
+    """
+    :param chunks: iterable of the plaintext request body
+    :param headers: request headers
+    :return: (generator of ciphertext chunks, headers for the swift request)
+    """
+    try:
+        data = sdos_frontend.encrypt_stream(chunks=chunks, name=thisObject, headers=headers)
+    except:
+        raise HttpError("Encryption failed", 412)
+    return data, strip_length(add_sdos_flag(headers))
+
+
+##############################################################################
+# object DELETE
+##############################################################################
+def get_segments_for_delete(sdos_frontend, args, myUrl, reqHead, get_url):
+    """
+    the segments of an SLO are deleted together with the manifest; their keys are deleted afterwards
+    """
+    if (sdos_frontend and args.get(largeObjects.MANIFEST_ARG) == "delete"):
+        return largeObjects.get_segments_for_delete(myUrl, reqHead, get_url)
+    return []
+
+
+def delete_keys(s, sdos_frontend, thisObject, segments, get_frontend):
+    """
+    delete the keys once swift deleted the object
+    :param s: status of the swift DELETE
+    """
+    if (s == 200 and segments):
+        # SLO manifest and segments were deleted. the manifest itself is not encrypted and has no key
+        largeObjects.delete_segment_keys(segments, get_frontend)
+    elif (s == 204 and sdos_frontend):
+        # manifests and other objects without a key are ignored
+        sdos_frontend.deleteObject(thisObject)
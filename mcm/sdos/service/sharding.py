@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+	cascade_mode "sharded": the proxy runs as sharded_workers processes that all accept client requests on the
+	public port (SO_REUSEPORT). Each (tenant, container) is owned by exactly one of them, chosen by consistent
+	hashing; only the owner creates the containers frontend/cascade. Requests for a container that reach
+	another process are forwarded to the owner on its internal port, together with a secret that the launcher
+	creates for each run. Each process is a gunicorn server with a single worker, configured by config_gunicorn.py.
+	With consistent hashing, changing the number of workers only moves a small part of the containers
+
+"""
+
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import urllib.parse
+from multiprocessing import Process
+
+from mcm.sdos import configuration
+from mcm.sdos.service import httpBackend, pseudoContainer
+from mcm.sdos.service.Exceptions import HttpError
+
+# set on forwarded requests; its value is the index of the forwarding process
+FORWARDED_HEADER = "X-SDOS-Forwarded-Shard"
+# set on internal container DELETE requests that only delete the keys of objects that are already gone in swift.
+# the body is a json list of the object names
+KEY_DELETE_HEADER = "X-SDOS-Delete-Key-Only"
+# set on all requests from another process; its value is the secret of this launch. other local processes
+# can reach the internal ports as well, but they can't pass their requests off as internal ones
+SECRET_HEADER = "X-SDOS-Shard-Secret"
+FORWARDED_ENVIRON = "HTTP_" + FORWARDED_HEADER.upper().replace("-", "_")
+SECRET_ENVIRON = "HTTP_" + SECRET_HEADER.upper().replace("-", "_")
+INTERNAL_ENVIRON = "sdos.internal_request"
+
+__shard = None
+__secret = None
+__ring = None
+
+
+##############################################################################
+# consistent hashing
+##############################################################################
+class HashRing(object):
+    """
+        each node is placed on the ring at many points (replicas), a key belongs to the next node on the ring
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self.points = sorted((self.__hash("{}-{}".format(node, i)), node) for node in nodes for i in range(replicas))
+        self.hashes = [p[0] for p in self.points]
+
+    @staticmethod
+    def __hash(s):
+        return int.from_bytes(hashlib.md5(s.encode("utf-8")).digest()[:8], "big")
+
+    def get_node(self, key):
+        i = bisect.bisect(self.hashes, self.__hash(key)) % len(self.hashes)
+        return self.points[i][1]
+
+
+def get_ring():
+    global __ring
+    if not __ring:
+        __ring = HashRing(range(configuration.sharded_workers))
+    return __ring
+
+
+def get_owner(swiftTenant, container):
+    return get_ring().get_node("{}/{}".format(swiftTenant, container))
+
+
+def get_internal_port(shard):
+    return configuration.sharded_internal_port_base + shard
+
+
+def get_internal_url(shard):
+    return "http://127.0.0.1:{}".format(get_internal_port(shard))
+
+
+##############################################################################
+# routing
+##############################################################################
+def get_forward_target(view_args, environ, headers):
+    """
+    find the process that has to handle this request
+    :param view_args: the url parameters of the request
+    :param environ: wsgi environment
+    :param headers: request headers
+    :return: the shard index to forward to, or None to handle the request in this process
+    """
+    if __shard is None:
+        return None
+    swiftTenant = (view_args or {}).get("thisAuth")
+    container = (view_args or {}).get("thisContainer")
+    if not container or container == pseudoContainer.PSEUDO_CONTAINER_NAME:
+        return None
+    if is_internal_request(environ):
+        # forwarded to us, we are the owner
+        return None
+    if FORWARDED_HEADER in headers:
+        raise HttpError("request forwarding loop detected", 508)
+    owner = get_owner(swiftTenant, container)
+    if owner == __shard:
+        return None
+    logging.debug("forwarding request for {}/{} to shard {}".format(swiftTenant, container, owner))
+    return owner
+
+
+def add_forwarded_header(headers):
+    h = dict((k, v) for k, v in dict(headers).items() if k.lower() != KEY_DELETE_HEADER.lower())
+    h[FORWARDED_HEADER] = str(__shard)
+    h.update(get_internal_headers())
+    return h
+
+
+def get_internal_headers():
+    return {SECRET_HEADER: __secret}
+
+
+def check_internal_request(environ):
+    """
+    a request from another process arrives on our internal port and carries the secret of this launch.
+    the secret is removed from the request, so that it isn't passed on to swift. The forwarded header of an internal
+    request is removed as well; otherwise our requests for large object segments would carry it to their owners
+    :param environ: wsgi environment
+    :return:
+    """
+    secret = environ.pop(SECRET_ENVIRON, "")
+    environ[INTERNAL_ENVIRON] = (__shard is not None and int(environ["SERVER_PORT"]) == get_internal_port(__shard)
+                                 and hmac.compare_digest(secret.encode("utf-8"), __secret.encode("utf-8")))
+    if environ[INTERNAL_ENVIRON]:
+        environ.pop(FORWARDED_ENVIRON, None)
+
+
+def internal_requests(app):
+    """
+    wsgi middleware of the shard processes, see check_internal_request
+    :param app:
+    :return:
+    """
+
+    def check(environ, start_response):
+        check_internal_request(environ)
+        return app(environ, start_response)
+
+    return check
+
+
+def is_internal_request(environ):
+    return environ.get(INTERNAL_ENVIRON, False)
+
+
+def is_key_delete(environ, headers):
+    """
+    only other shards may request this, see check_internal_request
+    """
+    return is_internal_request(environ) and KEY_DELETE_HEADER in headers
+
+
+##############################################################################
+# large object segments
+##############################################################################
+def get_remote_owner(swiftTenant, container):
+    """
+    the segments of a large object may be in a container that another process owns
+    :return: the shard index of the owner, or None if this process uses the containers cascade
+    """
+    if __shard is None:
+        return None
+    owner = get_owner(swiftTenant, container)
+    return None if owner == __shard else owner
+
+
+def get_internal_object_url(shard, swiftTenant, container, obj=None):
+    path = "/v1/AUTH_{}/{}".format(swiftTenant, container)
+    if obj:
+        path += "/" + obj
+    return get_internal_url(shard) + urllib.parse.quote(path)
+
+
+class ShardFrontend(object):
+    """
+    stands in for the frontend of a segment container that another process owns. Only the owner may use the
+    containers cascade, so segments are read through the owner (get_internal_object_url), which returns them
+    decrypted, and their keys are deleted by the owner
+    """
+
+    def __init__(self, shard, swiftTenant, container, swiftToken):
+        self.shard = shard
+        self.swiftTenant = swiftTenant
+        self.containerName = container
+        self.swiftToken = swiftToken
+
+    def decrypt_stream(self, chunks, name):
+        # decrypted by the owner
+        return chunks
+
+    def deleteObjects(self, names):
+        reqHead = {"X-Auth-Token": self.swiftToken, KEY_DELETE_HEADER: "true", "Content-Type": "application/json"}
+        reqHead.update(get_internal_headers())
+        s, h, b = httpBackend.doGenericRequest(method="DELETE",
+                                               reqUrl=get_internal_object_url(self.shard, self.swiftTenant,
+                                                                              self.containerName),
+                                               reqHead=reqHead, reqArgs={},
+                                               reqData=json.dumps(list(names)).encode("utf-8"))
+        if s != 204:
+            raise HttpError("deleting the keys of {} objects in {} on shard {} failed: {}".format(
+                len(names), self.containerName, self.shard, b), s)
+
+
+##############################################################################
+# launcher
+##############################################################################
+def serve_shard(shard, secret):
+    """
+    run one shard: a gunicorn server with a single worker, which owns the shards cascades. It listens on the
+    public port, which is shared with all other shards (SO_REUSEPORT), and on its internal port, which receives
+    the requests for the containers we own from the other shards. The other settings are taken from
+    config_gunicorn.py
+    :param shard: index of this shard
+    :param secret: of this launch, see SECRET_HEADER
+    :return:
+    """
+    global __shard, __secret
+    __shard = shard
+    __secret = secret
+    from gunicorn.app.base import BaseApplication
+    import config_gunicorn
+
+    class ShardServer(BaseApplication):
+
+        def load_config(self):
+            for k, v in vars(config_gunicorn).items():
+                if k in self.cfg.settings:
+                    self.cfg.set(k, v)
+            self.cfg.set("bind", ["{}:{}".format(configuration.my_bind_host, configuration.my_endpoint_port),
+                                  "127.0.0.1:{}".format(get_internal_port(shard))])
+            self.cfg.set("reuse_port", True)
+            self.cfg.set("workers", 1)
+            self.cfg.set("proc_name", "sdos-shard-{}".format(shard))
+            if "control_socket" in self.cfg.settings:
+                # gunicorn 25.1+; each shard has its own
+                self.cfg.set("control_socket", "{}.{}".format(self.cfg.control_socket, shard))
+
+        def load(self):
+            # imported in the worker, after gunicorn set it up
+            from mcm.sdos.service import app
+            return internal_requests(app)
+
+    logging.warning("shard {} serving on port {}, internal port {}".format(shard, configuration.my_endpoint_port,
+                                                                           get_internal_port(shard)))
+    ShardServer().run()
+
+
+def run():
+    """
+    start sharded_workers processes and wait for them
+    :return:
+    """
+    if configuration.cascade_mode != "sharded":
+        raise SystemExit("the sharded server requires cascade_mode = \"sharded\"")
+    secret = secrets.token_hex(32)
+    workers = [Process(target=serve_shard, args=(shard, secret), name="sdos-shard-{}".format(shard))
+               for shard in range(configuration.sharded_workers)]
+    for p in workers:
+        p.start()
+
+    def stop(signum, frame):
+        for p in workers:
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for p in workers:
+        p.join()
+    logging.warning("all shards stopped, pid {}".format(os.getpid()))
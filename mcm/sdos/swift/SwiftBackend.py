@@ -13,9 +13,11 @@
 """
 
 import logging
+import threading
 import swiftclient
 import io
 from mcm.sdos import configuration
+from mcm.sdos.core import SlotPlacement
 
 
 class SwiftBackend(object):
@@ -28,10 +30,14 @@ class SwiftBackend(object):
         we take either an existing authentication, or create a new one.
         in SDOS-service mode, tenant/token are used since AUTH is already handled by the client.
         user/key are only used for tests
+
+        the backend is shared between threads (requests, cascade flushers, re-key pool). swiftclient connections
+        are not thread safe, so each thread gets its own connection with the same parameters
         """
         self.log = logging.getLogger(__name__)
         self.log.debug('initializing...')
-        self.swiftC = None
+        self.connection_args = None
+        self.__local = threading.local()
 
         if tenant and token:
             self.set_existing_authentication(tenant=tenant, token=token)
@@ -43,23 +49,33 @@ class SwiftBackend(object):
     ###############################################################################
 
     def set_existing_authentication(self, tenant, token):
-        self.swiftC = swiftclient.client.Connection(preauthtoken=token,
-                                                    preauthurl=configuration.swift_store_url.format(tenant),
-                                                    retries=5,
-                                                    timeout=10,
-                                                    insecure='true')
+        self.connection_args = dict(preauthtoken=token,
+                                    preauthurl=configuration.swift_store_url.format(tenant),
+                                    retries=5,
+                                    timeout=10,
+                                    insecure='true')
 
     def authenticate(self, user, key):
         self.log.debug('establishing NEW connection')
-        self.swiftC = swiftclient.client.Connection(authurl=configuration.swift_auth_url,
-                                                    user=user,
-                                                    key=key,
-                                                    retries=5,
-                                                    timeout=10,
-                                                    insecure='true')
+        self.connection_args = dict(authurl=configuration.swift_auth_url,
+                                    user=user,
+                                    key=key,
+                                    retries=5,
+                                    timeout=10,
+                                    insecure='true')
+
+    @property
+    def swiftC(self):
+        if not self.connection_args:
+            return None
+        try:
+            return self.__local.swiftC
+        except AttributeError:
+            self.__local.swiftC = swiftclient.client.Connection(**self.connection_args)
+            return self.__local.swiftC
 
     def _assertConnection(self):
-        if not self.swiftC: raise AttributeError(
+        if not self.connection_args: raise AttributeError(
             'no swift connection object present. Maybe the swift backend was not properly initialized.')
 
     ###############################################################################
@@ -101,6 +117,29 @@ class SwiftBackend(object):
         except swiftclient.exceptions.ClientException:
             self.swiftC.put_container(container=container, headers={})
 
+    def __get_int_property(self, t, name, default):
+        """
+        the runtime properties are set by clients; an invalid value must not break every request to the container
+        :param t: container headers
+        :return: the int value, or the default if it is missing or invalid
+        """
+        v = t.get(name, default)
+        try:
+            return int(v)
+        except (TypeError, ValueError):
+            self.log.warning("invalid container property {}: {}; using the default {}".format(name, v, default))
+            return default
+
+    def __get_slot_placement(self, t):
+        """
+        :return: the slot placement policy, None (the default policy) if it is missing or unknown
+        """
+        v = t.get("x-container-meta-sdosslotplacement", None)
+        if v and v not in SlotPlacement.PLACEMENT_POLICIES:
+            self.log.warning("unknown slot placement policy: {}; using the default".format(v))
+            return None
+        return v
+
     def is_sdos_container(self, containerName):
         return bool(self.get_sdos_properties(containerName)["sdos_type"])
 
@@ -128,5 +167,11 @@ class SwiftBackend(object):
             "sdosheight": int(t.get("x-container-meta-sdosheight", 0)),
             "sdosmasterkey": t.get("x-container-meta-sdosmasterkey", 0),
             "sdosbatchdelete": t.get("x-container-meta-sdosbatchdelete", False) == "True",
-            "sdostpmkeyid": int(t.get("x-container-meta-sdostpmkeyid", -1))
+            "sdostpmkeyid": int(t.get("x-container-meta-sdostpmkeyid", -1)),
+            "sdosrekeyworkers": self.__get_int_property(t, "x-container-meta-sdosrekeyworkers", 1),
+            "sdosslotplacement": self.__get_slot_placement(t),
+            "sdosobjectkeycachesize": self.__get_int_property(t, "x-container-meta-sdosobjectkeycachesize",
+                                                              configuration.object_key_cache_size),
+            "sdospartitioncachesize": self.__get_int_property(t, "x-container-meta-sdospartitioncachesize",
+                                                              configuration.partition_cache_size)
         }
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+	Project MCM - Micro Content Management
+	SDOS - Secure Delete Object Store
+
+
+	Copyright (C) <2017> Tim Waizenegger, <University of Stuttgart>
+
+	This software may be modified and distributed under the terms
+	of the MIT license.  See the LICENSE file for details.
+
+
+	Measures the encryption throughput (MB/s) of the available crypto backends for object sizes from 1 kB to 1 GB
+	usage: python -m mcm.sdos.tester.CryptoBenchmark [max size in bytes]
+"""
+
+import logging
+import sys
+
+from mcm.sdos import configuration
+from mcm.sdos.crypto import CryptoBackend
+
+logging.basicConfig(level=configuration.log_level)
+log = logging.getLogger()
+
+SIZES = [1 << 10, 16 << 10, 256 << 10, 1 << 20, 16 << 20, 256 << 20, 1 << 30]
+MODES = ["cbc", "ctr"]
+MIN_SECONDS = 1.0
+
+
+###############################################################################
+###############################################################################
+
+def formatSize(size):
+	for unit in ["B", "kB", "MB", "GB"]:
+		if size < 1024:
+			return "{}{}".format(size, unit)
+		size //= 1024
+	return "{}TB".format(size)
+
+
+def runBenchmark(maxSize):
+	backends = CryptoBackend.getAvailableBackends()
+	sizes = [s for s in SIZES if s <= maxSize]
+	print("{:>8} {:>6} ".format("size", "mode") + " ".join("{:>12}".format(b.name) for b in backends))
+	for size in sizes:
+		for mode in MODES:
+			results = [CryptoBackend.benchmarkBackend(b, size=size, mode=mode, minSeconds=MIN_SECONDS) for b in backends]
+			print("{:>8} {:>6} ".format(formatSize(size), mode) + " ".join("{:>12.1f}".format(r) for r in results))
+	print("selected at startup: {}".format(CryptoBackend.selectBackend().name))
+
+
+###############################################################################
+###############################################################################
+
+if __name__ == '__main__':
+	runBenchmark(int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1])
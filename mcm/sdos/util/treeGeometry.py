@@ -15,7 +15,8 @@
 import json
 import logging
 import collections
-import math
+
+import numpy as np
 
 ###############################################################################
 ###############################################################################
@@ -59,7 +60,7 @@ def reverse_slot_mapping(cascade):
     :return:
     """
     mapper = cascade.keySlotMapper
-    m = mapper.getMappingDict()
+    m = mapper.getMappingSnapshot()
     return dict((v, k) for k, v in m.items())
 
 
@@ -117,31 +118,26 @@ def sdos_slot_utilization(cascade, NUMFIELDS=10000):
                 9 all are utilized.
                 Note that these <q>blocks</q> are only used here for visualizing allocation. They don't align with key
                 partitions or anything.</p>
+    the blocks are counted with numpy from the used slots; the cost doesn't depend on the size of the cascade
     :param cascade:
     :return:
     """
-    reverse = reverse_slot_mapping(cascade)
-    s = ""
     MAXVAL = 9
-    groupSize = math.floor((
-                               cascade.cascadeProperties.LAST_OBJCT_KEY_SLOT - cascade.cascadeProperties.FIRST_OBJECT_KEY_SLOT + 1) / NUMFIELDS)
-    remainder = (
-                    cascade.cascadeProperties.LAST_OBJCT_KEY_SLOT - cascade.cascadeProperties.FIRST_OBJECT_KEY_SLOT + 1) - groupSize * NUMFIELDS
-    currentPos = 0
-    foundInGroup = 0
+    numSlots = cascade.cascadeProperties.LAST_OBJCT_KEY_SLOT - cascade.cascadeProperties.FIRST_OBJECT_KEY_SLOT + 1
+    groupSize = numSlots // NUMFIELDS
+    remainder = numSlots - groupSize * NUMFIELDS
     if groupSize == 0:
         e = "Error: block size must be smaller than number of keys, i.e. smaller than {}".format(cascade.cascadeProperties.NUMBER_OF_SLOTS_IN_OBJECT_KEY_PARTITIONS)
         logging.info(e)
         return json.dumps({"groupSize": 0, "blocks": NUMFIELDS, "alloc": e})
 
-    for slot in range(cascade.cascadeProperties.FIRST_OBJECT_KEY_SLOT, cascade.cascadeProperties.LAST_OBJCT_KEY_SLOT):
-        if currentPos == groupSize:
-            s += str(math.ceil((MAXVAL / groupSize) * foundInGroup))
-            currentPos = 0
-            foundInGroup = 0
-        if slot in reverse:
-            foundInGroup += 1
-        currentPos += 1
+    used = np.fromiter(cascade.keySlotMapper.getUsedListSnapshot(), dtype=np.int64)
+    used -= cascade.cascadeProperties.FIRST_OBJECT_KEY_SLOT
+    # the last block collects the remainder slots
+    counts = np.bincount(np.minimum(used // groupSize, NUMFIELDS), minlength=NUMFIELDS + 1)
+    # integer ceil(MAXVAL / groupSize * count)
+    blocks = (MAXVAL * counts[:NUMFIELDS] + groupSize - 1) // groupSize
+    s = "".join(blocks.astype(str))
     if remainder:
-        s += str(math.ceil(MAXVAL / remainder * foundInGroup))
+        s += str((MAXVAL * int(counts[NUMFIELDS]) + remainder - 1) // remainder)
     return json.dumps({"groupSize": groupSize, "blocks": NUMFIELDS, "alloc": s})
@@ -0,0 +1,120 @@
+from unittest import mock
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase, TestServer
+from mcm.sdos import configuration
+from mcm.sdos.core.Frontend import ObjectCryptFrontend
+from mcm.sdos.crypto import CryptoLib, DataCrypt
+from mcm.sdos.service import asyncServer, requestHandling
+import os, re
+
+
+class FixedKeyFrontend(ObjectCryptFrontend):
+	def __init__(self):
+		self.key = CryptoLib.generateRandomKey()
+		self.deleted = []
+
+	def get_key_for_new_object(self, name, headers=None):
+		return self.key
+
+	def get_key_for_stored_object(self, name):
+		return self.key
+
+	def deleteObject(self, name):
+		self.deleted.append(name)
+
+
+class FakeSwift(object):
+	"""
+	stores object data by path and serves single byte ranges
+	"""
+
+	def __init__(self):
+		self.objects = dict()
+		self.app = web.Application()
+		self.app.router.add_route("*", "/{path:.+}", self.handle)
+
+	async def handle(self, request):
+		if request.method == "PUT":
+			self.objects[request.path] = await request.read()
+			return web.Response(status=201)
+		if request.path not in self.objects:
+			return web.Response(status=404)
+		if request.method == "DELETE":
+			del self.objects[request.path]
+			return web.Response(status=204)
+		data = self.objects[request.path]
+		m = re.match(r"bytes=(\d+)-(\d+)", request.headers.get("Range", ""))
+		if not m:
+			return web.Response(body=data, headers={"Etag": "x"})
+		first, last = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+		return web.Response(body=data[first:last + 1], status=206,
+							headers={"Content-Range": "bytes {}-{}/{}".format(first, last, len(data))})
+
+
+class TestAsyncServer(AioHTTPTestCase):
+	"""
+	objects in container c are encrypted by the proxy, the other containers are passed through
+	"""
+
+	async def get_application(self):
+		return asyncServer.make_app()
+
+	async def asyncSetUp(self):
+		self.swift = FakeSwift()
+		self.swiftServer = TestServer(self.swift.app)
+		await self.swiftServer.start_server()
+		self.url = configuration.swift_store_url
+		configuration.swift_store_url = str(self.swiftServer.make_url("/v1/AUTH_")) + "{}"
+		self.frontend = FixedKeyFrontend()
+		patcher = mock.patch.object(requestHandling, "get_sdos_frontend",
+									lambda containerName, **kw: self.frontend if containerName == "c" else False)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		await super().asyncSetUp()
+
+	async def asyncTearDown(self):
+		await super().asyncTearDown()
+		await self.swiftServer.close()
+		configuration.swift_store_url = self.url
+
+	async def request(self, method, path, data=None, **headers):
+		headers["X-Auth-Token"] = "t"
+		r = await self.client.request(method, path, data=data, headers=headers)
+		return r.status, r.headers, await r.read()
+
+	async def test_put_get_range_delete(self):
+		plaintext = os.urandom(100000)
+		s, h, b = await self.request("PUT", "/v1/AUTH_t/c/o", plaintext)
+		self.assertEqual(s, 201)
+		stored = self.swift.objects["/v1/AUTH_t/c/o"]
+		self.assertTrue(DataCrypt.isRangeReadable(stored))
+		self.assertNotIn(plaintext[:100], stored)
+
+		s, h, b = await self.request("GET", "/v1/AUTH_t/c/o")
+		self.assertEqual(s, 200)
+		self.assertEqual(b, plaintext)
+		self.assertNotIn("Etag", h)
+
+		s, h, b = await self.request("GET", "/v1/AUTH_t/c/o", Range="bytes=5-70000")
+		self.assertEqual(s, 206)
+		self.assertEqual(b, plaintext[5:70001])
+		self.assertEqual(h["Content-Range"], "bytes 5-70000/100000")
+		s, h, b = await self.request("GET", "/v1/AUTH_t/c/o", Range="bytes=-7")
+		self.assertEqual((s, b), (206, plaintext[-7:]))
+		s, h, b = await self.request("GET", "/v1/AUTH_t/c/o", Range="bytes=100000-")
+		self.assertEqual(s, 416)
+
+		s, h, b = await self.request("DELETE", "/v1/AUTH_t/c/o")
+		self.assertEqual(s, 204)
+		self.assertEqual(self.frontend.deleted, ["o"])
+		self.assertNotIn("/v1/AUTH_t/c/o", self.swift.objects)
+
+	async def test_passthrough(self):
+		s, h, b = await self.request("PUT", "/v1/AUTH_t/plain/o", b"data")
+		self.assertEqual(s, 201)
+		self.assertEqual(self.swift.objects["/v1/AUTH_t/plain/o"], b"data")
+		s, h, b = await self.request("GET", "/v1/AUTH_t/plain/o")
+		self.assertEqual((s, b), (200, b"data"))
+		s, h, b = await self.request("DELETE", "/v1/AUTH_t/plain/o")
+		self.assertEqual(s, 204)
+		self.assertEqual(self.frontend.deleted, [])
@@ -0,0 +1,142 @@
+from unittest import TestCase
+from sdos.core.CascadeProperties import CascadeProperties
+from sdos.core.Mapping import FreeSlotMap, KeySlotMapper
+
+
+class MemoryMappingStore(object):
+	def __init__(self):
+		self.by = None
+
+	def writeMapping(self, by):
+		self.by = by
+
+	def readMapping(self):
+		return self.by
+
+
+class TestFreeSlotMap(TestCase):
+	"""
+	4 object key partitions with 4 slots each
+	"""
+
+	def setUp(self):
+		self.cp = CascadeProperties("test", partition_bits=2, tree_height=2)
+		self.first = self.cp.FIRST_OBJECT_KEY_SLOT
+		self.fsm = FreeSlotMap(cascadeProperties=self.cp)
+
+	def test_lowest_free_slots(self):
+		f = self.first
+		self.assertEqual(self.fsm.findFreeSlots(3), [f, f + 1, f + 2])
+		# finding doesn't allocate
+		self.assertEqual(self.fsm.findFreeSlots(1), [f])
+
+	def test_used_slots_are_skipped(self):
+		f = self.first
+		self.fsm.setUsed(f)
+		self.fsm.setUsed(f + 2)
+		self.assertEqual(self.fsm.findFreeSlots(3), [f + 1, f + 3, f + 4])
+
+	def test_free_hint(self):
+		f = self.first
+		for slot in range(f, f + 4):
+			self.fsm.setUsed(slot)
+		self.assertEqual(self.fsm.findFreeSlots(1), [f + 4])
+		self.assertEqual(self.fsm.firstFreeHint, 1)
+
+		self.fsm.setFree(f + 1)
+		self.assertEqual(self.fsm.firstFreeHint, 0)
+		self.assertEqual(self.fsm.findFreeSlots(2), [f + 1, f + 4])
+
+	def test_set_free_twice(self):
+		f = self.first
+		self.fsm.setUsed(f)
+		self.fsm.setFree(f)
+		self.fsm.setFree(f)
+		self.assertEqual(self.fsm.usedCounts, {})
+		self.assertEqual(self.fsm.findFreeSlots(1), [f])
+
+	def test_empty_partition(self):
+		f = self.first
+		self.assertEqual(self.fsm.findEmptyPartition(), 0)
+		self.fsm.setUsed(f + 1)
+		self.assertEqual(self.fsm.findEmptyPartition(), 1)
+		self.assertEqual(self.fsm.findEmptyPartition(start=3), 3)
+		self.fsm.setFree(f + 1)
+		self.assertEqual(self.fsm.findEmptyPartition(), 0)
+
+	def test_free_slots_in_partition(self):
+		f = self.first
+		self.fsm.setUsed(f + 5)
+		self.assertEqual(self.fsm.findFreeSlotsInPartition(1, 4), [f + 4, f + 6, f + 7])
+		self.assertEqual(self.fsm.findFreeSlotsInPartition(2, 2), [f + 8, f + 9])
+
+	def test_full(self):
+		for slot in range(self.first, self.cp.LAST_OBJCT_KEY_SLOT + 1):
+			self.fsm.setUsed(slot)
+		self.assertRaises(SystemError, self.fsm.findFreeSlots, 1)
+		self.assertIsNone(self.fsm.findEmptyPartition())
+
+	def test_not_enough_free_slots(self):
+		for slot in range(self.first, self.cp.LAST_OBJCT_KEY_SLOT):
+			self.fsm.setUsed(slot)
+		self.assertEqual(self.fsm.findFreeSlots(1), [self.cp.LAST_OBJCT_KEY_SLOT])
+		self.assertRaises(SystemError, self.fsm.findFreeSlots, 2)
+
+
+class TestKeySlotMapperPlacement(TestCase):
+
+	def setUp(self):
+		self.cp = CascadeProperties("test", partition_bits=2, tree_height=2)
+		self.first = self.cp.FIRST_OBJECT_KEY_SLOT
+		self.ksm = KeySlotMapper(mappingStore=MemoryMappingStore(), cascadeProperties=self.cp)
+
+	def tearDown(self):
+		self.ksm.close()
+
+	def partition(self, slot):
+		return (slot - self.first) // self.cp.PARTITION_SIZE
+
+	def test_without_group(self):
+		f = self.first
+		self.assertEqual(self.ksm.getOrCreateMapping("a"), f)
+		self.assertEqual(self.ksm.getOrCreateMapping("b"), f + 1)
+		# existing names keep their slot
+		self.assertEqual(self.ksm.getOrCreateMapping("a"), f)
+
+	def test_groups_use_their_own_partitions(self):
+		a1 = self.ksm.getOrCreateMapping("a/1", group="a")
+		b1 = self.ksm.getOrCreateMapping("b/1", group="b")
+		a2 = self.ksm.getOrCreateMapping("a/2", group="a")
+		self.assertEqual(self.partition(a1), self.partition(a2))
+		self.assertNotEqual(self.partition(a1), self.partition(b1))
+		# objects without a group take the lowest free slot, also in partitions of groups
+		self.assertEqual(self.ksm.getOrCreateMapping("x"), self.first + 2)
+
+	def test_group_continues_in_next_empty_partition(self):
+		slots = [self.ksm.getOrCreateMapping("a/{}".format(i), group="a") for i in range(6)]
+		self.assertEqual([self.partition(s) for s in slots], [0, 0, 0, 0, 1, 1])
+		b = self.ksm.getOrCreateMapping("b/1", group="b")
+		self.assertEqual(self.partition(b), 2)
+
+	def test_batch_allocation_in_group(self):
+		slots = self.ksm.getOrCreateMappings(["a/{}".format(i) for i in range(5)], group="a")
+		self.assertEqual(sorted(self.partition(s) for s in slots.values()), [0, 0, 0, 0, 1])
+		self.assertEqual(len(set(slots.values())), 5)
+
+	def test_no_empty_partition_left(self):
+		f = self.first
+		for g in range(4):
+			self.ksm.getOrCreateMapping("g{}/1".format(g), group="g{}".format(g))
+		# all partitions are used by some group; new groups fall back to the lowest free slots
+		self.assertEqual(self.ksm.getOrCreateMapping("new/1", group="new"), f + 1)
+		self.assertNotIn("new", self.ksm.groupPartitions)
+		# a group whose partition is full continues in the lowest free slots
+		self.assertEqual(self.ksm.findFreeSlots(5, group="g0"), [f + 2, f + 3, f + 5, f + 6, f + 7])
+
+	def test_reset_mapping_frees_slot(self):
+		f = self.first
+		self.ksm.getOrCreateMapping("a")
+		self.ksm.getOrCreateMapping("b")
+		self.assertEqual(self.ksm.resetMapping("a"), f)
+		self.assertFalse(self.ksm.hasMapping("a"))
+		self.assertEqual(self.ksm.getOrCreateMapping("c"), f)
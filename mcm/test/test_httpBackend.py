@@ -0,0 +1,62 @@
+from unittest import TestCase, mock
+from mcm.sdos.service import httpBackend
+
+
+class FakeRaw(object):
+	def __init__(self, chunks):
+		self.chunks = chunks
+
+	def stream(self, chunkSize, decode_content):
+		return iter(self.chunks)
+
+
+class FakeResponse(object):
+	def __init__(self, chunks):
+		self.chunks = chunks
+		self.raw = FakeRaw(chunks)
+		self.headers = {"Content-Length": "6", "Connection": "keep-alive"}
+		self.status_code = 200
+		self.closed = 0
+
+	def iter_content(self, chunk_size):
+		return iter(self.chunks)
+
+	def close(self):
+		self.closed += 1
+
+
+class TestStreamingRequest(TestCase):
+
+	def setUp(self):
+		self.r = FakeResponse([b"abc", b"def"])
+		session = mock.Mock()
+		session.request.return_value = self.r
+		patcher = mock.patch.object(httpBackend, "getSession", return_value=session)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def request(self, decodeContent=True):
+		return httpBackend.doStreamingRequest(method="GET", reqUrl="http://swift/v1/a/c/o", reqHead={},
+											  reqArgs={}, reqData=None, decodeContent=decodeContent)
+
+	def test_headers(self):
+		s, h, b = self.request()
+		self.assertEqual(s, 200)
+		self.assertEqual(h, {"Content-Length": "6"})
+
+	def test_released_after_iterating(self):
+		s, h, b = self.request()
+		self.assertEqual(list(b), [b"abc", b"def"])
+		self.assertTrue(self.r.closed)
+
+	def test_released_on_close_without_iterating(self):
+		s, h, b = self.request()
+		b.close()
+		self.assertTrue(self.r.closed)
+
+	def test_released_on_close_while_iterating(self):
+		s, h, b = self.request(decodeContent=False)
+		it = iter(b)
+		self.assertEqual(next(it), b"abc")
+		b.close()
+		self.assertTrue(self.r.closed)
@@ -0,0 +1,249 @@
+from unittest import TestCase
+from sdos.core.CascadeProperties import CascadeProperties
+from sdos.core.CascadePersistence import MemoryBackedPartitionStore
+from sdos.core.KeyCascade import Cascade
+from sdos.core.KeyPartitionCache import KeyPartitionCache
+from sdos.core.Mapping import KeySlotMapper
+from sdos.core.MasterKeySource import MasterKeyDummy
+import io, threading
+
+
+class MemoryMappingStore(object):
+	def __init__(self):
+		self.by = None
+
+	def writeMapping(self, by):
+		self.by = bytes(by.getbuffer())
+
+	def readMapping(self):
+		return io.BytesIO(self.by) if self.by else None
+
+
+class CascadeTestCase(TestCase):
+	"""
+	cascades with 4 slots per partition and 64 object key slots, with both partition cache tiers and the
+	object key cache. a cascade that is made again reads the state that the previous one stored
+	"""
+
+	def setUp(self):
+		self.setUpStores()
+		self.cascades = []
+
+	def tearDown(self):
+		for c in self.cascades:
+			c.close()
+
+	def setUpStores(self):
+		self.store = MemoryBackedPartitionStore()
+		self.store.containerNameSdosMgmt = "test_mgmt"
+		self.mappingStore = MemoryMappingStore()
+		self.masterKey = MasterKeyDummy()
+
+	def make(self, **properties):
+		cp = CascadeProperties("test", partition_bits=2, tree_height=3, **properties)
+		c = Cascade(partitionStore=KeyPartitionCache(partitionStore=self.store, cascadeProperties=cp),
+					keySlotMapper=KeySlotMapper(mappingStore=self.mappingStore, cascadeProperties=cp),
+					masterKeySource=self.masterKey, cascadeProperties=cp)
+		self.cascades.append(c)
+		return c
+
+	def createObjects(self, c, n):
+		names = ["o{}".format(i) for i in range(n)]
+		return dict((name, c.getKeyForNewObject(name)) for name in names)
+
+	def partitionKeys(self, partition):
+		return [partition.getKey(slot) for slot in range(partition.cascadeProperties.PARTITION_SIZE)]
+
+	def storedKeys(self, c):
+		"""
+		all keys in the stored partitions, decrypted with the current master key
+		"""
+		keys = []
+		for pid in sorted(self.store.partitions):
+			key = self.masterKey.get_current_key() if pid == 0 else c._getKeyFromCascade(pid)
+			keys.extend(self.partitionKeys(c.getPartition(pid, key)))
+		return keys
+
+	def cachedKeys(self, c):
+		keys = list(c.objectKeyCache.values())
+		for partition in c.partitionStore.plainPartitionCache.values():
+			keys.extend(self.partitionKeys(partition))
+		return keys
+
+
+class TestSecureDeleteWithCaches(CascadeTestCase):
+
+	def test_deleted_key_is_unrecoverable(self):
+		c = self.make()
+		keys = self.createObjects(c, 20)
+		# all partitions on the paths and the object keys are cached now
+		for name, key in keys.items():
+			self.assertEqual(c.getKeyForStoredObject(name), key)
+		self.assertIn(keys["o7"], self.cachedKeys(c))
+
+		c.secureDeleteObjectKey("o7")
+		self.assertRaises(KeyError, c.getKeyForStoredObject, "o7")
+		self.assertNotIn(keys["o7"], self.cachedKeys(c))
+		for name, key in keys.items():
+			if name != "o7":
+				self.assertEqual(c.getKeyForStoredObject(name), key)
+
+		c.close()
+		c = self.make()
+		self.assertRaises(KeyError, c.getKeyForStoredObject, "o7")
+		self.assertNotIn(keys["o7"], self.storedKeys(c))
+		self.assertIn(keys["o8"], self.storedKeys(c))
+
+
+class TestObjectKeyCache(CascadeTestCase):
+
+	def test_bounded(self):
+		c = self.make(object_key_cache_size=4)
+		keys = self.createObjects(c, 20)
+		for name, key in keys.items():
+			self.assertEqual(c.getKeyForStoredObject(name), key)
+		self.assertEqual(len(c.objectKeyCache), 4)
+
+	def test_disabled(self):
+		c = self.make(object_key_cache_size=0)
+		keys = self.createObjects(c, 5)
+		self.assertEqual(c.getKeyForStoredObject("o3"), keys["o3"])
+		self.assertEqual(len(c.objectKeyCache), 0)
+
+	def test_freed_slots_get_new_keys(self):
+		c = self.make()
+		keys = self.createObjects(c, 8)
+		slots = dict((name, c.keySlotMapper.getMapping(name)) for name in keys)
+
+		c.deleteObjectKey("o2")
+		c.secureDeleteObjectKey("o5")
+		self.assertRaises(KeyError, c.getKeyForStoredObject, "o2")
+		self.assertRaises(KeyError, c.getKeyForStoredObject, "o5")
+		# the new objects reuse the freed slots, but not the keys cached for them
+		a = c.getKeyForNewObject("a")
+		b = c.getKeyForNewObject("b")
+		self.assertEqual({c.keySlotMapper.getMapping("a"), c.keySlotMapper.getMapping("b")},
+						 {slots["o2"], slots["o5"]})
+		self.assertFalse({a, b} & {keys["o2"], keys["o5"]})
+		self.assertEqual(c.getKeyForStoredObject("a"), a)
+
+
+class TestConcurrentReaders(CascadeTestCase):
+
+	def test_readers_during_secure_delete(self):
+		c = self.make(rekey_workers=4)
+		keys = self.createObjects(c, 40)
+		deleted = ["o{}".format(i) for i in range(0, 40, 3)]
+		errors = []
+		done = threading.Event()
+
+		def read():
+			while not done.is_set():
+				for name, key in keys.items():
+					try:
+						k = c.getKeyForStoredObject(name)
+					except KeyError:
+						if name not in deleted:
+							errors.append("{} missing".format(name))
+						continue
+					except Exception as e:
+						errors.append(e)
+						continue
+					if k != key:
+						errors.append("{} has a wrong key".format(name))
+
+		readers = [threading.Thread(target=read) for _ in range(4)]
+		for t in readers:
+			t.start()
+		try:
+			for name in deleted[:5]:
+				c.secureDeleteObjectKey(name)
+			c.secureDeleteObjectKeyBatch(deleted[5:])
+		finally:
+			done.set()
+			for t in readers:
+				t.join()
+		self.assertEqual(errors, [])
+		for name in deleted:
+			self.assertRaises(KeyError, c.getKeyForStoredObject, name)
+
+
+class TestParallelRekey(CascadeTestCase):
+
+	def deleteAndReopen(self, rekeyWorkers):
+		"""
+		:return: the keys and slots before, and the keys read from storage after a batch secure delete
+		"""
+		self.setUpStores()
+		c = self.make(rekey_workers=rekeyWorkers)
+		keys = self.createObjects(c, 60)
+		slots = dict((name, c.keySlotMapper.getMapping(name)) for name in keys)
+		c.secureDeleteObjectKeyBatch(["o{}".format(i) for i in range(0, 60, 4)])
+		self.assertEqual(c.rekey_pool is not None, rekeyWorkers > 1)
+		c.close()
+
+		c = self.make(rekey_workers=rekeyWorkers)
+		after = dict()
+		for name in keys:
+			try:
+				after[name] = c.getKeyForStoredObject(name)
+			except KeyError:
+				pass
+		return keys, slots, after
+
+	def test_same_result_as_serial(self):
+		serialKeys, serialSlots, serialAfter = self.deleteAndReopen(1)
+		parallelKeys, parallelSlots, parallelAfter = self.deleteAndReopen(4)
+		self.assertEqual(serialSlots, parallelSlots)
+		self.assertEqual(sorted(serialAfter), sorted(parallelAfter))
+		self.assertEqual(len(parallelAfter), 45)
+		for name in parallelAfter:
+			self.assertEqual(serialAfter[name], serialKeys[name])
+			self.assertEqual(parallelAfter[name], parallelKeys[name])
+
+
+class TestBatchRetrieval(CascadeTestCase):
+
+	def test_same_keys_as_single_lookups(self):
+		c = self.make(object_key_cache_size=0)
+		keys = self.createObjects(c, 30)
+		self.assertEqual(c.getKeysForStoredObjects(keys.keys()), keys)
+		self.assertEqual(c.getKeysForStoredObjects(["o3", "o17"]),
+						 {"o3": c.getKeyForStoredObject("o3"), "o17": c.getKeyForStoredObject("o17")})
+
+	def test_partly_cached(self):
+		c = self.make()
+		keys = self.createObjects(c, 30)
+		c.objectKeyCache.clear()
+		c.getKeyForStoredObject("o4")
+		self.assertEqual(c.getKeysForStoredObjects(keys.keys()), keys)
+
+	def test_unknown_object(self):
+		c = self.make()
+		self.createObjects(c, 3)
+		self.assertRaises(KeyError, c.getKeysForStoredObjects, ["o1", "nope"])
+
+
+class TestBatchAllocation(CascadeTestCase):
+
+	def test_same_keys_as_single_lookups(self):
+		c = self.make()
+		existing = c.getKeyForNewObject("x")
+		names = ["n{}".format(i) for i in range(10)]
+		keys = c.getKeysForNewObjects(names + ["x"])
+		self.assertEqual(keys["x"], existing)
+		self.assertEqual(len(set(keys.values())), 11)
+		for name in names:
+			self.assertEqual(c.getKeyForNewObject(name), keys[name])
+		c.close()
+
+		c = self.make()
+		self.assertEqual(c.getKeysForStoredObjects(keys.keys()), keys)
+
+	def test_packed_into_few_partitions(self):
+		c = self.make()
+		keys = c.getKeysForNewObjects(["n{}".format(i) for i in range(10)])
+		cp = c.cascadeProperties
+		partitions = set((c.keySlotMapper.getMapping(name) - cp.FIRST_OBJECT_KEY_SLOT) // cp.PARTITION_SIZE
+						 for name in keys)
+		self.assertEqual(len(partitions), 3)
@@ -0,0 +1,105 @@
+from unittest import TestCase
+from sdos.core.CascadeProperties import CascadeProperties
+from sdos.core.KeyPartition import KeyPartition
+import io, os
+
+
+class TestKeyPartition(TestCase):
+	"""
+	partitions with 256 slots; up to 32 keys are kept sparse
+	"""
+
+	def setUp(self):
+		self.cp = CascadeProperties("test", partition_bits=8, tree_height=3)
+		self.denseLength = self.cp.BYTES_FOR_PARTITION_IDs + KeyPartition.KEY_SIZE * self.cp.PARTITION_SIZE
+
+	def partition(self, slots):
+		p = KeyPartition(partitionId=7, cascadeProperties=self.cp)
+		keys = dict((slot, os.urandom(KeyPartition.KEY_SIZE)) for slot in slots)
+		for slot, key in keys.items():
+			p.setKey(slot, key)
+		return p, keys
+
+	def roundtrip(self, p):
+		by = p.serializeToBytesIO()
+		q = KeyPartition(partitionId=0, cascadeProperties=self.cp)
+		q.deserializeFromBytesIO(io.BytesIO(by.getvalue()))
+		return by.getvalue(), q
+
+	def assertKeys(self, p, keys):
+		for slot in range(self.cp.PARTITION_SIZE):
+			self.assertEqual(p.getKey(slot), keys.get(slot, None))
+
+	def test_sparse_roundtrip(self):
+		p, keys = self.partition([0, 5, 200, 255])
+		self.assertTrue(p.isSparse())
+		by, q = self.roundtrip(p)
+		self.assertLess(len(by), self.denseLength)
+		self.assertEqual(q.getId(), 7)
+		self.assertTrue(q.isSparse())
+		self.assertKeys(q, keys)
+
+	def test_empty_roundtrip(self):
+		p, keys = self.partition([])
+		by, q = self.roundtrip(p)
+		self.assertTrue(q.isSparse())
+		self.assertKeys(q, keys)
+
+	def test_dense_roundtrip(self):
+		p, keys = self.partition(range(256))
+		self.assertFalse(p.isSparse())
+		by, q = self.roundtrip(p)
+		self.assertEqual(len(by), self.denseLength)
+		self.assertFalse(q.isSparse())
+		self.assertKeys(q, keys)
+
+	def test_half_full_roundtrip(self):
+		# the sparse format is shorter, but the partition is dense in memory
+		p, keys = self.partition(range(0, 256, 2))
+		self.assertFalse(p.isSparse())
+		by, q = self.roundtrip(p)
+		self.assertLess(len(by), self.denseLength)
+		self.assertFalse(q.isSparse())
+		self.assertKeys(q, keys)
+
+	def test_dense_with_few_keys_becomes_sparse(self):
+		p, keys = self.partition(range(40))
+		for slot in range(3, 40):
+			p.resetKey(slot)
+			keys.pop(slot)
+		self.assertFalse(p.isSparse())
+		by, q = self.roundtrip(p)
+		self.assertTrue(q.isSparse())
+		self.assertKeys(q, keys)
+
+	def test_serialize_has_no_side_effects(self):
+		p, keys = self.partition([1, 2, 3])
+		first = p.serializeToBytesIO().getvalue()
+		self.assertTrue(p.isSparse())
+		self.assertEqual(p.serializeToBytesIO().getvalue(), first)
+		self.assertKeys(p, keys)
+
+	def test_serialize_sparse_as_dense(self):
+		# a sparse partition that is not shorter in the sparse format is written dense; it stays sparse
+		p = KeyPartition(partitionId=7, cascadeProperties=self.cp)
+		keys = dict((slot, os.urandom(KeyPartition.KEY_SIZE)) for slot in range(self.cp.PARTITION_SIZE))
+		p.sparseKeys = dict(keys)
+		by, q = self.roundtrip(p)
+		self.assertEqual(len(by), self.denseLength)
+		self.assertTrue(p.isSparse())
+		self.assertKeys(p, keys)
+		self.assertKeys(q, keys)
+
+	def test_reset_and_copy(self):
+		p, keys = self.partition([10, 20])
+		c = p.copy()
+		p.resetKey(10)
+		self.assertIsNone(p.getKey(10))
+		self.assertEqual(c.getKey(10), keys[10])
+
+	def test_unknown_format(self):
+		p, keys = self.partition([1])
+		by = bytearray(p.serializeToBytesIO().getvalue())
+		by[self.cp.BYTES_FOR_PARTITION_IDs] = 99
+		q = KeyPartition(partitionId=0, cascadeProperties=self.cp)
+		self.assertRaises(TypeError, q.deserializeFromBytesIO, io.BytesIO(bytes(by)))
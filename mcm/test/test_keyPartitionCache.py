@@ -0,0 +1,51 @@
+from unittest import TestCase
+from sdos.core.CascadeProperties import CascadeProperties
+from sdos.core.CascadePersistence import MemoryBackedPartitionStore
+from sdos.core.KeyCascade import Cascade
+from sdos.core.KeyPartitionCache import KeyPartitionCache
+from sdos.core.Mapping import KeySlotMapper
+from sdos.core.MasterKeySource import MasterKeyDummy
+import io
+
+
+class MemoryMappingStore(object):
+	def __init__(self):
+		self.by = None
+
+	def writeMapping(self, by):
+		self.by = bytes(by.getbuffer())
+
+	def readMapping(self):
+		return io.BytesIO(self.by) if self.by else None
+
+
+class TestKeyPartitionCacheBound(TestCase):
+	"""
+	two-level cascade: the root and 16 object key partitions with 16 slots each
+	"""
+
+	def setUp(self):
+		self.cp = CascadeProperties("test", partition_bits=4, tree_height=2, partition_cache_size=4096)
+		self.store = MemoryBackedPartitionStore()
+		self.store.containerNameSdosMgmt = "test_mgmt"
+		self.cache = KeyPartitionCache(partitionStore=self.store, cascadeProperties=self.cp)
+		self.cascade = Cascade(partitionStore=self.cache,
+							   keySlotMapper=KeySlotMapper(mappingStore=MemoryMappingStore(), cascadeProperties=self.cp),
+							   masterKeySource=MasterKeyDummy(), cascadeProperties=self.cp)
+
+	def tearDown(self):
+		self.cascade.close()
+
+	def test_first_level_is_evicted_after_flush(self):
+		names = ["o{}".format(i) for i in range(200)]
+		keys = self.cascade.getKeysForNewObjects(names)
+		# all partitions are dirty and stay until they are flushed
+		before = self.cache.getMemoryUsage()
+		self.assertGreater(before, self.cp.partition_cache_size)
+
+		self.cache.flush()
+		self.assertLess(self.cache.getMemoryUsage(), before)
+		self.assertLessEqual(self.cache.getMemoryUsage(), self.cp.partition_cache_size)
+		# evicted partitions are read from the store again
+		self.assertEqual(self.cascade.getKeysForStoredObjects(names), keys)
+		self.assertLessEqual(self.cache.getMemoryUsage(), self.cp.partition_cache_size)
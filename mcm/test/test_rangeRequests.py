@@ -0,0 +1,75 @@
+from unittest import TestCase
+from mcm.sdos.crypto import DataCrypt, CryptoLib
+from mcm.sdos.service.requestHandling import parse_byte_range, resolve_byte_range
+import io, os
+
+
+def chunked(data, size):
+	return (data[i:i + size] for i in range(0, len(data), size))
+
+
+class TestRangeDecryption(TestCase):
+
+	def setUp(self):
+		self.key = CryptoLib.generateRandomKey()
+		self.dc = DataCrypt.DataCrypt(self.key)
+		self.plaintext = os.urandom(100000)
+		self.ciphertext = b"".join(self.dc.encryptStream(chunked(self.plaintext, 7000)))
+		self.head = self.ciphertext[:DataCrypt.HEADER_LENGTH_V2]
+
+	def decrypt_range(self, first, last, chunkSize=1000):
+		start = DataCrypt.HEADER_LENGTH_V2 + first
+		chunks = chunked(self.ciphertext[start:DataCrypt.HEADER_LENGTH_V2 + last + 1], chunkSize)
+		return b"".join(self.dc.decryptRangeStream(self.head, chunks, first))
+
+	def test_range_readable(self):
+		self.assertTrue(DataCrypt.isRangeReadable(self.head))
+		self.assertFalse(DataCrypt.isRangeReadable(self.head[:DataCrypt.HEADER_LENGTH_V2 - 1]))
+		v1 = CryptoLib.CryptoLib(self.key, DataCrypt.HEADER).encryptBytesIO(io.BytesIO(b"data")).getvalue()
+		self.assertFalse(DataCrypt.isRangeReadable(v1))
+
+	def test_full_stream(self):
+		self.assertEqual(b"".join(self.dc.decryptStream(chunked(self.ciphertext, 3333))), self.plaintext)
+
+	def test_ranges(self):
+		# aligned and unaligned to the AES block size, single bytes, the end of the object
+		for first, last in [(0, 0), (0, 15), (15, 16), (17, 4095), (12345, 54321), (99999, 99999), (0, 99999)]:
+			self.assertEqual(self.decrypt_range(first, last), self.plaintext[first:last + 1], (first, last))
+
+	def test_odd_chunk_sizes(self):
+		for chunkSize in [1, 7, 16, 17, 65536]:
+			self.assertEqual(self.decrypt_range(1001, 30000, chunkSize), self.plaintext[1001:30001], chunkSize)
+
+	def test_wrong_key(self):
+		other = DataCrypt.DataCrypt(CryptoLib.generateRandomKey())
+		chunks = chunked(self.ciphertext[DataCrypt.HEADER_LENGTH_V2 + 100:DataCrypt.HEADER_LENGTH_V2 + 200], 50)
+		try:
+			decrypted = b"".join(other.decryptRangeStream(self.head, chunks, 100))
+		except Exception:
+			return
+		self.assertNotEqual(decrypted, self.plaintext[100:200])
+
+
+class TestByteRange(TestCase):
+
+	def test_parse(self):
+		self.assertEqual(parse_byte_range("bytes=0-99"), (0, 99))
+		self.assertEqual(parse_byte_range("bytes=100-"), (100, None))
+		self.assertEqual(parse_byte_range("bytes=-100"), (None, 100))
+		self.assertEqual(parse_byte_range("bytes= 5-5"), (5, 5))
+
+	def test_parse_unsupported(self):
+		for h in [None, "", "items=0-1", "bytes=0-1,5-6", "bytes=-", "bytes=5", "bytes=a-b", "bytes=9-1"]:
+			self.assertIsNone(parse_byte_range(h), h)
+
+	def test_resolve(self):
+		self.assertEqual(resolve_byte_range((0, 99), 1000), (0, 99))
+		self.assertEqual(resolve_byte_range((100, None), 1000), (100, 999))
+		self.assertEqual(resolve_byte_range((None, 100), 1000), (900, 999))
+		self.assertEqual(resolve_byte_range((None, 5000), 1000), (0, 999))
+		self.assertEqual(resolve_byte_range((990, 5000), 1000), (990, 999))
+
+	def test_resolve_unsatisfiable(self):
+		self.assertIsNone(resolve_byte_range((1000, None), 1000))
+		self.assertIsNone(resolve_byte_range((0, 10), 0))
+		self.assertIsNone(resolve_byte_range((None, 10), 0))
@@ -0,0 +1,121 @@
+from unittest import TestCase
+from mcm.sdos import configuration
+from mcm.sdos.service import sharding, pseudoContainer
+from mcm.sdos.service.Exceptions import HttpError
+
+
+class TestHashRing(TestCase):
+
+	def setUp(self):
+		self.keys = ["tenant/container{}".format(i) for i in range(2000)]
+
+	def test_deterministic(self):
+		a = sharding.HashRing(range(4))
+		b = sharding.HashRing(range(4))
+		self.assertEqual([a.get_node(k) for k in self.keys], [b.get_node(k) for k in self.keys])
+
+	def test_single_node(self):
+		ring = sharding.HashRing([0])
+		self.assertEqual(set(ring.get_node(k) for k in self.keys), {0})
+
+	def test_balanced(self):
+		ring = sharding.HashRing(range(4))
+		counts = dict((n, 0) for n in range(4))
+		for k in self.keys:
+			counts[ring.get_node(k)] += 1
+		for n, c in counts.items():
+			self.assertGreater(c, len(self.keys) / 4 * 0.6, counts)
+			self.assertLess(c, len(self.keys) / 4 * 1.4, counts)
+
+	def test_adding_a_node_moves_few_keys(self):
+		before = sharding.HashRing(range(4))
+		after = sharding.HashRing(range(5))
+		moved = [k for k in self.keys if before.get_node(k) != after.get_node(k)]
+		# keys only move to the new node
+		self.assertEqual(set(after.get_node(k) for k in moved), {4})
+		self.assertLess(len(moved), len(self.keys) * 0.35)
+
+
+class TestForwardTarget(TestCase):
+
+	def setUp(self):
+		self.workers = configuration.sharded_workers
+		configuration.sharded_workers = 4
+		setattr(sharding, "__ring", None)
+		setattr(sharding, "__shard", 1)
+		setattr(sharding, "__secret", "s3cret")
+		self.owned = next(c for c in ("c{}".format(i) for i in range(100)) if sharding.get_owner("t", c) == 1)
+		self.other = next(c for c in ("c{}".format(i) for i in range(100)) if sharding.get_owner("t", c) != 1)
+
+	def tearDown(self):
+		configuration.sharded_workers = self.workers
+		setattr(sharding, "__ring", None)
+		setattr(sharding, "__shard", None)
+		setattr(sharding, "__secret", None)
+
+	def environ(self, port=8080, secret=None):
+		environ = {"SERVER_PORT": str(port)}
+		if secret:
+			environ[sharding.SECRET_ENVIRON] = secret
+		sharding.check_internal_request(environ)
+		return environ
+
+	def internal(self, secret="s3cret"):
+		return self.environ(sharding.get_internal_port(1), secret)
+
+	def target(self, container, environ=None, headers=None):
+		return sharding.get_forward_target({"thisAuth": "t", "thisContainer": container}, environ or self.environ(),
+										   headers or {})
+
+	def test_not_sharded(self):
+		setattr(sharding, "__shard", None)
+		self.assertIsNone(self.target(self.other))
+
+	def test_owned_container(self):
+		self.assertIsNone(self.target(self.owned))
+
+	def test_forward_to_owner(self):
+		self.assertEqual(self.target(self.other), sharding.get_owner("t", self.other))
+
+	def test_internal_request(self):
+		self.assertIsNone(self.target(self.other, environ=self.internal()))
+		self.assertEqual(self.target(self.other, environ=self.environ(secret="s3cret")),
+						 sharding.get_owner("t", self.other))
+
+	def test_internal_port_requires_secret(self):
+		self.assertEqual(self.target(self.other, environ=self.internal(secret=None)),
+						 sharding.get_owner("t", self.other))
+		self.assertEqual(self.target(self.other, environ=self.internal(secret="wrong")),
+						 sharding.get_owner("t", self.other))
+
+	def test_internal_headers_are_removed(self):
+		environ = {"SERVER_PORT": str(sharding.get_internal_port(1)), sharding.SECRET_ENVIRON: "s3cret",
+				   sharding.FORWARDED_ENVIRON: "2"}
+		sharding.check_internal_request(environ)
+		self.assertTrue(sharding.is_internal_request(environ))
+		self.assertNotIn(sharding.SECRET_ENVIRON, environ)
+		self.assertNotIn(sharding.FORWARDED_ENVIRON, environ)
+		self.assertEqual(sharding.add_forwarded_header({"X-Auth-Token": "x"}),
+						 {"X-Auth-Token": "x", sharding.FORWARDED_HEADER: "1", sharding.SECRET_HEADER: "s3cret"})
+
+	def test_account_and_pseudo_container(self):
+		self.assertIsNone(sharding.get_forward_target({"thisAuth": "t"}, self.environ(), {}))
+		self.assertIsNone(sharding.get_forward_target(None, self.environ(), {}))
+		self.assertIsNone(self.target(pseudoContainer.PSEUDO_CONTAINER_NAME))
+
+	def test_forwarding_loop(self):
+		with self.assertRaises(HttpError) as e:
+			self.target(self.other, headers={sharding.FORWARDED_HEADER: "2"})
+		self.assertEqual(e.exception.status_code, 508)
+
+	def test_remote_segment_owner(self):
+		self.assertIsNone(sharding.get_remote_owner("t", self.owned))
+		self.assertEqual(sharding.get_remote_owner("t", self.other), sharding.get_owner("t", self.other))
+
+	def test_key_delete_only_from_other_shards(self):
+		headers = {sharding.KEY_DELETE_HEADER: "true"}
+		self.assertFalse(sharding.is_key_delete(self.environ(), headers))
+		self.assertFalse(sharding.is_key_delete(self.internal(secret=None), headers))
+		self.assertFalse(sharding.is_key_delete(self.internal(secret="wrong"), headers))
+		self.assertTrue(sharding.is_key_delete(self.internal(), headers))
+		self.assertNotIn(sharding.KEY_DELETE_HEADER, sharding.add_forwarded_header(headers))